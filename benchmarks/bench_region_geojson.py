@@ -0,0 +1,36 @@
+"""
+Compare the GeoJSON encoding of region layers with the previous path,
+``json.loads(gdf.to_json())``, on the datasets used in glue_map/tests.
+
+Run with ``python benchmarks/bench_region_geojson.py``.
+"""
+import json
+import timeit
+
+import geopandas
+
+from glue_map.map.geojson import geodataframe_to_geojson
+
+DATASETS = ["naturalearth_lowres", "nybb"]
+
+
+def best_time(func, number=5, repeat=5):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    print(f"{'dataset':<22}{'path':<28}{'time (ms)':>10}{'payload (kB)':>14}")
+    for name in DATASETS:
+        gdf = geopandas.read_file(geopandas.datasets.get_path(name))
+        paths = {
+            "json.loads(gdf.to_json())": lambda: json.loads(gdf.to_json()),
+            "geodataframe_to_geojson": lambda: geodataframe_to_geojson(gdf),
+        }
+        for label, encode in paths.items():
+            seconds = best_time(encode)
+            payload = len(json.dumps(encode(), separators=(",", ":")))
+            print(f"{name:<22}{label:<28}{seconds * 1e3:>10.1f}{payload / 1e3:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,26 @@
 import geopandas
 from glue.config import data_translator
+from glue.core.component import Component, DaskComponent
 from glue.core.component_id import ComponentIDList
 from glue.core.data import Data
+from glue.core.decorators import clear_cache
+from glue.core.message import NumericalDataChangedMessage
 from glue.core.subset import Subset
 from glue.core.coordinates import Coordinates
 import numpy as np
+import dask.array as da
+import shapely
 import xarray as xr
 import glob
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from glue.logger import logger
 
 import warnings
 warnings.filterwarnings('ignore') # setting ignore as a parameter
@@ -14,55 +28,363 @@ warnings.filterwarnings('ignore') # setting ignore as a parameter
 __all__ = ["InvalidGeoData", "GeoRegionData", "GeoPandasTranslator"]
 
 
-def load_tempo_data(directory, quality_flag='high'):
+# Bits of the per-pixel TEMPO quality class. A pixel passes a quality level
+# when all the bits listed for that level in TEMPO_QUALITY_LEVELS are set.
+TEMPO_QUALITY_SZA = 1  # solar_zenith_angle < 80
+TEMPO_QUALITY_FLAG = 2  # main_data_quality_flag == 0
+TEMPO_QUALITY_CLOUD_MEDIUM = 4  # eff_cloud_fraction < 0.4
+TEMPO_QUALITY_CLOUD_HIGH = 8  # eff_cloud_fraction < 0.2
+
+TEMPO_QUALITY_LEVELS = {
+    'high': TEMPO_QUALITY_SZA | TEMPO_QUALITY_FLAG | TEMPO_QUALITY_CLOUD_MEDIUM | TEMPO_QUALITY_CLOUD_HIGH,
+    'medium': TEMPO_QUALITY_SZA | TEMPO_QUALITY_FLAG | TEMPO_QUALITY_CLOUD_MEDIUM,
+    'low': TEMPO_QUALITY_SZA | TEMPO_QUALITY_FLAG,
+}
+
+
+def _tempo_quality_class(product, geoloc, support):
     """
-    Read all the TEMPO datafiles from a given directory into a glue data object
+    Build the uint8 per-pixel quality class (see TEMPO_QUALITY_LEVELS)
     """
-    input_files = glob.glob(f"{directory}/TEMPO_NO2_L3_V01_*_S*.nc")
+    cloud_fraction = support['eff_cloud_fraction']
+    quality_class = (
+        (geoloc['solar_zenith_angle'] < 80).astype(np.uint8) * TEMPO_QUALITY_SZA
+        + (product['main_data_quality_flag'] == 0).astype(np.uint8) * TEMPO_QUALITY_FLAG
+        + (cloud_fraction < 0.4).astype(np.uint8) * TEMPO_QUALITY_CLOUD_MEDIUM
+        + (cloud_fraction < 0.2).astype(np.uint8) * TEMPO_QUALITY_CLOUD_HIGH
+    )
+    return quality_class.astype(np.uint8)
 
-    input_data = []
-    for input_file in input_files:
-        coords = xr.open_dataset(input_file, engine='h5netcdf', chunks='auto')
-        product = xr.open_dataset(input_file, engine='h5netcdf', chunks='auto', group='product')
-        geoloc = xr.open_dataset(input_file, engine='h5netcdf', chunks='auto', group='geolocation')
-        support = xr.open_dataset(input_file, engine='h5netcdf', chunks='auto', group='support_data')
+
+def tempo_quality_mask(quality_class, quality_flag='high'):
+    """
+    Return a boolean mask of the pixels in ``quality_class`` that pass
+    the requested quality level ('high', 'medium' or 'low')
+    """
+    try:
+        required = TEMPO_QUALITY_LEVELS[quality_flag]
+    except KeyError:
+        raise ValueError(f"quality_flag should be one of 'high', 'medium' or 'low', not {quality_flag!r}")
+    return (quality_class & required) == required
+
+
+def _open_tempo_granule(input_file, load=False):
+    """
+    Open a single TEMPO granule and return the unmasked NO2 product and its
+    quality class together with the time (in seconds) it took.
+
+    The file is opened only once, and the root, ``product``, ``geolocation``
+    and ``support_data`` groups are all read through that one handle. The
+    granule is lazy, with one dask chunk per time step, and the file is
+    closed when the granule is closed. If ``load`` is True the granule is
+    read into memory instead, and the file closed before returning.
+    """
+    import h5netcdf
+    from xarray.backends import H5NetCDFStore
+
+    start = time.perf_counter()
+    h5file = h5netcdf.File(input_file, 'r')
+    try:
+        coords, product, geoloc, support = [
+            xr.open_dataset(H5NetCDFStore(h5file, group=group), chunks=-1)
+            for group in (None, 'product', 'geolocation', 'support_data')
+        ]
         product = product.assign_coords(coords.coords)
-        high_quality = (geoloc['solar_zenith_angle'] < 80) & (product['main_data_quality_flag'] == 0) & (support['eff_cloud_fraction'] < 0.2)
-        med_quality = (geoloc['solar_zenith_angle'] < 80) & (product['main_data_quality_flag'] == 0) & (support['eff_cloud_fraction'] < 0.4)
-        low_quality = (geoloc['solar_zenith_angle'] < 80) & (product['main_data_quality_flag'] == 0)
-        if quality_flag == 'high':
-            masked_product = product.where(high_quality)
-        elif quality_flag == 'medium':
-            masked_product = product.where(med_quality)
-        elif quality_flag == 'low':
-            masked_product = product.where(low_quality)
-        input_data.append(masked_product)
-    final_data = xr.combine_by_coords(input_data)
+        granule = product[['vertical_column_troposphere']].assign(
+            quality_class=_tempo_quality_class(product, geoloc, support)
+        )
+        if load:
+            granule = granule.load()
+    except BaseException:
+        h5file.close()
+        raise
+    if load:
+        h5file.close()
+    else:
+        granule.set_close(h5file.close)
+    return granule, time.perf_counter() - start
+
+
+# The number of TEMPO cubes kept in a cache directory, the least recently
+# used ones are removed when a new one is written
+TEMPO_CACHE_ENTRIES = 4
+
+# Temporary stores older than this many seconds were left by interrupted
+# writes, and are removed when the cache is pruned
+TEMPO_CACHE_TMP_AGE = 3600
+
+# The cached store that each TEMPO data object reads lazily from. Stores
+# are not pruned while a data object reading from them is alive.
+_open_tempo_caches = weakref.WeakKeyDictionary()
+
+
+def _tempo_cache_path(cache_dir, input_files):
+    """
+    Path of the cached TEMPO cube for this list of files
+
+    The key covers the file names, their modification times and sizes, so
+    replacing or adding a granule gives a new cache entry. The cache holds
+    the unmasked product, so it is shared by all quality levels.
+    """
+    key = hashlib.sha1(b'tempo-v2')
+    for input_file in input_files:
+        stat = os.stat(input_file)
+        key.update(f"{os.path.abspath(input_file)}:{stat.st_mtime_ns}:{stat.st_size}".encode())
+    return os.path.join(cache_dir, f"tempo_no2_{key.hexdigest()[:16]}.zarr")
+
+
+def _prune_tempo_cache(cache_dir, keep):
+    """
+    Remove all but the ``keep`` most recently used TEMPO cubes in ``cache_dir``,
+    other than those still in use, and any stale temporary stores
+    """
+    in_use = set(_open_tempo_caches.values())
+    paths = glob.glob(os.path.join(cache_dir, 'tempo_no2_*.zarr'))
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        if os.path.abspath(path) in in_use:
+            continue
+        logger.info(f"Removing cached TEMPO data {path}")
+        shutil.rmtree(path, ignore_errors=True)
+
+    now = time.time()
+    for path in glob.glob(os.path.join(cache_dir, '*.zarr.tmp')):
+        if now - os.path.getmtime(path) > TEMPO_CACHE_TMP_AGE:
+            logger.info(f"Removing interrupted TEMPO cache write {path}")
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _tempo_data(cube, quality_flag):
+    """
+    Wrap a combined TEMPO cube (NO2 product plus quality class) as XarrayData
+    """
+    new_data = cube['vertical_column_troposphere']
+    return XarrayData(new_data, label='tempo_no2', coords=XarrayCoordinates(new_data, n_dim=3),
+                      quality=cube['quality_class'], quality_flag=quality_flag)
+
+
+def _open_tempo_granules(input_files, max_workers=None):
+    """
+    Open TEMPO granules lazily in a pool of ``max_workers`` threads (or
+    serially if it is 1) and return them along with a dictionary of the time
+    spent opening each file
+    """
+    if max_workers == 1:
+        results = [_open_tempo_granule(input_file) for input_file in input_files]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(_open_tempo_granule, input_files))
+
+    granules = []
+    load_times = {}
+    for input_file, (granule, elapsed) in zip(input_files, results):
+        logger.info(f"Opened TEMPO granule {os.path.basename(input_file)} in {elapsed:.3f}s")
+        load_times[input_file] = elapsed
+        granules.append(granule)
+    return granules, load_times
+
+
+def _combine_tempo_granules(granules):
+    """
+    Combine TEMPO granules into one cube in WGS84 with NO2 in units of 10^16
+    """
+    # One chunk per time step, so that browsing the cube reads one granule at a time
+    final_data = xr.combine_by_coords(granules).chunk({'time': 1})
     _ = final_data.rio.write_crs("epsg:4326", inplace=True)
-    final_data['vertical_column_troposphere'].name = 'NO2'
     new_data = final_data['vertical_column_troposphere']
     new_data = new_data.rio.write_nodata(np.nan, encoded=True)
     no2_norm = 10**16
     new_data.data = new_data.data/no2_norm
-    new_data.coords['time'] = range(len(new_data.coords['time']))  # Somehow req for glue
-    return XarrayData(new_data, label='tempo_no2', coords=XarrayCoordinates(new_data, n_dim=3))
+    final_data['vertical_column_troposphere'] = new_data
+    return final_data
+
+
+def _write_tempo_slab(input_file, store, region):
+    """
+    Read a TEMPO granule, rescale it as `_combine_tempo_granules` does and
+    write it to the ``region`` of the time axis of the Zarr store ``store``
+    """
+    import rioxarray  # noqa: F401 (registers the .rio accessor)
+
+    granule, elapsed = _open_tempo_granule(input_file, load=True)
+    slab = _combine_tempo_granules([granule])
+    # Only the data is written, the coordinates are already in the store
+    slab = slab.drop_vars(list(slab.coords))
+    slab.to_zarr(store, region={'time': region})
+    return elapsed
+
+
+def _write_tempo_cache(cube, granules, input_files, store, max_workers=None, use_processes=False):
+    """
+    Write a combined TEMPO cube to a new Zarr store, each granule to its own
+    slab of the time axis (see load_tempo_data for the pool options)
+    """
+    times = cube.indexes['time']
+    regions = [slice(times.get_loc(granule['time'].values[0]), times.get_loc(granule['time'].values[-1]) + 1)
+               for granule in granules]
+    cube = cube.assign_coords(time=range(len(times)))  # Somehow req for glue
+    if not use_processes or max_workers == 1:
+        cube.to_zarr(store, mode='w', compute=False).compute(num_workers=max_workers)
+        return
+
+    cube.to_zarr(store, mode='w', compute=False)
+    # Forking a process that already runs threads (e.g. a Jupyter kernel) can deadlock
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for input_file, elapsed in zip(input_files, pool.map(_write_tempo_slab, input_files,
+                                                             [store] * len(input_files), regions)):
+            logger.info(f"Wrote TEMPO granule {os.path.basename(input_file)} to the cache in {elapsed:.3f}s")
+
+
+def load_tempo_data(directory, quality_flag='high', max_workers=None, use_processes=False, cache_dir=None):
+    """
+    Read all the TEMPO datafiles from a given directory into a glue data object
+
+    The NO2 product is kept unmasked alongside a per-pixel quality class, and
+    ``quality_flag`` ('high', 'medium' or 'low') only sets the quality level
+    that map layers start with; it can be changed there without reloading.
+
+    Granules are opened lazily by a pool of ``max_workers`` threads, which
+    only read their metadata and set up the quality class, so the data stay
+    on disk until they are used. Use ``max_workers=1`` to open them serially.
+    The time spent opening each granule is logged and stored in
+    ``data.meta['tempo_load_times']``.
+
+    If ``cache_dir`` is given, the combined and rescaled cube is written
+    there as a Zarr store the first time, and later calls with the same
+    files open that store lazily instead. The store is written one granule
+    at a time, by ``max_workers`` threads, or by as many processes if
+    ``use_processes`` is True (it has no effect without ``cache_dir``).
+    h5py only lets one thread at a time read HDF5 files, so processes read
+    in parallel and scale with the number of cores, each writing its own
+    slab of the time axis. Only the ``TEMPO_CACHE_ENTRIES`` most recently
+    used stores are kept in ``cache_dir``, along with any that data objects
+    still read from.
+
+    Granules that arrive later can be added with `append_tempo_data`.
+    """
+    import rioxarray  # noqa: F401 (registers the .rio accessor)
+
+    if quality_flag not in TEMPO_QUALITY_LEVELS:
+        raise ValueError(f"quality_flag should be one of 'high', 'medium' or 'low', not {quality_flag!r}")
+
+    input_files = sorted(glob.glob(f"{directory}/TEMPO_NO2_L3_V01_*_S*.nc"))
+
+    if cache_dir is not None:
+        cache_path = _tempo_cache_path(cache_dir, input_files)
+        if os.path.exists(cache_path):
+            logger.info(f"Opening cached TEMPO data from {cache_path}")
+            os.utime(cache_path)  # Marks it as recently used
+            data = _tempo_data(xr.open_zarr(cache_path, decode_coords='all'), quality_flag)
+            data.meta['tempo_files'] = input_files
+            data.meta['tempo_cache'] = cache_path
+            _open_tempo_caches[data] = os.path.abspath(cache_path)
+            return data
+
+    granules, load_times = _open_tempo_granules(input_files, max_workers=max_workers)
+    final_data = _combine_tempo_granules(granules)
+
+    if cache_dir is None:
+        final_data.coords['time'] = range(len(final_data.coords['time']))  # Somehow req for glue
+    else:
+        # Write to a temporary store first so that an interrupted write is never picked up
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=cache_dir, suffix='.zarr.tmp')
+        try:
+            _write_tempo_cache(final_data, granules, input_files, tmp_path,
+                               max_workers=max_workers, use_processes=use_processes)
+        finally:
+            for granule in granules:
+                granule.close()
+        try:
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # Another process wrote the same cube first, so its copy is used
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        _prune_tempo_cache(cache_dir, TEMPO_CACHE_ENTRIES)
+        final_data = xr.open_zarr(cache_path, decode_coords='all')
+
+    data = _tempo_data(final_data, quality_flag)
+    data.meta['tempo_files'] = input_files
+    data.meta['tempo_load_times'] = load_times
+    if cache_dir is not None:
+        data.meta['tempo_cache'] = cache_path
+        _open_tempo_caches[data] = os.path.abspath(cache_path)
+    return data
+
+
+def append_tempo_data(data, directory, max_workers=None):
+    """
+    Add any TEMPO datafiles in ``directory`` that are not yet part of
+    ``data`` (as returned by `load_tempo_data`) to the end of its time axis.
+
+    Only the new granules are opened, lazily as in `load_tempo_data`.
+    ``data`` is updated in place, so
+    existing links, subsets and map layers pick up the longer time axis.
+    New granules are expected to be later than the ones already loaded.
+    Returns the list of files that were added.
+    """
+    import rioxarray  # noqa: F401 (registers the .rio accessor)
+
+    loaded_files = set(data.meta['tempo_files'])
+    new_files = [input_file for input_file in sorted(glob.glob(f"{directory}/TEMPO_NO2_L3_V01_*_S*.nc"))
+                 if input_file not in loaded_files]
+    if not new_files:
+        return []
+
+    granules, load_times = _open_tempo_granules(new_files, max_workers=max_workers)
+    new_cube = _combine_tempo_granules(granules)
+    cube = xr.Dataset({'vertical_column_troposphere': data.xarr, 'quality_class': data.quality})
+    cube = xr.concat([cube, new_cube], dim='time')
+    cube.coords['time'] = range(len(cube.coords['time']))  # Somehow req for glue
+
+    data.update_xarray(cube['vertical_column_troposphere'], quality=cube['quality_class'])
+    data.meta['tempo_files'] = data.meta['tempo_files'] + new_files
+    data.meta.setdefault('tempo_load_times', {}).update(load_times)
+    return new_files
 
 
 class InvalidGeoData(Exception):
     pass
 
+
+def _regular_axis(values, rtol=1e-6):
+    """
+    Return ``(start, step)`` if ``values`` are evenly spaced, otherwise `None`
+    """
+    if len(values) < 2:
+        return (float(values[0]) if len(values) else 0., 1.)
+    start = float(values[0])
+    step = (float(values[-1]) - start) / (len(values) - 1)
+    if step == 0:
+        return None
+    if np.allclose(values, start + step * np.arange(len(values)), rtol=0, atol=rtol * abs(step)):
+        return (start, step)
+    return None
+
+
+def _interp_sorted(x, xp, fp):
+    """
+    Piecewise-linear interpolation of ``fp`` at ``x`` for increasing ``xp``,
+    extrapolating the first and last segments beyond the ends
+    """
+    i = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+    x0 = xp[i]
+    f0 = fp[i]
+    return f0 + (x - x0) * ((fp[i + 1] - f0) / (xp[i + 1] - x0))
+
+
 class XarrayCoordinates(Coordinates):
     """
-    A work-in-progress class to provide access to xarray coordinates.
-    Currently interpolates between pixel and world coordinates, which
-    is probably inefficient.
+    Provide access to the coordinates of an xarray DataArray.
+
+    Evenly spaced axes (the common case, including TEMPO grids) are converted
+    with an affine transform. Other axes are interpolated piecewise-linearly,
+    using ``searchsorted`` to go from world to pixel coordinates.
 
     Does not yet handle units.
     """
     def __init__(self, xarr, **kwargs):
-        self.wc = [np.asarray(w) for w in xarr.indexes.values()]
-        self.pc = [np.arange(len(wc)) for wc in self.wc]
-        self.coord_keys = xarr.coords.keys()
+        self.update(xarr)
         #self.units = []
         #for coord in self.coord_keys:
         #    try:
@@ -71,15 +393,46 @@ class XarrayCoordinates(Coordinates):
         #        self.units.append("")
 
         super().__init__(**kwargs)
-    
+
+    def update(self, xarr):
+        """
+        Read the axes from ``xarr``, e.g. after its time axis has grown
+        """
+        # glue orders pixel and world axes from the last array dimension to the first
+        self.coord_keys = list(xarr.dims[::-1])
+        self.wc = []
+        for dim in self.coord_keys:
+            values = np.asarray(xarr.indexes[dim]) if dim in xarr.indexes else np.array([])
+            if values.dtype.kind not in 'iuf':
+                # No (numeric) index, so use the pixel coordinate
+                values = np.arange(xarr.sizes[dim])
+            self.wc.append(values.astype(float))
+        self.pc = [np.arange(len(wc)) for wc in self.wc]
+        self._affine = [_regular_axis(wc) for wc in self.wc]
+
     def pixel_to_world_values(self, *args):
-        world_values = tuple([np.interp(arg, self.pc[i], self.wc[i]) for i,arg in enumerate(args)])
-        return world_values
+        world_values = []
+        for i, arg in enumerate(args):
+            arg = np.asarray(arg, dtype=float)
+            if self._affine[i] is not None:
+                start, step = self._affine[i]
+                world_values.append(arg * step + start)
+            else:
+                world_values.append(_interp_sorted(arg, self.pc[i], self.wc[i]))
+        return tuple(world_values)
 
-    
     def world_to_pixel_values(self, *args):
-        pixel_values = tuple([np.interp(arg, self.wc[i], self.pc[i]) for i, arge in enumerate(args)])
-        return pixel_values
+        pixel_values = []
+        for i, arg in enumerate(args):
+            arg = np.asarray(arg, dtype=float)
+            if self._affine[i] is not None:
+                start, step = self._affine[i]
+                pixel_values.append((arg - start) / step)
+            elif self.wc[i][0] < self.wc[i][-1]:
+                pixel_values.append(_interp_sorted(arg, self.wc[i], self.pc[i]))
+            else:
+                pixel_values.append(_interp_sorted(arg, self.wc[i][::-1], self.pc[i][::-1]))
+        return tuple(pixel_values)
 
     #@property
     #def world_axis_units(self):
@@ -93,6 +446,41 @@ class XarrayCoordinates(Coordinates):
         # coordinates for each axis.
         return [x for x in self.coord_keys]
 
+
+class XarrayComponent(DaskComponent):
+    """
+    A lazy component for the array wrapped by `XarrayData`.
+
+    The array is kept as a dask array, so slicing only computes the chunks
+    that the slice touches and ``data`` never loads the whole array. Whole
+    array statistics are reduced chunk by chunk in
+    `XarrayData.compute_statistic`.
+    """
+    def __init__(self, data, units=None):
+        super().__init__(self._as_dask(data), units=units)
+
+    @staticmethod
+    def _as_dask(data):
+        if isinstance(data, da.Array):
+            return data
+        return da.from_array(np.asarray(data), chunks='auto')
+
+    def set_data(self, data):
+        self._data = self._as_dask(data)
+
+    @property
+    def numeric(self):
+        return np.issubdtype(self._data.dtype, np.number)
+
+
+# Dask reductions used by XarrayData.compute_statistic, as (with NaNs, ignoring NaNs)
+_DASK_STATISTICS = {
+    'minimum': (da.min, da.nanmin),
+    'maximum': (da.max, da.nanmax),
+    'mean': (da.mean, da.nanmean),
+    'sum': (da.sum, da.nansum),
+}
+
 crs_string = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AXIS["Latitude",NORTH],AXIS["Longitude",EAST],AUTHORITY["EPSG","4326"]]'
 
 class XarrayData(Data):
@@ -107,15 +495,250 @@ class XarrayData(Data):
     we need something in here even if the xarray dataset does not
     specify.
 
+    A per-pixel quality class can be attached as ``quality``. It is not
+    a glue component; map layers use it to mask pixels while rendering.
+
     """
-    def __init__(self, input_xarray, label="", coords=None):
+    def __init__(self, input_xarray, label="", coords=None, quality=None, quality_flag=None):
         #This might be what we need for a DataSet
         #components = {x:input_xarray[x].data for x in input_xarray.data_vars.variables}
         #But for a single DataArray we just do this:
-        components = {input_xarray.name:input_xarray.data}
         #_ = input_xarray.rio.write_crs("epsg:4326", inplace=True)
         self.xarr = input_xarray
-        super().__init__(label=label, coords=coords, **components)
+        # Optional uint8 quality class with the same shape as input_xarray (see
+        # tempo_quality_mask) and the quality level that new layers start with.
+        self.quality = quality
+        self.quality_flag = quality_flag
+        super().__init__(label=label, coords=coords)
+        self.add_component(XarrayComponent(input_xarray.data), input_xarray.name)
+
+    def compute_statistic(self, statistic, cid, subset_state=None, axis=None,
+                          finite=True, positive=False, percentile=None, view=None,
+                          random_subset=None, n_chunk_max=40000000):
+        """
+        Compute a statistic for the data, see `glue.core.data.Data.compute_statistic`.
+
+        Minimum, maximum, mean and sum of the wrapped array (without a subset)
+        are reduced chunk by chunk with dask rather than loading the array.
+        """
+        if isinstance(cid, str):
+            cid = self.id[cid]
+        component = self._components.get(cid)
+        if (subset_state is None and statistic in _DASK_STATISTICS and
+                isinstance(component, XarrayComponent)):
+            values = component.data
+            if view is not None:
+                values = values[tuple(view) if isinstance(view, list) else view]
+            if finite:
+                values = da.where(da.isfinite(values), values, np.nan)
+            if positive:
+                values = da.where(values > 0, values, np.nan)
+            function = _DASK_STATISTICS[statistic][finite or positive]
+            if isinstance(axis, tuple) and len(axis) == 0:
+                return values.compute()
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                return function(values, axis=axis).compute()
+        return super().compute_statistic(statistic, cid, subset_state=subset_state, axis=axis,
+                                         finite=finite, positive=positive, percentile=percentile,
+                                         view=view, random_subset=random_subset,
+                                         n_chunk_max=n_chunk_max)
+
+    def update_xarray(self, input_xarray, quality=None):
+        """
+        Replace the wrapped DataArray in place, for instance with one that has
+        a longer time axis.
+
+        Unlike `update_values_from_data`, the coordinates object is updated
+        rather than replaced, so the world coordinate components keep their
+        component IDs and viewers using them as attributes are not reset.
+        """
+        self.xarr = input_xarray
+        self.quality = quality
+        self._shape = input_xarray.shape
+        self.get_component(input_xarray.name).set_data(input_xarray.data)
+        if isinstance(self.coords, XarrayCoordinates):
+            self.coords.update(input_xarray)
+
+        if self.hub is not None:
+            self.hub.broadcast(NumericalDataChangedMessage(self))
+
+        for subset in self.subsets:
+            clear_cache(subset.subset_state.to_mask)
+
+
+def _bbox_centers(geometry):
+    bounds = geometry.bounds
+    x = (bounds['minx'] + bounds['maxx']) / 2
+    y = (bounds['miny'] + bounds['maxy']) / 2
+    return geopandas.GeoSeries(geopandas.points_from_xy(x, y), index=geometry.index, crs=geometry.crs)
+
+
+# Ways of placing one anchor point in each region, see GeoRegionData
+GEO_ANCHORS = {
+    'representative_point': lambda geometry: geometry.representative_point(),
+    'centroid': lambda geometry: geometry.centroid,
+    'bbox_center': _bbox_centers,
+}
+
+
+class GeoAnchors:
+    """
+    The anchor points of a set of geometries, computed on first access
+    """
+    def __init__(self, geometry, anchor='representative_point'):
+        if anchor not in GEO_ANCHORS:
+            raise ValueError(f"anchor should be one of {', '.join(GEO_ANCHORS)}, not {anchor!r}")
+        self.geometry = geometry
+        self.anchor = anchor
+        self._points = None
+
+    @property
+    def shape(self):
+        return (len(self.geometry),)
+
+    @property
+    def points(self):
+        """
+        A GeoSeries of the anchor points
+        """
+        if self._points is None:
+            self._points = GEO_ANCHORS[self.anchor](self.geometry)
+        return self._points
+
+
+class GeoAnchorComponent(Component):
+    """
+    One coordinate (``'x'`` or ``'y'``) of the anchor points of a GeoRegionData
+    object, only computed when the values are first needed.
+    """
+    def __init__(self, anchors, axis, units=None):
+        self.units = units
+        self.anchors = anchors
+        self.axis = axis
+        self._values = None
+
+    @property
+    def _data(self):
+        if self._values is None:
+            self._values = np.asarray(getattr(self.anchors.points, self.axis), dtype=float)
+        return self._values
+
+    @_data.setter
+    def _data(self, value):
+        self._values = value
+
+    @property
+    def shape(self):
+        return self.anchors.shape if self._values is None else self._values.shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def numeric(self):
+        return True
+
+    @property
+    def categorical(self):
+        return False
+
+    @property
+    def datetime(self):
+        return False
+
+
+# Regions are simplified separately for each band of this many zoom levels,
+# up to MAX_SIMPLIFIED_ZOOM, above which the full geometries are shown
+SIMPLIFICATION_BAND = 2
+MAX_SIMPLIFIED_ZOOM = 12
+
+# coverage_simplify removes vertices by the area of the triangles they make
+# (Visvalingam-Whyatt), which can move borders by several times its
+# tolerance, so coverages are simplified with this fraction of it
+COVERAGE_TOLERANCE_FACTOR = 0.25
+
+# Coverage simplification needs shapely 2.1 built with GEOS 3.12 or later,
+# without it every geometry is simplified on its own
+HAS_COVERAGE_SIMPLIFY = hasattr(shapely, "coverage_simplify") and hasattr(shapely, "coverage_is_valid")
+
+# Metres per degree of longitude at the equator, to express tolerances in
+# the units of projected coordinate systems
+METRES_PER_DEGREE = 111319.49
+
+
+class SimplificationPyramid:
+    """
+    Simplified versions of a set of geometries, one for each band of zoom
+    levels, computed on first use and then kept
+
+    The tolerance for a band is half a screen pixel at the deepest zoom
+    level in the band, so the simplification cannot be seen on the map.
+    Polygons that tile the plane without overlaps (e.g. counties) are
+    simplified as a coverage, so that neighbours keep sharing their
+    borders without gaps or overlaps, other geometries are simplified one
+    by one, preserving their topology (as are coverages if this shapely
+    cannot simplify them).
+    """
+
+    def __init__(self, geometry, crs=None):
+        self.geometry = np.asarray(geometry, dtype=object)
+        self._levels = {}
+        self._is_coverage = None
+        if crs is None or crs.is_geographic:
+            self._units_per_degree = 1
+        else:
+            self._units_per_degree = METRES_PER_DEGREE / crs.axis_info[0].unit_conversion_factor
+
+    @staticmethod
+    def band(zoom):
+        """
+        The band of zoom level ``zoom``, or None if it shows the full geometries
+        """
+        zoom = int(round(zoom or 0))
+        if zoom > MAX_SIMPLIFIED_ZOOM:
+            return None
+        return max(zoom, 0) // SIMPLIFICATION_BAND
+
+    def tolerance(self, band):
+        """
+        The simplification tolerance for ``band``, in the units of the geometries
+        """
+        deepest_zoom = (band + 1) * SIMPLIFICATION_BAND - 1
+        return 0.5 * 360 / (256 * 2 ** deepest_zoom) * self._units_per_degree
+
+    @property
+    def is_coverage(self):
+        """
+        Whether the geometries are all polygons that do not overlap, and
+        can be simplified as a coverage
+        """
+        if self._is_coverage is None:
+            if not HAS_COVERAGE_SIMPLIFY:
+                self._is_coverage = False
+                return False
+            polygons = np.isin(shapely.get_type_id(self.geometry), [3, 6]).all()
+            self._is_coverage = bool(polygons and shapely.coverage_is_valid(self.geometry))
+        return self._is_coverage
+
+    def level(self, zoom):
+        """
+        The geometries simplified for zoom level ``zoom``
+        """
+        band = self.band(zoom)
+        if band is None:
+            return self.geometry
+        if band not in self._levels:
+            if self.is_coverage:
+                simplified = shapely.coverage_simplify(
+                    self.geometry, self.tolerance(band) * COVERAGE_TOLERANCE_FACTOR
+                )
+            else:
+                simplified = shapely.simplify(self.geometry, self.tolerance(band), preserve_topology=True)
+            self._levels[band] = simplified
+        return self._levels[band]
+
 
 class GeoRegionData(Data):
     """
@@ -138,13 +761,27 @@ class GeoRegionData(Data):
     be to use these attributes as coordinate components but they
     are a bit different from normal coordinate components.
 
-    Currently we call these new attributes centroids, although they
-    are GeoPandas `representative_points` because we want to
-    guarantee that these points are within regions. Centroid
-    is a more intuitive, albeit technically incorrect, name.
+    Currently we call these new attributes centroids, although by
+    default they are GeoPandas `representative_points` because we want
+    to guarantee that these points are within regions. Centroid
+    is a more intuitive, albeit technically incorrect, name. The
+    ``anchor`` argument can instead select the true ``'centroid'`` or
+    the ``'bbox_center'``, which is the cheapest for complex polygons.
+    The anchors are only computed when these components are first used.
+
+    The GeoDataFrame reconstructed by `GeoPandasTranslator`, the
+    `SimplificationPyramid` and spatial index of the geometries, and the
+    ``geojson_cache`` that viewers keep encoded features in are cached on
+    the data object and discarded whenever components are added, removed or
+    changed.
     """
 
-    def __init__(self, data, label="", coords=None, **kwargs):
+    def __init__(self, data, label="", coords=None, anchor='representative_point', **kwargs):
+        self._geodataframe = None
+        self._simplification = None
+        self._spatial_index = None
+        self.geojson_cache = {}
+        self._geom_type = None
         super(GeoRegionData, self).__init__()
         self.label = label
         self.geometry = None
@@ -156,13 +793,13 @@ class GeoRegionData(Data):
         ):
             self.geometry = None
             # Naming of centroid is a bit misleading, but easier than representative point
-            self.centroids = data.representative_point()
+            self.anchors = GeoAnchors(data.geometry, anchor=anchor)
             for i in range(2):
                 label = data.crs.axis_info[i].name + " (Centroid)"
                 if i == 0:
-                    cid = self.add_component(self.centroids.y, label=label)
+                    cid = self.add_component(GeoAnchorComponent(self.anchors, 'y'), label=label)
                 elif i == 1:
-                    cid = self.add_component(self.centroids.x, label=label)
+                    cid = self.add_component(GeoAnchorComponent(self.anchors, 'x'), label=label)
                 self._centroid_component_ids.append(cid)
 
             if isinstance(data, geopandas.GeoDataFrame):
@@ -171,10 +808,9 @@ class GeoRegionData(Data):
                     if name != data.geometry.name:  # Is this safe?
                         self.add_component(values, label=name)
                     else:
+                        # Geometries are not hashable, so glue gets them as WKB bytes
                         # https://leblancfg.com/unhashable-python-unique-locations-geometry-geodataframe.html
-                        self.add_component(
-                            values.apply(lambda x: x.wkt).values, label="geometry"
-                        )
+                        self.add_component(values.to_wkb().values, label="geometry")
 
         else:
             raise InvalidGeoData(
@@ -183,6 +819,75 @@ class GeoRegionData(Data):
             )
         self.meta["crs"] = data.crs
 
+    @property
+    def centroids(self):
+        """
+        A GeoSeries of the anchor point of each region
+        """
+        return self.anchors.points
+
+    @property
+    def geom_type(self):
+        """
+        The kind of geometries: 'points' or 'lines' if all the geometries are
+        of that type, otherwise 'regions' (for polygons or a mix of types)
+        """
+        if self._geom_type is None:
+            if self.geometry is None:
+                self._geom_type = "points"
+            else:
+                # From the geometry component, which may have been replaced since
+                type_ids = set(shapely.get_type_id(self.simplification.geometry).tolist()) - {-1}
+                if type_ids == {0}:
+                    self._geom_type = "points"
+                elif type_ids == {1}:
+                    self._geom_type = "lines"
+                else:
+                    self._geom_type = "regions"
+        return self._geom_type
+
+    @property
+    def simplification(self):
+        """
+        The `SimplificationPyramid` of the geometries, for drawing them at each zoom level
+        """
+        if self._simplification is None:
+            gdf = GeoPandasTranslator._to_geodataframe(self)
+            self._simplification = SimplificationPyramid(gdf.geometry.values, crs=gdf.crs)
+        return self._simplification
+
+    @property
+    def spatial_index(self):
+        """
+        A `shapely.STRtree` of the geometries
+        """
+        if self._spatial_index is None:
+            self._spatial_index = shapely.STRtree(self.simplification.geometry)
+        return self._spatial_index
+
+    def _clear_geometry_caches(self):
+        self._geodataframe = None
+        self._simplification = None
+        self._spatial_index = None
+        self._geom_type = None
+        self.geojson_cache = {}
+
+    def add_component(self, component, label):
+        self._clear_geometry_caches()
+        return super().add_component(component, label)
+
+    def remove_component(self, component_id):
+        self._clear_geometry_caches()
+        return super().remove_component(component_id)
+
+    def update_components(self, mapping):
+        self._clear_geometry_caches()
+        return super().update_components(mapping)
+
+    def update_values_from_data(self, data):
+        self._clear_geometry_caches()
+        return super().update_values_from_data(data)
+
 
 @data_translator(geopandas.GeoDataFrame)
 class GeoPandasTranslator:
@@ -196,26 +901,39 @@ class GeoPandasTranslator:
         return GeoRegionData(data)
 
     def to_object(self, data_or_subset, attribute=None):
-        gdf = geopandas.GeoDataFrame()
-        coords = data_or_subset.coordinate_components
         if isinstance(data_or_subset, Subset):
-            # These are fake components created just for glue
-            centroids = data_or_subset.data._centroid_component_ids
-            crs = data_or_subset.data.meta["crs"]
+            gdf = self._to_geodataframe(data_or_subset.data)
+            indices = np.flatnonzero(data_or_subset.to_mask())
+            return gdf.take(indices).reset_index(drop=True)
         else:
-            # These are fake components created just for glue
-            centroids = data_or_subset._centroid_component_ids
-            crs = data_or_subset.meta["crs"]
+            # A shallow copy, so that callers adding columns do not change the cache
+            return self._to_geodataframe(data_or_subset).copy(deep=False)
+
+    @staticmethod
+    def _to_geodataframe(data):
+        """
+        Return the (cached) GeoDataFrame for all the rows of a GeoRegionData
+        """
+        labels = tuple(cid.label for cid in data.components)
+        if data._geodataframe is not None and data._geodataframe[0] == labels:
+            return data._geodataframe[1]
+
+        gdf = geopandas.GeoDataFrame()
+        coords = data.coordinate_components
+        # These are fake components created just for glue
+        centroids = data._centroid_component_ids
 
-        for cid in data_or_subset.components:
+        for cid in data.components:
             if (cid not in coords) and (cid not in centroids):
                 if cid.label == "geometry":
-                    g = geopandas.GeoSeries.from_wkt(data_or_subset[cid])
+                    g = geopandas.GeoSeries.from_wkb(np.asarray(data[cid]))
                     gdf[cid.label] = g
                 else:
-                    gdf[cid.label] = data_or_subset[cid]
+                    gdf[cid.label] = data[cid]
         gdf.set_geometry("geometry", inplace=True)
-        gdf.crs = crs
+        gdf.crs = data.meta["crs"]
+        # Component labels can be changed in place, so they are part of the key
+        data._geodataframe = (labels, gdf)
         return gdf
 
 
@@ -0,0 +1,187 @@
+"""
+Features sent to the browser as binary widget buffers rather than as JSON.
+
+Coordinates are quantized to a grid of ``precision`` decimal places,
+delta-encoded and packed as zigzag varints, so most of them take one to
+three bytes rather than the ten or so of their JSON text. A `FeatureChannel`
+widget holds them, and its front end (features.js) decodes them into the
+data of an ipyleaflet layer. This needs anywidget; without it, the map
+layers send GeoJSON instead.
+"""
+import pathlib
+
+import numpy as np
+import shapely
+from ipywidgets import Widget, widget_serialization
+from traitlets import Bytes, Dict, Instance, Unicode
+
+from .geojson import GEOMETRY_FAMILIES, MULTI_TYPE_IDS
+from .vector_tiles import _varints, _zigzag
+
+try:
+    from anywidget import AnyWidget
+except ImportError:
+    AnyWidget = None
+
+__all__ = ["HAS_ANYWIDGET", "pack_geometries", "pack_points", "unpack_geometries", "pack_colors", "pack_mask"]
+
+HAS_ANYWIDGET = AnyWidget is not None
+
+# The number of levels of offsets of the ragged arrays of each family of
+# geometries when they include multi-part geometries
+MULTI_DEPTHS = {"Point": 1, "LineString": 2, "Polygon": 3}
+
+
+def _pack_coordinates(coords, precision):
+    # Each quantized coordinate is sent as the difference from the previous
+    # one, which is small along rings and between points sorted in space
+    quantized = np.round(np.asarray(coords, dtype=float) * 10.0 ** precision).astype(np.int64)
+    deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return _varints(_zigzag(deltas.ravel()))
+
+
+def _unpack_varints(data):
+    data = np.frombuffer(data, dtype=np.uint8)
+    last = (data & 0x80) == 0
+    number = np.concatenate([[0], np.cumsum(last)[:-1]])
+    start = np.concatenate([[0], np.flatnonzero(last)[:-1] + 1])
+    shift = (np.arange(len(data)) - start[number]) * 7
+    values = np.zeros(last.sum(), dtype=np.uint64)
+    np.add.at(values, number, (data & 0x7F).astype(np.uint64) << shift.astype(np.uint64))
+    return values
+
+
+def _unpack_coordinates(data, precision):
+    zigzagged = _unpack_varints(data).astype(np.int64)
+    deltas = (zigzagged >> 1) ^ -(zigzagged & 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10.0 ** precision
+
+
+def pack_geometries(geometries, ids, precision):
+    """
+    The buffers of an array of shapely geometries and the ids of their features
+
+    As in `encode_geometries`, the coordinates of each family of geometries
+    (points, lines and polygons with their multi-part versions) are taken
+    together from `shapely.to_ragged_array`, and are sent along with its
+    offsets. Missing, empty and other geometries (e.g. geometry collections)
+    are left out.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    ids = np.asarray(ids)
+    type_ids = shapely.get_type_id(geometries)
+    type_ids[shapely.is_empty(geometries)] = -1
+    families = []
+    for name, family in GEOMETRY_FAMILIES.items():
+        selected = np.flatnonzero(np.isin(type_ids, family))
+        if len(selected) == 0:
+            continue
+        _, coords, offsets = shapely.to_ragged_array(geometries[selected], include_z=False)
+        families.append({
+            "type": name,
+            "ids": ids[selected].astype("<u4").tobytes(),
+            "multi": np.isin(type_ids[selected], MULTI_TYPE_IDS).astype(np.uint8).tobytes(),
+            "offsets": [offset.astype("<u4").tobytes() for offset in offsets],
+            "coordinates": _pack_coordinates(coords, precision),
+        })
+    return {"precision": precision, "families": families}
+
+
+def pack_points(lat, lon, precision):
+    """
+    The buffers of points without ids, in the form of `pack_geometries`
+    """
+    coords = np.column_stack([np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)])
+    if len(coords) == 0:
+        return {"precision": precision, "families": []}
+    return {
+        "precision": precision,
+        "families": [{"type": "Point", "ids": None, "multi": None, "offsets": [],
+                      "coordinates": _pack_coordinates(coords, precision)}],
+    }
+
+
+def unpack_geometries(packed):
+    """
+    The ``(id, geometry)`` of each feature packed by `pack_geometries`, with
+    GeoJSON geometry dicts, as features.js decodes them in the browser
+    """
+    features = []
+    for family in packed["families"]:
+        nested = _unpack_coordinates(family["coordinates"], packed["precision"]).tolist()
+        for offsets in family["offsets"]:
+            bounds = np.frombuffer(offsets, dtype="<u4").tolist()
+            nested = [nested[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+        n = len(nested)
+        ids = [None] * n if family["ids"] is None else np.frombuffer(family["ids"], dtype="<u4").tolist()
+        multi = [0] * n if family["multi"] is None else np.frombuffer(family["multi"], dtype=np.uint8).tolist()
+        ragged_multi = len(family["offsets"]) == MULTI_DEPTHS[family["type"]]
+        for feature_id, is_multi, coordinates in zip(ids, multi, nested):
+            if is_multi:
+                geometry = {"type": "Multi" + family["type"], "coordinates": coordinates}
+            else:
+                geometry = {"type": family["type"], "coordinates": coordinates[0] if ragged_multi else coordinates}
+            features.append((feature_id, geometry))
+    return features
+
+
+def pack_colors(colors):
+    """
+    The buffers of an array of hex colours, as a palette of the distinct
+    colours and the index of each colour in it
+    """
+    if colors is None:
+        return {}
+    palette, index = np.unique(np.asarray(colors), return_inverse=True)
+    width = 1 if len(palette) <= 256 else 2
+    return {
+        "palette": palette.tolist(),
+        "index": index.astype("<u1" if width == 1 else "<u2").tobytes(),
+        "width": width,
+    }
+
+
+def pack_mask(mask):
+    """
+    A boolean array as a bitmask, with the first element in the lowest bit
+    """
+    return np.packbits(np.asarray(mask, dtype=bool), bitorder="little").tobytes()
+
+
+if HAS_ANYWIDGET:
+
+    class FeatureChannel(AnyWidget):
+        """
+        Show features sent as binary buffers on an ipyleaflet layer
+
+        The front end decodes ``geometry`` (see `pack_geometries`) and sets
+        the features, or the locations for a Heatmap, on ``layer`` without
+        sending them back to the kernel. ``kind`` says how:
+
+        * "regions": features with their ids, coloured by ``colors`` (see
+          `pack_colors`), which has a colour for each id. If ``selected``
+          (see `pack_mask`) is set, only the features whose ids are
+          selected are shown.
+        * "points": a feature for each point, coloured by ``colors`` and
+          sized by ``radii`` (uint16), which have a value for each point
+        * "locations": heatmap locations, weighted by ``weights`` (float32)
+
+        Each of these can be changed without sending the others again. If
+        ``source`` is set, the geometry is taken from that FeatureChannel, so
+        that several layers (e.g. of a data set and its subsets) can show
+        the same geometry, sent once, with different selections and colours.
+        """
+
+        _esm = pathlib.Path(__file__).parent / "features.js"
+
+        layer = Instance(Widget, allow_none=True).tag(sync=True, **widget_serialization)
+        source = Instance(Widget, allow_none=True).tag(sync=True, **widget_serialization)
+        kind = Unicode("regions").tag(sync=True)
+        geometry = Dict().tag(sync=True)
+        selected = Bytes(None, allow_none=True).tag(sync=True)
+        colors = Dict().tag(sync=True)
+        radii = Bytes(None, allow_none=True).tag(sync=True)
+        weights = Bytes(None, allow_none=True).tag(sync=True)
+
+else:
+    FeatureChannel = None
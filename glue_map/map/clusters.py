@@ -0,0 +1,97 @@
+"""
+Zoom-aware clustering of points on a quadtree grid.
+"""
+import numpy as np
+
+from .tiles import MAX_LEVEL, quadtree_codes
+
+__all__ = ["PointClusters"]
+
+# Clusters are quadtree cells this many levels below the map tiles, i.e.
+# 256 / 2 ** CELL_LEVELS = 64 screen pixels across
+CELL_LEVELS = 2
+
+# Heatmap points are binned into cells 4 screen pixels across, well below
+# the radius / 2 pixel grid that Leaflet.heat sums intensities on itself
+HEAT_CELL_LEVELS = 6
+
+
+class PointClusters:
+    """
+    Cluster points on a grid that follows the zoom level of the map
+
+    The points are sorted along a quadtree curve once, when the index is
+    built. The clusters at a zoom level are the runs of points that share a
+    quadtree cell about 64 screen pixels across, so computing them is a
+    single ``reduceat`` pass, and they are cached for each zoom level.
+
+    With ``cell_levels`` the cells are ``256 / 2 ** cell_levels`` screen
+    pixels across instead, and with ``weights`` the total weight of the
+    points in each cluster is available from `totals`.
+    """
+
+    def __init__(self, lat, lon, weights=None, cell_levels=CELL_LEVELS):
+        lat = np.asarray(lat, dtype=float).ravel()
+        lon = np.asarray(lon, dtype=float).ravel()
+        keep = np.isfinite(lat) & np.isfinite(lon)
+        codes = quadtree_codes(lon[keep], lat[keep])
+        order = np.argsort(codes, kind="stable")
+        self.cell_levels = cell_levels
+        self._codes = codes[order]
+        self._lat = lat[keep][order]
+        self._lon = lon[keep][order]
+        if weights is None:
+            self._weights = None
+        else:
+            self._weights = np.asarray(weights, dtype=float).ravel()[keep][order]
+        self._clusters = {}
+        self._starts = {}
+        self._totals = {}
+
+    def __len__(self):
+        return len(self._codes)
+
+    def zoom_to_level(self, zoom):
+        """
+        The integer zoom level that clusters are computed for
+        """
+        return int(np.clip(round(zoom or 0), 0, MAX_LEVEL - self.cell_levels))
+
+    def clusters(self, zoom):
+        """
+        Return the latitude, longitude (the mean of the points) and number of
+        points of each cluster at zoom level ``zoom``
+        """
+        z = self.zoom_to_level(zoom)
+        if z not in self._clusters:
+            if len(self._codes) == 0:
+                self._clusters[z] = (np.array([]), np.array([]), np.array([], dtype=int))
+            else:
+                starts = self._cluster_starts(z)
+                counts = np.diff(starts, append=len(self._codes))
+                lat = np.add.reduceat(self._lat, starts) / counts
+                lon = np.add.reduceat(self._lon, starts) / counts
+                self._clusters[z] = (lat, lon, counts)
+        return self._clusters[z]
+
+    def totals(self, zoom):
+        """
+        Return the total weight of the points in each cluster at zoom level
+        ``zoom``, or their number if no weights were given
+        """
+        z = self.zoom_to_level(zoom)
+        if self._weights is None:
+            return self.clusters(z)[2]
+        if z not in self._totals:
+            if len(self._codes) == 0:
+                self._totals[z] = np.array([])
+            else:
+                self._totals[z] = np.add.reduceat(self._weights, self._cluster_starts(z))
+        return self._totals[z]
+
+    def _cluster_starts(self, z):
+        # The first point of each cluster, for reduceat
+        if z not in self._starts:
+            cells = self._codes >> np.uint64(2 * (MAX_LEVEL - z - self.cell_levels))
+            self._starts[z] = np.flatnonzero(np.diff(cells, prepend=cells[0] + np.uint64(1)))
+        return self._starts[z]
@@ -0,0 +1,163 @@
+// The front end of FeatureChannel (binary.py): decode the features sent as
+// binary buffers and show them on an ipyleaflet layer. The decoded features
+// are only set in the browser, and are not sent back to the kernel.
+
+// The number of levels of offsets of the ragged arrays of each family of
+// geometries when they include multi-part geometries
+const MULTI_DEPTHS = { Point: 1, LineString: 2, Polygon: 3 };
+
+function typed(view, Type) {
+  // Buffers are copied, as their views need not be aligned for Type
+  if (!view) return null;
+  return new Type(view.buffer.slice(view.byteOffset, view.byteOffset + view.byteLength));
+}
+
+export function unpackCoordinates(view, precision) {
+  // Zigzag varints of the differences between consecutive quantized
+  // coordinates, x and y in turn
+  const bytes = new Uint8Array(view.buffer, view.byteOffset, view.byteLength);
+  const scale = 10 ** precision;
+  const coords = [];
+  let value = 0;
+  let shift = 0;
+  let x = 0;
+  let y = 0;
+  let odd = false;
+  for (let i = 0; i < bytes.length; i++) {
+    value += (bytes[i] & 0x7f) * 2 ** shift;
+    if (bytes[i] & 0x80) {
+      shift += 7;
+      continue;
+    }
+    const delta = value % 2 ? -(value + 1) / 2 : value / 2;
+    if (odd) {
+      y += delta;
+      coords.push([x / scale, y / scale]);
+    } else {
+      x += delta;
+    }
+    odd = !odd;
+    value = 0;
+    shift = 0;
+  }
+  return coords;
+}
+
+export function unpackGeometries(packed) {
+  // The [id, geometry] of each feature (see pack_geometries)
+  const features = [];
+  for (const family of packed.families || []) {
+    let nested = unpackCoordinates(family.coordinates, packed.precision);
+    for (const view of family.offsets) {
+      const offsets = typed(view, Uint32Array);
+      const parts = new Array(offsets.length - 1);
+      for (let i = 0; i < parts.length; i++) {
+        parts[i] = nested.slice(offsets[i], offsets[i + 1]);
+      }
+      nested = parts;
+    }
+    const ids = typed(family.ids, Uint32Array);
+    const multi = typed(family.multi, Uint8Array);
+    const raggedMulti = family.offsets.length === MULTI_DEPTHS[family.type];
+    for (let i = 0; i < nested.length; i++) {
+      const geometry = multi && multi[i]
+        ? { type: "Multi" + family.type, coordinates: nested[i] }
+        : { type: family.type, coordinates: raggedMulti ? nested[i][0] : nested[i] };
+      features.push([ids ? ids[i] : null, geometry]);
+    }
+  }
+  return features;
+}
+
+function colorLookup(colors) {
+  // The colour at each position of a pack_colors palette and index
+  if (!colors || !colors.palette) return null;
+  const index = typed(colors.index, colors.width === 2 ? Uint16Array : Uint8Array);
+  return (i) => colors.palette[index[i]];
+}
+
+export function regionFeatures(features, model) {
+  const color = colorLookup(model.get("colors"));
+  const selected = typed(model.get("selected"), Uint8Array);
+  const collection = [];
+  for (const [id, geometry] of features) {
+    // One bit per id, the first id in the lowest bit (see pack_mask)
+    if (selected && !((selected[id >> 3] >> (id & 7)) & 1)) continue;
+    const properties = { id };
+    if (color) {
+      const c = color(id);
+      properties.style = { color: c, fillColor: c };
+    }
+    collection.push({ type: "Feature", id: String(id), properties, geometry });
+  }
+  return { type: "FeatureCollection", features: collection };
+}
+
+export function pointFeatures(features, model) {
+  const color = colorLookup(model.get("colors"));
+  const radii = typed(model.get("radii"), Uint16Array);
+  const collection = features.map(([, geometry], i) => {
+    const style = {};
+    if (color) style.fillColor = color(i);
+    if (radii) style.radius = radii[i];
+    return { type: "Feature", properties: { style }, geometry };
+  });
+  return { type: "FeatureCollection", features: collection };
+}
+
+export function heatmapLocations(features, model) {
+  const weights = typed(model.get("weights"), Float32Array);
+  return features.map(([, geometry], i) => [
+    geometry.coordinates[1],
+    geometry.coordinates[0],
+    weights ? weights[i] : 1,
+  ]);
+}
+
+async function getWidget(model, name) {
+  const reference = model.get(name);
+  if (!reference) return null;
+  return await model.widget_manager.get_model(reference.slice("IPY_MODEL_".length));
+}
+
+export default {
+  async initialize({ model }) {
+    // The channel the geometry is taken from, this one unless source is set
+    let source = null;
+    // Geometry is only decoded again when it changes, not with its styles
+    let decoded = { packed: null, features: [] };
+    const features = () => {
+      const packed = (source || model).get("geometry");
+      if (packed !== decoded.packed) {
+        decoded = { packed, features: unpackGeometries(packed || {}) };
+      }
+      return decoded.features;
+    };
+    const render = async () => {
+      const layer = await getWidget(model, "layer");
+      if (!layer) return;
+      const kind = model.get("kind");
+      if (kind === "locations") {
+        layer.set("locations", heatmapLocations(features(), model));
+      } else if (kind === "points") {
+        layer.set("data", pointFeatures(features(), model));
+      } else {
+        layer.set("data", regionFeatures(features(), model));
+      }
+    };
+    const connect = async () => {
+      if (source) source.off("change:geometry", render);
+      source = await getWidget(model, "source");
+      if (source) source.on("change:geometry", render);
+      await render();
+    };
+    for (const name of ["layer", "kind", "geometry", "selected", "colors", "radii", "weights"]) {
+      model.on(`change:${name}`, render);
+    }
+    model.on("change:source", connect);
+    await connect();
+    return () => {
+      if (source) source.off("change:geometry", render);
+    };
+  },
+};
@@ -0,0 +1,167 @@
+"""
+Encoding of GeoDataFrames as GeoJSON feature collections for map layers.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import mapping
+
+from ..data import GeoPandasTranslator
+
+__all__ = ["geodataframe_to_geojson", "region_features", "grid_precision", "zoom_precision"]
+
+# Coordinates are rounded to this many decimal places, about 10 cm in degrees
+COORDINATE_PRECISION = 6
+
+# The shapely type ids of the single and multi geometries that
+# shapely.to_ragged_array encodes together
+GEOMETRY_FAMILIES = {
+    "Point": (0, 4),
+    "LineString": (1, 5),
+    "Polygon": (3, 6),
+}
+MULTI_TYPE_IDS = (4, 5, 6)
+
+
+def grid_precision(step, precision=COORDINATE_PRECISION):
+    """
+    The number of decimal places, at most ``precision``, that rounds
+    coordinates to a grid no coarser than ``step``
+    """
+    return int(np.clip(np.ceil(-np.log10(step)), 0, precision))
+
+
+def zoom_precision(zoom, precision=COORDINATE_PRECISION):
+    """
+    The number of decimal places, at most ``precision``, that rounds
+    longitudes and latitudes to a grid no coarser than half a screen pixel
+    at zoom level ``zoom``
+    """
+    return grid_precision(0.5 * 360 / (256 * 2 ** zoom), precision)
+
+
+def _nest(coords, offsets):
+    # Split the flat coordinate list up by each level of offsets in turn
+    for offset in offsets:
+        bounds = offset.tolist()
+        coords = [coords[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+    return coords
+
+
+def encode_geometries(geometries, precision=COORDINATE_PRECISION):
+    """
+    GeoJSON geometry dicts for an array of shapely geometries
+
+    The coordinates of each family of geometries (points, lines and
+    polygons, with their multi-part versions) are extracted together as one
+    array with `shapely.to_ragged_array`, rounded to ``precision`` decimal
+    places, and converted to nested lists by slicing a single flat list.
+    Missing and empty geometries are encoded as None.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    type_ids = shapely.get_type_id(geometries)
+    type_ids[shapely.is_empty(geometries)] = -1
+    encoded = [None] * len(geometries)
+
+    for name, family in GEOMETRY_FAMILIES.items():
+        selected = np.flatnonzero(np.isin(type_ids, family))
+        if len(selected) == 0:
+            continue
+        ragged_type, coords, offsets = shapely.to_ragged_array(geometries[selected], include_z=False)
+        nested = _nest(np.round(coords, precision).tolist(), offsets)
+        multi = ragged_type.name.startswith("MULTI")
+        for i, type_id, coordinates in zip(selected.tolist(), type_ids[selected].tolist(), nested):
+            if type_id in MULTI_TYPE_IDS:
+                encoded[i] = {"type": "Multi" + name, "coordinates": coordinates}
+            else:
+                # Single geometries are promoted to one-part multi geometries
+                # in a ragged array shared with multi geometries
+                encoded[i] = {"type": name, "coordinates": coordinates[0] if multi else coordinates}
+
+    # Anything else, e.g. geometry collections, goes through shapely
+    for i in np.flatnonzero(~np.isin(type_ids, [-1, *MULTI_TYPE_IDS, 0, 1, 3])).tolist():
+        encoded[i] = mapping(shapely.set_precision(geometries[i], 10.0 ** -precision))
+    return encoded
+
+
+def _json_properties(df):
+    # NaN and NaT become null, and timestamps ISO strings, as with GeoDataFrame.to_json
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].map(lambda t: t.isoformat(), na_action="ignore")
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def geodataframe_to_geojson(gdf, precision=COORDINATE_PRECISION, geometry=None):
+    """
+    A GeoJSON feature collection for ``gdf``, as Python objects
+
+    This gives the same features as ``json.loads(gdf.to_json())``, with the
+    index as the id of each feature and the other columns as its properties,
+    but builds them directly from the geometries, with the coordinates
+    rounded to ``precision`` decimal places, rather than writing and then
+    parsing JSON text. If ``geometry`` is given, those geometries (one for
+    each row, e.g. simplified versions) are encoded instead of the
+    geometry column.
+    """
+    if geometry is None:
+        geometry = gdf.geometry.values
+    geometries = encode_geometries(geometry, precision)
+    properties = _json_properties(gdf.drop(columns=gdf.geometry.name))
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"id": str(index), "type": "Feature", "properties": props, "geometry": geometry}
+            for index, props, geometry in zip(gdf.index, properties, geometries)
+        ],
+    }
+
+
+def region_precision(data, zoom, precision=COORDINATE_PRECISION):
+    """
+    The number of decimal places the coordinates of the regions of the
+    GeoRegionData ``data`` are rounded to at zoom level ``zoom``: a grid no
+    coarser than the simplification tolerance of the zoom level, and at most
+    ``precision``
+    """
+    pyramid = data.simplification
+    band = pyramid.band(zoom)
+    if band is None:
+        return precision
+    return grid_precision(pyramid.tolerance(band), precision)
+
+
+def region_features(data, rows, zoom, precision=COORDINATE_PRECISION):
+    """
+    A GeoJSON feature collection for the regions at positions ``rows`` of
+    the GeoRegionData ``data``, drawn at zoom level ``zoom``
+
+    The geometries and properties of all the regions are encoded the first
+    time they are needed and kept in the ``geojson_cache`` of the data. The
+    layers for the data and for all its subsets share them, so showing a
+    new selection only builds a feature for each selected region. The id of
+    each feature is the position of the region in ``data``.
+
+    The geometries are taken from the `SimplificationPyramid` level for the
+    zoom level, with their coordinates rounded to a grid no coarser than
+    its simplification tolerance (half a pixel), and to at most
+    ``precision`` decimal places.
+    """
+    pyramid = data.simplification
+    precision = region_precision(data, zoom, precision)
+    geometry_key = ("geometry", pyramid.band(zoom), precision)
+    if geometry_key not in data.geojson_cache:
+        data.geojson_cache[geometry_key] = encode_geometries(pyramid.level(zoom), precision)
+    if "properties" not in data.geojson_cache:
+        gdf = GeoPandasTranslator._to_geodataframe(data)
+        data.geojson_cache["properties"] = _json_properties(gdf.drop(columns=gdf.geometry.name))
+    geometries = data.geojson_cache[geometry_key]
+    properties = data.geojson_cache["properties"]
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"id": str(row), "type": "Feature", "properties": properties[row], "geometry": geometries[row]}
+            for row in np.asarray(rows).tolist()
+        ],
+    }
@@ -1,14 +1,15 @@
-import json
+import abc
 import random
 
 import ipyleaflet
 import numpy as np
 from glue.core.exceptions import IncompatibleAttribute
 from glue.core.data import Data
+from glue.core.subset import Subset
 from glue.utils import color2hex, ensure_numerical
 from glue.viewers.common.layer_artist import LayerArtist
-from glue_jupyter.link import link
-from ipyleaflet.leaflet import CircleMarker, GeoJSON, Heatmap, LayerGroup, ImageOverlay
+from ipywidgets import CallbackDispatcher
+from ipyleaflet.leaflet import GeoJSON, Heatmap, ImageOverlay, TileLayer, VectorTileLayer
 import matplotlib.pyplot as plt
 import PIL
 import PIL.Image
@@ -20,8 +21,22 @@ from rasterio.warp import reproject, Resampling
 from time import time
 from glue.core.data_derived import IndexedData
 
-from ..data import GeoPandasTranslator
+from ..data import tempo_quality_mask
 from .state import MapPointsLayerState, MapRegionLayerState, MapXarrayLayerState
+from .binary import HAS_ANYWIDGET, FeatureChannel, pack_colors, pack_geometries, pack_mask, pack_points
+from .clusters import HEAT_CELL_LEVELS, PointClusters
+from .geojson import COORDINATE_PRECISION, region_features, region_precision, zoom_precision
+from .playback import FramePlayer
+from .tiles import MAX_TILE_ZOOM, PointDensityTiles, get_tile_server, quadtree_codes
+from .utils import LRUCache, payload_meter, values_to_hex, values_to_radii
+from .vector_tiles import RegionVectorTiles, vector_tile_style
+from .viewport import (
+    PointViewportIndex,
+    bounds_contain,
+    expand_bounds,
+    points_in_bounds,
+    region_viewport_indices,
+)
 # from glue.logger import logger
 
 
@@ -30,6 +45,13 @@ from .state import MapPointsLayerState, MapRegionLayerState, MapXarrayLayerState
 
 __all__ = ["MapRegionLayerArtist", "MapPointsLayerArtist","MapXarrayLayerArtist"]
 
+# The index maps of reprojected grids are cached up to this many bytes
+REPROJECTION_CACHE_BYTES = 256 * 1024 ** 2
+_reprojection_indices = LRUCache(REPROJECTION_CACHE_BYTES)
+
+# Rendered frames of each xarray layer are cached up to this many bytes by default
+FRAME_CACHE_BYTES = 256 * 1024 ** 2
+
 
 RESET_TABLE_PROPERTIES = (
     "mode",
@@ -43,9 +65,160 @@ RESET_TABLE_PROPERTIES = (
 )
 
 
-class MapPointsLayerArtist(LayerArtist):
+class SharedStyleGeoJSON(GeoJSON):
+    """
+    A GeoJSON layer whose ``style`` is shared by all the features
+
+    Unlike GeoJSON, ``style`` is not merged into a deep copy of every feature
+    in Python. It is sent as it is and applied to all the features in the
+    browser, on top of the ``style`` in the properties of each feature, so
+    changing the shared style does not send the features again.
+    ``style_callback`` is not supported.
+    """
+
+    def _get_data(self):
+        return self.data
+
+
+class PointsGeoJSON(SharedStyleGeoJSON):
+    """
+    A GeoJSON layer for drawing many points as circle markers
+
+    Changing the colour, size or opacity shared by all points does not send
+    the points again.
+    """
+
+
+def points_to_geojson(lat, lon, colors=None, radii=None, precision=COORDINATE_PRECISION):
+    """
+    Pack points into a GeoJSON FeatureCollection for a `PointsGeoJSON` layer
+
+    Points that share a style are sent as a single MultiPoint feature, so the
+    payload is not much more than the coordinates, rounded to ``precision``
+    decimal places. ``colors`` (hex strings) and ``radii`` are per-point
+    styles. If either is None that part of the style is left to the layer.
+    Points with non-finite coordinates are dropped.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    keep = np.isfinite(lat) & np.isfinite(lon)
+    coords = np.round(np.column_stack([lon[keep], lat[keep]]), precision)
+
+    names, uniques, indices = [], [], []
+    for name, values in (("fillColor", colors), ("radius", radii)):
+        if values is not None:
+            unique, index = np.unique(np.asarray(values)[keep], return_inverse=True)
+            names.append(name)
+            uniques.append(unique)
+            indices.append(index)
+    shape = [len(unique) for unique in uniques]
+    if indices:
+        group = np.ravel_multi_index(indices, shape)
+    else:
+        group = np.zeros(len(coords), dtype=int)
+
+    groups, group = np.unique(group, return_inverse=True)
+    order = np.argsort(group, kind="stable")
+    chunks = np.split(coords[order], np.cumsum(np.bincount(group, minlength=len(groups)))[:-1])
+    features = []
+    for key, chunk in zip(groups, chunks):
+        style = {}
+        for name, unique, i in zip(names, uniques, np.unravel_index(key, shape)):
+            style[name] = unique[i].item()
+        features.append(
+            {
+                "type": "Feature",
+                "properties": {"style": style},
+                "geometry": {"type": "MultiPoint", "coordinates": chunk.tolist()},
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def clusters_to_geojson(lat, lon, counts, radii, precision=COORDINATE_PRECISION):
+    """
+    A GeoJSON FeatureCollection with one point per cluster for a `PointsGeoJSON`
+    layer, with the number of points in the cluster as its ``count`` property
+    """
+    lat = np.round(lat, precision)
+    lon = np.round(lon, precision)
+    features = [
+        {
+            "type": "Feature",
+            "properties": {"count": count, "style": {"radius": radius}},
+            "geometry": {"type": "Point", "coordinates": [x, y]},
+        }
+        for x, y, count, radius in zip(
+            np.asarray(lon).tolist(), np.asarray(lat).tolist(), np.asarray(counts).tolist(), np.asarray(radii).tolist()
+        )
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+class VectorMapLayerArtist(LayerArtist):
     """
-    Display a collection of points on a map
+    A base class for the layer artists that send points or regions to the
+    map, either those within the map bounds or as tiles
+    """
+
+    _removed = False
+    # The display modes in which only what is within the map bounds plus a
+    # margin is sent, by _send_visible
+    _culled_modes = ()
+    # Whether features are sent as binary buffers through a FeatureChannel
+    # rather than as GeoJSON, which needs anywidget
+    binary_transport = HAS_ANYWIDGET
+    # The FeatureChannel of the map layer, if the features are sent through one
+    _channel = None
+
+    def _send(self, name, value, widget=None):
+        # Set a trait of the map layer (or of ``widget``), reporting the
+        # update to payload_meter
+        setattr(self.map_layer if widget is None else widget, name, value)
+        payload_meter.record(self, name, value)
+
+    def _open_channel(self, map_layer, kind, **traits):
+        # A FeatureChannel to send the features of a new map layer through,
+        # if binary_transport is set (the channel of the old map layer is
+        # closed by _make_map_layer)
+        if self.binary_transport:
+            self._channel = FeatureChannel(layer=map_layer, kind=kind, **traits)
+
+    def _close_channel(self):
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
+
+    @abc.abstractmethod
+    def _send_visible(self):
+        # Send what is within the map bounds plus a margin, or everything if
+        # the bounds are not known yet
+        pass
+
+    def _on_bounds_change(self, bounds):
+        # Nothing is sent while the viewport stays within the margin of the last update
+        if (
+            self._removed
+            or bounds is None
+            or self.state.display_mode not in self._culled_modes
+            or (self._sent_bounds is not None and bounds_contain(self._sent_bounds, bounds))
+        ):
+            return
+        self._send_visible()
+
+    def _render_tile(self, z, x, y):
+        # Called from the tile server thread, with the tile source of the
+        # tiled display mode (None in the other modes)
+        tiles = self._tiles
+        if tiles is None:
+            return None
+        return tiles(z, x, y)
+
+
+class MapPointsLayerArtist(VectorMapLayerArtist):
+    """
+    Display a collection of points on a map, as individual points, density
+    tiles, clusters or a heatmap
 
     Because most of the properties of the heatmap do not update dynamically:
 
@@ -58,7 +231,8 @@ class MapPointsLayerArtist(LayerArtist):
     """
 
     _layer_state_cls = MapPointsLayerState
-    _removed = False
+    _culled_modes = ("Individual Points", "Heatmap")
+    coordinate_precision = COORDINATE_PRECISION
 
     def __init__(self, viewer_state, map=None, layer_state=None, layer=None):
         super(MapPointsLayerArtist, self).__init__(
@@ -71,22 +245,193 @@ class MapPointsLayerArtist(LayerArtist):
         self.zorder = self.state.zorder
         self.visible = self.state.visible
 
-        self._coords = []
-        self._markers = (
-            []
-        )  # These are the layers/markers to be plotted in Individual Points mode
-        if self.state.display_mode == "Individual Points":
-            self.map_layer = LayerGroup(layers=self._markers)
-        else:  # Heatmap is the default
-            self.map_layer = Heatmap(locations=self._coords)
+        self._coords = []  # These are the locations for the Heatmap
+        self._lat = np.array([])
+        self._lon = np.array([])
+        # Per-point fill colours and radii in Individual Points mode, or None
+        # when all points have the same colour/size
+        self._point_colors = None
+        self._point_radii = None
+        # The indices of the points last sent through a FeatureChannel, in
+        # the order they were sent
+        self._sent_points = np.array([], dtype=int)
+        # The tile source in Density Tiles mode, and the base URL it is served from
+        self._tiles = None
+        self._tile_url = None
+        self._tile_version = 0
+        # The cluster index in Clustered mode, and the zoom level last shown
+        self._clusters = None
+        self._cluster_level = None
+        # The binned points in Heatmap mode, and the zoom level last shown
+        self._heat_bins = None
+        self._heat_level = None
+        # The index of the points in the viewport, and the bounds the points
+        # last sent were culled to (None if they were not culled)
+        self._viewport_index = None
+        self._sent_bounds = None
+        self.map_layer = self._make_map_layer()
 
         self.map.add_layer(self.map_layer)
 
         self.state.add_global_callback(self._update_presentation)
+        self._viewer_state.add_callback("zoom_level", self._on_zoom_level_change)
+        self._viewer_state.add_callback("bounds", self._on_bounds_change)
         # self._viewer_state.add_global_callback(self._update_presentation)
 
         # self._update_presentation(force=True)
 
+    def _point_style(self):
+        """
+        The style shared by all the points in Individual Points and Clustered modes
+        """
+        clustered = self.state.display_mode == "Clustered"
+        style = {"stroke": False, "fillOpacity": self.state.alpha}
+        if clustered or self._point_colors is None:
+            style["fillColor"] = color2hex(self.state.color)
+        if not clustered and self._point_radii is None:
+            style["radius"] = self.state.size * self.state.size_scaling
+        return style
+
+    def _cluster_geojson(self):
+        lat, lon, counts = self._clusters.clusters(self._viewer_state.zoom_level)
+        self._cluster_level = self._clusters.zoom_to_level(self._viewer_state.zoom_level)
+        radii = self.state.size * self.state.size_scaling * (1 + np.log10(counts))
+        precision = zoom_precision(self._cluster_level, self.coordinate_precision)
+        return clusters_to_geojson(lat, lon, counts, radii, precision)
+
+    def _on_zoom_level_change(self, zoom_level):
+        # The cluster index is reused, only the clusters for the new zoom level are sent
+        if self._removed:
+            return
+        if self.state.display_mode == "Clustered":
+            if self._clusters is not None and self._clusters.zoom_to_level(zoom_level) != self._cluster_level:
+                self._send("data", self._cluster_geojson())
+        elif self.state.display_mode == "Heatmap":
+            if self._heat_bins is not None and self._heat_bins.zoom_to_level(zoom_level) != self._heat_level:
+                self._send_visible()
+
+    def _heat_weights(self):
+        """
+        The weight of each point in Heatmap mode, or None if they all weigh 1
+        """
+        if self.state.heatmap_weight == "Size attribute":
+            att = self.state.size_att
+        elif self.state.heatmap_weight == "Color attribute":
+            att = self.state.cmap_att
+        else:
+            return None
+        if att is None:
+            return None
+        weights = np.nan_to_num(ensure_numerical(self.layer[att]).astype(float).ravel())
+        weights = np.clip(weights, 0, None)
+        mean = weights.mean() if len(weights) else 0
+        return weights / mean if mean > 0 else weights
+
+    def _heat_locations(self):
+        """
+        The latitudes, longitudes and weights of the heatmap locations within
+        the map bounds plus a margin, and the decimal places to send them with
+        """
+        zoom = self._viewer_state.zoom_level
+        lat, lon, _ = self._heat_bins.clusters(zoom)
+        weights = self._heat_bins.totals(zoom)
+        self._heat_level = self._heat_bins.zoom_to_level(zoom)
+        if self._viewer_state.bounds is None:
+            self._sent_bounds = None
+        else:
+            self._sent_bounds = expand_bounds(self._viewer_state.bounds)
+            inside = points_in_bounds(lat, lon, self._sent_bounds)
+            lat, lon, weights = lat[inside], lon[inside], weights[inside]
+        return lat, lon, weights, zoom_precision(self._heat_level, self.coordinate_precision)
+
+    def _visible_points(self):
+        """
+        The indices of the points within the map bounds plus a margin, or a
+        slice of all the points if the bounds are not known yet
+        """
+        if self._viewer_state.bounds is None:
+            self._sent_bounds = None
+            return slice(None)
+        if self._viewport_index is None:
+            self._viewport_index = PointViewportIndex(self._lat, self._lon)
+        self._sent_bounds = expand_bounds(self._viewer_state.bounds)
+        return self._viewport_index.query(self._sent_bounds)
+
+    def _send_visible(self):
+        if self.state.display_mode == "Individual Points":
+            visible = self._visible_points()
+            lat, lon = self._lat[visible], self._lon[visible]
+            if self._channel is not None:
+                # Sorted along a quadtree curve, so that the differences
+                # between consecutive points are small
+                keep = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+                keep = keep[np.argsort(quadtree_codes(lon[keep], lat[keep]), kind="stable")]
+                self._sent_points = np.arange(len(self._lat))[visible][keep]
+                self._send("geometry", pack_points(lat[keep], lon[keep], self.coordinate_precision), self._channel)
+                self._send_point_styles()
+                return
+            colors = None if self._point_colors is None else self._point_colors[visible]
+            radii = None if self._point_radii is None else self._point_radii[visible]
+            self._send("data", points_to_geojson(lat, lon, colors, radii, self.coordinate_precision))
+        elif self._heat_bins is not None:
+            lat, lon, weights, precision = self._heat_locations()
+            if self._channel is not None:
+                self._send("geometry", pack_points(lat, lon, precision), self._channel)
+                self._send("weights", weights.astype("<f4").tobytes(), self._channel)
+                return
+            self._coords = np.column_stack([np.round(lat, precision), np.round(lon, precision), weights]).tolist()
+            self._send("locations", self._coords)
+
+    def _send_point_styles(self):
+        """
+        Send the colours and radii of the points in Individual Points mode
+
+        Through a FeatureChannel, only those of the points last sent are
+        sent, if they have changed. As GeoJSON, the points are grouped by
+        their style, so they are all sent again.
+        """
+        if self._channel is None:
+            self._send_visible()
+            return
+        points = self._sent_points
+        colors = pack_colors(None if self._point_colors is None else self._point_colors[points])
+        if colors != self._channel.colors:
+            self._send("colors", colors, self._channel)
+        radii = None
+        if self._point_radii is not None:
+            radii = np.clip(self._point_radii[points], 0, np.iinfo(np.uint16).max).astype("<u2").tobytes()
+        if radii != self._channel.radii:
+            self._send("radii", radii, self._channel)
+
+    def _make_map_layer(self):
+        # The points themselves are sent by _update_presentation
+        self._close_channel()
+        if self.state.display_mode in ("Individual Points", "Clustered"):
+            style = self._point_style()
+            map_layer = PointsGeoJSON(data=points_to_geojson([], []), point_style=style, style=style)
+            if self.state.display_mode == "Individual Points":
+                self._open_channel(map_layer, "points")
+            return map_layer
+        elif self.state.display_mode == "Density Tiles":
+            if self._tile_url is None:
+                self._tile_url = get_tile_server().register(self.layer_id, self._render_tile)
+            return TileLayer(
+                url=f"{self._tile_url}?v={self._tile_version}",
+                opacity=self.state.alpha,
+                max_native_zoom=MAX_TILE_ZOOM,
+            )
+        else:  # Heatmap is the default
+            # This is not quite right because we don't have state objects
+            # that describe all these other things that go into a Heatmap
+            map_layer = Heatmap(locations=[] if self.binary_transport else self._coords)
+            self._open_channel(map_layer, "locations")
+            return map_layer
+
+    def _refresh_tiles(self):
+        # A new URL makes the map reload the tiles
+        self._tile_version += 1
+        self.map_layer.url = f"{self._tile_url}?v={self._tile_version}"
+
     def clear(self):
         if self.map_layer is not None:
             try:
@@ -98,6 +443,12 @@ class MapPointsLayerArtist(LayerArtist):
     def remove(self):
         self._removed = True
         self.clear()
+        self._close_channel()
+        self._viewer_state.remove_callback("zoom_level", self._on_zoom_level_change)
+        self._viewer_state.remove_callback("bounds", self._on_bounds_change)
+        if self._tile_url is not None:
+            get_tile_server().unregister(self.layer_id)
+            self._tiles = None
 
     def redraw(self):
         pass
@@ -117,17 +468,15 @@ class MapPointsLayerArtist(LayerArtist):
         ):
             return
 
-        self._markers = []
-        if self.map_layer.layers is not None:
-            self.map_layer.layers = self._markers
-
         self._update_presentation(force=True)
 
     def _update_presentation(self, force=False, **kwargs):
         """
         We need to add a new boolean mode --
             heatmap: which is the default for large? datasets but does not have a lot of options
-            layer_group of circle markers: which can do all the cmap and size stuff
+            individual points: a single layer of circle markers which can do all the cmap and size stuff
+            density tiles: raster tiles of the point density, for datasets too large to send to the browser
+            clustered: one marker per cluster of points at the current zoom level
 
         """
         # print(f"Updating layer_artist for points in {self.layer.label} with {force=}")
@@ -145,30 +494,27 @@ class MapPointsLayerArtist(LayerArtist):
 
         # my_logger.debug(f"updating Map for points in {self.layer.label} with {force=}")
 
+        individual_points = self.state.display_mode == "Individual Points"
+        density_tiles = self.state.display_mode == "Density Tiles"
+        clustered = self.state.display_mode == "Clustered"
+        heatmap = not (individual_points or density_tiles or clustered)
+        # Whether the points, or only their colours and radii, rather than
+        # just the shared style, have to be resent
+        points_changed = False
+        styles_changed = False
+        tiles_changed = False
+        clusters_changed = False
+
         if "display_mode" in changed:
             # print("Updating display_mode")
-            if self.state.display_mode == "Individual Points":
-                try:
-                    self.map.remove_layer(self.map_layer)
-                    self.map_layer = LayerGroup(layers=self._markers)
-                    self.map.add_layer(self.map_layer)
-                except ipyleaflet.LayerException:
-                    pass
-            else:
-                self.map.remove_layer(self.map_layer)
-                self.map_layer = Heatmap(
-                    locations=self._coords
-                )  # This is not quite right
-                # because we don't have state objects that describe all these other things that go into a Heatmap
-                self.map.add_layer(self.map_layer)
+            self.clear()
+            self.map_layer = self._make_map_layer()
 
         if self.visible is False:
             self.clear()
-        else:
-            try:
-                self.map.add_layer(self.map_layer)
-            except ipyleaflet.LayerException:
-                pass
+        elif self.map_layer not in self.map.layers:
+            # Not try/except LayerException, since its message has the repr of the whole layer
+            self.map.add_layer(self.map_layer)
 
         if force or any(x in changed for x in ["lon_att", "lat_att", "display_mode"]):
             # print("Inside lat/lon if statement")
@@ -187,27 +533,19 @@ class MapPointsLayerArtist(LayerArtist):
             if not len(lon):
                 return
 
-            locs = list(zip(lat, lon))
-            self._coords = locs
-            if self.state.display_mode == "Individual Points":
-                try:
-                    self._markers = []
-                except:  # noqa 722
-                    pass
-                for lat, lon in self._coords:
-                    self._markers.append(
-                        CircleMarker(
-                            location=(lat, lon),
-                            stroke=False,
-                            fill_color=color2hex(self.state.color),
-                            fill_opacity=self.state.alpha,
-                        )
-                    )  # Might want to make this an option.
-                    # This is not quite right, we should store the current colors in a state var?
-                    # Otherwise, we do not get the colormap value back when toggling display_mode...
-                self.map_layer.layers = self._markers  # layers is the attribute here
-            else:
-                self.map_layer.locations = self._coords
+            self._lat = np.asarray(lat, dtype=float).ravel()
+            self._lon = np.asarray(lon, dtype=float).ravel()
+            self._viewport_index = None
+            self._heat_bins = None
+            if individual_points or heatmap:
+                points_changed = True
+            elif density_tiles:
+                self._tiles = PointDensityTiles(self._lat, self._lon, self.state.cmap)
+                tiles_changed = True
+            elif clustered:
+                # The index is only rebuilt when the points change, not on zoom
+                self._clusters = PointClusters(self._lat, self._lon)
+                clusters_changed = True
 
         if force or any(
             x in changed
@@ -222,7 +560,7 @@ class MapPointsLayerArtist(LayerArtist):
             ]
         ):
             # print("Updating color")
-            if self.state.display_mode == "Individual Points":
+            if individual_points:
                 if (
                     self.state.color_mode == "Linear"
                     and self.state.cmap_att is not None
@@ -239,20 +577,23 @@ class MapPointsLayerArtist(LayerArtist):
                     # print("Calculating colors...")
 
                     if "cmap_vmin" not in changed and "cmap_att" in changed:
-                        self.state.cmap_vmin = min(color_values)
+                        self.state.cmap_vmin = np.nanmin(color_values)
                     if "cmap_vmax" not in changed and "cmap_att" in changed:
-                        self.state.cmap_vmax = max(color_values)
-                    diff = (
-                        self.state.cmap_vmax - self.state.cmap_vmin or 1
-                    )  # to avoid div by zero
-                    normalized_vals = (color_values - self.state.cmap_vmin) / diff
-                    for marker, val in zip(self._markers, normalized_vals):
-                        marker.fill_color = color2hex(self.state.cmap(val))
+                        self.state.cmap_vmax = np.nanmax(color_values)
+                    self._point_colors = values_to_hex(
+                        color_values, self.state.cmap_vmin, self.state.cmap_vmax, self.state.cmap
+                    )
+                    styles_changed = True
                 else:
-                    for marker in self._markers:
-                        marker.fill_color = color2hex(self.state.color)
+                    styles_changed |= self._point_colors is not None
+                    self._point_colors = None
 
-            else:
+            elif density_tiles:
+                if self._tiles is not None and self._tiles.cmap is not self.state.cmap:
+                    self._tiles.cmap = self.state.cmap
+                    tiles_changed = True
+
+            elif heatmap:
                 try:
                     self.map.remove_layer(self.map_layer)
                     color = color2hex(self.state.color)
@@ -274,6 +615,8 @@ class MapPointsLayerArtist(LayerArtist):
             ]
         ):
             # print("Updating size")
+            # Cluster markers are sized from size and size_scaling
+            clusters_changed |= clustered
             if self.state.size_mode == "Linear" and self.state.size_att is not None:
                 # print("Linear mode is active")
                 try:
@@ -286,31 +629,25 @@ class MapPointsLayerArtist(LayerArtist):
                     self.disable_invalid_attributes(self.state.size_att)
                     return
 
-                if self.state.display_mode == "Individual Points":
+                if individual_points:
                     #print("Calculating sizes")
                     if "size_vmin" not in changed and "size_att" in changed:
-                        self.state.size_vmin = min(
+                        self.state.size_vmin = np.nanmin(
                             size_values
                         )  # Actually we only want to update this if we swap size_att
                     if "size_vmax" not in changed and "size_att" in changed:
-                        self.state.size_vmax = max(size_values)
-                    diff = self.state.size_vmax - self.state.size_vmin
-                    normalized_vals = (size_values - self.state.size_vmin) / diff
-                    # print(f'{self._markers=}')
-                    # self.map.remove_layer(self.map_layer)
-                    for marker, val in zip(self._markers, normalized_vals):
-                        marker.radius = int(
-                            (val + 1) * self.state.size_scaling * 5
-                        )  # So we always show the points
-                        # print(int(val)+1)
-                # self.map.add_layer(self.map_layer)
+                        self.state.size_vmax = np.nanmax(size_values)
+                    self._point_radii = values_to_radii(
+                        size_values, self.state.size_vmin, self.state.size_vmax, self.state.size_scaling
+                    )  # So we always show the points
+                    styles_changed = True
 
             else:
                 size_values = None
-                if self.state.display_mode == "Individual Points":
-                    for marker in self._markers:
-                        marker.radius = self.state.size * self.state.size_scaling
-                else:
+                if individual_points:
+                    styles_changed |= self._point_radii is not None
+                    self._point_radii = None
+                elif heatmap:
                     try:
                         self.map.remove_layer(self.map_layer)
                         self.map_layer.radius = (
@@ -322,10 +659,9 @@ class MapPointsLayerArtist(LayerArtist):
                         pass
 
         if force or "alpha" in changed:
-            if self.state.display_mode == "Individual Points":
-                for marker in self._markers:
-                    marker.fill_opacity = self.state.alpha
-            else:
+            if density_tiles:
+                self.map_layer.opacity = self.state.alpha
+            elif heatmap:
                 try:
                     self.map.remove_layer(self.map_layer)
                     self.map_layer.min_opacity = (
@@ -335,18 +671,182 @@ class MapPointsLayerArtist(LayerArtist):
                 except ipyleaflet.LayerException:
                     pass
 
+        if heatmap and (
+            self._heat_bins is None
+            or any(x in changed for x in ["heatmap_weight", "size_att", "cmap_att"])
+        ):
+            # The bins are only rebuilt when the points or weights change, not on zoom
+            try:
+                weights = self._heat_weights()
+            except IncompatibleAttribute:
+                if self.state.heatmap_weight == "Size attribute":
+                    self.disable_invalid_attributes(self.state.size_att)
+                else:
+                    self.disable_invalid_attributes(self.state.cmap_att)
+                return
+            self._heat_bins = PointClusters(self._lat, self._lon, weights, cell_levels=HEAT_CELL_LEVELS)
+            points_changed = True
+
+        if individual_points:
+            if points_changed:
+                self._send_visible()
+            elif styles_changed:
+                self._send_point_styles()
+            self.map_layer.style = self._point_style()
+        elif heatmap and points_changed:
+            self._send_visible()
+        elif clustered:
+            if clusters_changed and self._clusters is not None:
+                self._send("data", self._cluster_geojson())
+            self.map_layer.style = self._point_style()
+        elif density_tiles and tiles_changed:
+            self._refresh_tiles()
+
         self.enable()
 
 
-class MapRegionLayerArtist(LayerArtist):
+class SharedRegions:
     """
-    Display a GeoRegionData datafile on top of a Basemap (.map is controlled by Viewer State)
+    A base class for what the layers of a GeoRegionData and of its subsets
+    share, looked up by key
+
+    Each layer gets the shared object with `acquire` and gives it back with
+    `release`, and it is closed once no layer uses it.
+    """
+
+    # The shared objects of each subclass, by key
+    _instances = None
+
+    def __init__(self, key, data):
+        self.key = key
+        self.data = data
+        self._users = 0
+
+    @classmethod
+    def acquire(cls, key, data):
+        if key not in cls._instances:
+            cls._instances[key] = cls(key, data)
+        shared = cls._instances[key]
+        shared._users += 1
+        return shared
+
+    def release(self):
+        self._users -= 1
+        if self._users == 0:
+            del self._instances[self.key]
+            self.close()
+
+    def close(self):
+        pass
+
 
+class SharedRegionGeometry(SharedRegions):
+    """
+    The geometries of the regions of a GeoRegionData within the bounds of a
+    map, in a FeatureChannel that the channels of the layers of the data and
+    its subsets on the map take them from
+
+    The geometries of all the regions within the bounds are sent once, and
+    each layer only sends which of them it shows, as a bitmask.
+    """
+
+    _instances = {}
+
+    def __init__(self, key, data):
+        super().__init__(key, data)
+        self.channel = FeatureChannel()
+        # The simplification pyramid, zoom band and bounds of the geometries last sent
+        self._sent = None
+
+    def send(self, layer_artist, bounds, zoom, precision=COORDINATE_PRECISION):
+        """
+        Send the geometries of the regions within ``bounds`` plus a margin
+        (or of all the regions if ``bounds`` is None), drawn at zoom level
+        ``zoom``, unless those last sent cover them, and return the bounds
+        they were culled to
+        """
+        pyramid = self.data.simplification
+        band = pyramid.band(zoom)
+        if self._sent is not None:
+            sent_pyramid, sent_band, sent_bounds = self._sent
+            if sent_pyramid is pyramid and sent_band == band:
+                if bounds is None and sent_bounds is None:
+                    return sent_bounds
+                if bounds is not None and sent_bounds is not None and bounds_contain(sent_bounds, bounds):
+                    return sent_bounds
+        if bounds is None:
+            rows = np.arange(self.data.size)
+            sent_bounds = None
+        else:
+            sent_bounds = expand_bounds(bounds)
+            rows = region_viewport_indices(self.data.spatial_index, sent_bounds)
+        precision = region_precision(self.data, zoom, precision)
+        layer_artist._send("geometry", pack_geometries(pyramid.level(zoom)[rows], rows, precision), self.channel)
+        self._sent = (pyramid, band, sent_bounds)
+        return sent_bounds
+
+    def close(self):
+        self.channel.close()
+
+
+class SharedRegionTiles(SharedRegions):
+    """
+    The vector tiles of the regions of a GeoRegionData, served from a single
+    URL for the layers of the data and its subsets on every map, which
+    select the regions they show in their style (see `vector_tile_style`)
+
+    Called from the tile server thread with ``(z, x, y)``, like `RegionVectorTiles`.
+    """
+
+    _instances = {}
+
+    def __init__(self, key, data):
+        super().__init__(key, data)
+        self._tiles = None
+        self._pyramid = None
+        self._version = 0
+        self._name = f"regions-{key}"
+        self._url = get_tile_server().register(self._name, self, "pbf")
+
+    @property
+    def url(self):
+        """
+        The URL of the tiles, which changes when the geometries of the data
+        do, to make the maps reload them
+        """
+        pyramid = self.data.simplification
+        if pyramid is not self._pyramid:
+            self._pyramid = pyramid
+            self._tiles = RegionVectorTiles(self.data)
+            self._version += 1
+        return f"{self._url}?v={self._version}"
+
+    def __call__(self, z, x, y):
+        tiles = self._tiles
+        if tiles is None:
+            return None
+        return tiles(z, x, y)
 
+    def close(self):
+        get_tile_server().unregister(self._name)
+        self._tiles = None
+
+
+class MapRegionLayerArtist(VectorMapLayerArtist):
+    """
+    Display a GeoRegionData datafile on top of a Basemap (.map is controlled by Viewer State)
+
+    The regions within the map bounds are sent as GeoJSON simplified for the
+    zoom level (see `region_features`), or all of them as vector tiles.
+    Through FeatureChannels, or as vector tiles, the layers of a data set and
+    of its subsets share the geometries of its regions (see
+    `SharedRegionGeometry` and `SharedRegionTiles`), and each only sends
+    which regions it shows.
     """
 
     _layer_state_cls = MapRegionLayerState
-    _removed = False
+    _culled_modes = ("GeoJSON",)
+    coordinate_precision = COORDINATE_PRECISION
 
     # We probably have to (if possible) make this actually blank
     _fake_geo_json = {
@@ -370,6 +870,9 @@ class MapRegionLayerArtist(LayerArtist):
         ],
     }
 
+    # What the layer starts with when the regions are sent through a FeatureChannel
+    _empty_geo_json = {"type": "FeatureCollection", "features": []}
+
     def __init__(self, viewer_state, map=None, layer_state=None, layer=None):
         # my_logger.warning(f"Calling _init_...")
 
@@ -385,24 +888,198 @@ class MapRegionLayerArtist(LayerArtist):
         self.border_weight = 0.5  # This could be user-adjustable
 
         self._regions = self._fake_geo_json
-        self.map_layer = GeoJSON(
-            data=self._regions,
-            style={
-                "fillColor": self.state.color,
-                "fillOpacity": self.state.alpha,
-                "opacity": self.state.alpha,
-                "color": self.state.color,
-                "weight": self.border_weight,
-            },
-            hover_style={
-                "fillOpacity": self.state.alpha + 0.2,
-                "opacity": self.state.alpha + 0.2,
+        # The positions in the data of the regions in the layer (None until
+        # they are first shown), and of the regions last sent
+        self._rows = None
+        self._sent_rows = None
+        # The bounds the regions last sent were culled to (None if they were
+        # not culled), and the zoom band of their simplified geometries
+        self._sent_bounds = None
+        self._sent_band = None
+        # The colour of every region of the data in Linear colour mode (None otherwise)
+        self._region_colors = None
+        # The SharedRegionTiles of the data, from when Vector Tiles mode is
+        # first shown, and the SharedRegionGeometry of the data on the map
+        # while the regions are sent through a FeatureChannel
+        self._tiles = None
+        self._geometry = None
+        # Called with the position in the data of a region clicked on
+        self._click_callbacks = CallbackDispatcher()
+        self.map_layer = self._make_map_layer()
+
+        self.state.add_callback("visible", self._on_visible_change)
+        self.state.add_global_callback(self._update_presentation)
+        self._viewer_state.add_callback("bounds", self._on_bounds_change)
+        self._viewer_state.add_callback("zoom_level", self._on_zoom_level_change)
+        # self._viewer_state.add_global_callback(self._update_presentation)
+
+    def _make_map_layer(self):
+        # The regions themselves are sent by _update_presentation
+        self._close_channel()
+        if self.state.display_mode == "Vector Tiles":
+            if self._tiles is None:
+                self._tiles = SharedRegionTiles.acquire(self.layer.data.uuid, self.layer.data)
+            map_layer = VectorTileLayer(
+                url=self._tiles.url,
+                layer_styles=self._tile_style(),
+                visible=self.state.visible,
+                interactive=True,
+            )
+        else:
+            map_layer = SharedStyleGeoJSON(
+                data=self._empty_geo_json if self.binary_transport else self._regions,
+                style=self._region_style(),
+                hover_style=self._hover_style(),
+                visible=self.state.visible,
+            )
+            if self.binary_transport:
+                key = (self.map.model_id, self.layer.data.uuid)
+                self._geometry = SharedRegionGeometry.acquire(key, self.layer.data)
+                self._open_channel(map_layer, "regions", source=self._geometry.channel)
+        map_layer.on_click(self._on_region_click)
+        return map_layer
+
+    def on_click(self, callback, remove=False):
+        """
+        Call ``callback(row)`` with the position in the data of the region
+        clicked on, whichever the display mode, or stop calling it if
+        ``remove`` is True
+        """
+        self._click_callbacks.register_callback(callback, remove=remove)
+
+    def _on_region_click(self, properties=None, **kwargs):
+        # GeoJSON features have the row as their id, and features of vector
+        # tiles as their id property. Others, such as the placeholder shown
+        # before the regions, are not regions of the data.
+        region_id = kwargs.get("id")
+        if region_id is None and properties is not None:
+            region_id = properties.get("id")
+        if str(region_id).isdigit():
+            self._click_callbacks(int(region_id))
+
+    def _on_visible_change(self, visible):
+        self.map_layer.visible = visible
+
+    def _close_channel(self):
+        super()._close_channel()
+        if self._geometry is not None:
+            self._geometry.release()
+            self._geometry = None
+
+    def _selection(self):
+        """
+        A boolean mask of the regions of the data in the layer, or None for
+        the layer of the data itself
+        """
+        if isinstance(self.layer, Data) or self._rows is None:
+            return None
+        selected = np.zeros(self.layer.data.size, dtype=bool)
+        selected[self._rows] = True
+        return selected
+
+    def _refresh_tiles(self):
+        # The tiles are shared with the layers of the data and its subsets,
+        # and only have a new URL (to make the map reload them) when the
+        # geometries of the data change. The regions in the layer are
+        # selected by the style.
+        self.map_layer.url = self._tiles.url
+        self.map_layer.layer_styles = self._tile_style()
+
+    def _send_visible(self):
+        if self._rows is None:
+            return  # The regions have not been shown yet
+        data = self.layer.data
+        zoom = self._viewer_state.zoom_level
+        if self._channel is not None:
+            # The geometries of all the regions of the data on the map are
+            # sent once for all its layers, and this layer only sends which
+            # of them it shows
+            self._sent_bounds = self._geometry.send(self, self._viewer_state.bounds, zoom, self.coordinate_precision)
+            self._sent_band = data.simplification.band(zoom)
+            selected = self._selection()
+            selected = None if selected is None else pack_mask(selected)
+            if selected != self._channel.selected:
+                self._send("selected", selected, self._channel)
+            self._send_colors()
+            return
+        rows = self._rows
+        if self._viewer_state.bounds is None:
+            self._sent_bounds = None
+        else:
+            self._sent_bounds = expand_bounds(self._viewer_state.bounds)
+            visible = region_viewport_indices(data.spatial_index, self._sent_bounds)
+            rows = rows[np.isin(rows, visible, assume_unique=True)]
+        self._sent_rows = rows
+        self._sent_band = data.simplification.band(zoom)
+        self._regions = region_features(data, rows, zoom, self.coordinate_precision)
+        self._send_colors()
+
+    def _send_colors(self):
+        """
+        Send the regions last encoded, with the colour of each region in Linear colour mode
+
+        Through a FeatureChannel, only the colours of all the regions of the
+        data are sent, if they have changed.
+        """
+        if self._channel is not None:
+            colors = pack_colors(self._region_colors)
+            if colors != self._channel.colors:
+                self._send("colors", colors, self._channel)
+            return
+        if self._region_colors is None:
+            self._send("data", self._regions)
+            return
+        colors = self._region_colors[self._sent_rows].tolist()
+        self._send(
+            "data",
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {**feature, "properties": {**feature["properties"], "style": {"fillColor": color, "color": color}}}
+                    for feature, color in zip(self._regions["features"], colors)
+                ],
             },
         )
-        link((self.state, "visible"), (self.map_layer, "visible"))
 
-        self.state.add_global_callback(self._update_presentation)
-        # self._viewer_state.add_global_callback(self._update_presentation)
+    def _region_style(self):
+        """
+        The style shared by all the regions
+        """
+        style = {"fillOpacity": self.state.alpha, "opacity": self.state.alpha, "weight": self.border_weight}
+        if self._region_colors is None:
+            style["fillColor"] = style["color"] = self.state.color
+        return style
+
+    def _hover_style(self):
+        return {"fillOpacity": self.state.alpha + 0.2, "opacity": self.state.alpha + 0.2}
+
+    def _tile_style(self):
+        """
+        The ``layer_styles`` of the vector tiles, colouring the regions by
+        their ids in Linear colour mode, and only drawing the regions in the
+        layer for subsets
+        """
+        style = {"fillOpacity": self.state.alpha, "opacity": self.state.alpha, "weight": self.border_weight}
+        if self._region_colors is None:
+            style["fillColor"] = style["color"] = self.state.color
+        return vector_tile_style(style, self._region_colors, self._selection())
+
+    def _restyle(self):
+        if self.state.display_mode == "Vector Tiles":
+            self.map_layer.layer_styles = self._tile_style()
+        else:
+            self.map_layer.style = self._region_style()
+            self.map_layer.hover_style = self._hover_style()
+
+    def _on_zoom_level_change(self, zoom_level):
+        if (
+            self._removed
+            or self._rows is None
+            or self.state.display_mode == "Vector Tiles"
+            or self.layer.data.simplification.band(zoom_level) == self._sent_band
+        ):
+            return
+        self._send_visible()
 
     def clear(self):
         if self.map_layer is not None:
@@ -415,6 +1092,12 @@ class MapRegionLayerArtist(LayerArtist):
     def remove(self):
         self._removed = True
         self.clear()
+        self._close_channel()
+        self._viewer_state.remove_callback("bounds", self._on_bounds_change)
+        self._viewer_state.remove_callback("zoom_level", self._on_zoom_level_change)
+        if self._tiles is not None:
+            self._tiles.release()
+            self._tiles = None
 
     def redraw(self):
         pass
@@ -453,6 +1136,16 @@ class MapRegionLayerArtist(LayerArtist):
         if self._viewer_state.lon_att is None or self._viewer_state.lat_att is None:
             self.clear()
 
+        vector_tiles = self.state.display_mode == "Vector Tiles"
+        # Whether the geometries or only the colours of the regions have to be resent
+        regions_changed = False
+        colors_changed = False
+
+        if "display_mode" in changed:
+            self.clear()
+            self.map_layer = self._make_map_layer()
+            regions_changed = True
+
         if self.visible is False:
             self.clear()
         else:
@@ -482,9 +1175,11 @@ class MapRegionLayerArtist(LayerArtist):
                 return
             # my_logger.warning(f"Updating map_layer.data with regions...")
 
-            gdf = GeoPandasTranslator().to_object(self.layer)
-            self._regions = json.loads(gdf.to_json())
-            self.map_layer.data = self._regions
+            if isinstance(self.layer, Subset):
+                self._rows = np.flatnonzero(self.layer.to_mask())
+            else:
+                self._rows = np.arange(self.layer.size)
+            regions_changed = True
 
         if force or any(
             x in changed
@@ -495,6 +1190,7 @@ class MapRegionLayerArtist(LayerArtist):
                 "cmap_vmin",
                 "cmap_vmax",
                 "color",
+                "display_mode",
             ]
         ):
             if (
@@ -503,72 +1199,49 @@ class MapRegionLayerArtist(LayerArtist):
                 and self.state.cmap is not None
             ):
                 try:
+                    # Colours are computed for all the regions of the data,
+                    # to be indexed by the ids of the features
                     cmap_values = (
-                        ensure_numerical(self.layer[self.state.cmap_att])
+                        ensure_numerical(self.layer.data[self.state.cmap_att])
                         .astype(np.float32)
                         .ravel()
                     )
                 except IncompatibleAttribute:
                     self.disable_invalid_attributes(self.state.cmap_att)
                     return
+                layer_values = cmap_values if self._rows is None else cmap_values[self._rows]
                 if "cmap_vmin" not in changed and "cmap_att" in changed:
-                    self.state.cmap_vmin = min(
-                        cmap_values
+                    self.state.cmap_vmin = np.nanmin(
+                        layer_values
                     )  # We only want to update this if we swap cmap_att, otherwise allow vmin and vmax to change
                 if "cmap_vmax" not in changed and "cmap_att" in changed:
-                    self.state.cmap_vmax = max(cmap_values)
-                diff = self.state.cmap_vmax - self.state.cmap_vmin
-                normalized_vals = (cmap_values - self.state.cmap_vmin) / diff
-                mapping = dict(
-                    zip(
-                        [str(x) for x in self.layer["Pixel Axis 0 [x]"]],
-                        normalized_vals,
-                    )
+                    self.state.cmap_vmax = np.nanmax(layer_values)
+                self._region_colors = values_to_hex(
+                    cmap_values, self.state.cmap_vmin, self.state.cmap_vmax, self.state.cmap
                 )
-
-                def feature_color(feature):
-                    feature_name = feature["id"]
-                    region_color = color2hex(self.state.cmap(mapping[feature_name]))
-                    return {
-                        "fillColor": region_color,
-                        "color": region_color,
-                        "weight": self.border_weight,
-                    }
-
-                # This logic does not seem to work when we change the color first and then go back to linear?
-                old_style = self.map_layer.style
-                if "color" in old_style:
-                    del old_style["color"]
-                if "fillColor" in old_style:
-                    del old_style["fillColor"]
-
-                # my_logger.warning(f"Setting color for Linear color...")
-
-                self.map_layer.style = old_style
-                # We need to blank these https://github.com/jupyter-widgets/ipyleaflet/issues/675#issuecomment-710970550
-                self.map_layer.style_callback = feature_color
+                colors_changed = True
 
             elif self.state.color_mode == "Fixed" and self.state.color is not None:
-                # my_logger.warning(f"Setting color for Fixed color...")
-                self.map_layer.style = {
-                    "color": self.state.color,
-                    "fillColor": self.state.color,
-                    "weight": self.border_weight,
-                }
+                # The shared style takes over from the colours in the features
+                self._region_colors = None
+            self._restyle()
         # if force or 'color' in changed:
         #    if self.state.color is not None and self.state.color_mode == 'Fixed':
         #        self.map_layer.style = {'color':self.state.color, 'fillColor':self.state.color}
 
         if force or "alpha" in changed:
             if self.state.alpha is not None:
-                self.map_layer.style = {
-                    "fillOpacity": self.state.alpha,
-                    "opacity": self.state.alpha,
-                }
-                self.map_layer.hover_style = {
-                    "fillOpacity": self.state.alpha + 0.2,
-                    "opacity": self.state.alpha + 0.2,
-                }
+                self._restyle()
+
+        if self._rows is not None:
+            if vector_tiles:
+                # The colours and the selection are in the style
+                if regions_changed:
+                    self._refresh_tiles()
+            elif regions_changed:
+                self._send_visible()
+            elif colors_changed:
+                self._send_colors()
 
         self.enable()
 
@@ -576,9 +1249,15 @@ class MapRegionLayerArtist(LayerArtist):
 class MapXarrayLayerArtist(LayerArtist):
     """
     Display a regularly gridded Xarray dataset on the map as an ImageOverlay
+
+    Rendered time slices are kept in ``frame_cache``, and played through
+    with a `FramePlayer` while ``playing`` is set.
     """
     _layer_state_cls = MapXarrayLayerState
     _removed = False
+    frame_cache_bytes = FRAME_CACHE_BYTES
+    colormap = "coolwarm"
+    proj_refinement = 1
 
     def __init__(self, viewer_state, map=None, layer_state=None, layer=None):
         super().__init__(
@@ -594,20 +1273,89 @@ class MapXarrayLayerArtist(LayerArtist):
         self.vmax = 1
         self.map.add(self.image_overlay_layer)
         self.bounds = [(0, 0), (0, 0)]
+        self.frame_cache = LRUCache(self.frame_cache_bytes)
+        # The array the cached frames were rendered from
+        self._frames_xarr = None
+        self.player = FramePlayer(self._prefetch_frame, self._show_frame, self.state.t_max + 1, fps=self.state.fps)
+        self.player.seek(self.state.t)
         if isinstance(self.layer, Data):
             self._sliced_data = IndexedData(self.layer, indices=(self.state.t, None, None))
         else:
             self._sliced_data = None
+
+        self.state.add_global_callback(self._update_presentation)
+        self.state.add_callback("t", self.player.seek)
+        self.state.add_callback("t_max", self._on_t_max_change)
+        self.state.add_callback("playing", self._on_playing_change)
+        self.state.add_callback("fps", self._on_fps_change)
         #  In theory we want something like this to link the opacity of the layer to the alpha of the state
         #  dlink((self.state, 'alpha'), (self.image_overlay_layer, 'opacity'), lambda x: [x])
 
     def remove(self):
         self._removed = True
         self.clear()
+        self.player.close()
+        self.frame_cache.clear()
+
+    def _on_playing_change(self, playing):
+        if playing:
+            self.player.play()
+        else:
+            self.player.pause()
+
+    def _on_fps_change(self, fps):
+        self.player.fps = fps
+
+    def _on_t_max_change(self, t_max):
+        self.player.n_frames = t_max + 1
+
+    def _prefetch_frame(self, t):
+        # Called from the playback threads
+        if (
+            self._removed
+            or self.state.data_att is None
+            or not isinstance(self.layer, Data)
+            or getattr(self, "norm_func", None) is None
+        ):
+            return
+        self._render_frame(t)
+
+    def _show_frame(self, t):
+        self.state.t = t
 
     def redraw(self):
         pass
 
+    def _render_frame(self, t):
+        """
+        The image URL of time slice ``t``, from the frame cache if it was rendered before
+        """
+        if getattr(self.layer, "xarr", None) is not self._frames_xarr:
+            self.frame_cache.clear()
+            self._frames_xarr = getattr(self.layer, "xarr", None)
+        key = (
+            self.state.data_att.uuid,
+            t,
+            self.state.quality_flag,
+            self.colormap,
+            self.vmin,
+            self.vmax,
+            self.proj_refinement,
+            tuple(map(tuple, self.bounds)),
+        )
+        imgurl = self.frame_cache.get(key)
+        if imgurl is None:
+            # Not read through _sliced_data, so that frames can be rendered in other threads
+            data = self.layer.get_data(self.state.data_att, view=(t, slice(None), slice(None)))
+            if getattr(self.layer, "quality", None) is not None:
+                # Only the quality class of this time slice is read
+                quality_class = np.asarray(self.layer.quality[t])
+                data = np.where(tempo_quality_mask(quality_class, self.state.quality_flag), data, np.nan)
+            imgurl = make_imageoverlay(data, self.bounds, self.norm_func,
+                                       proj_refinement=self.proj_refinement, colormap=self.colormap)
+            self.frame_cache.put(key, imgurl)
+        return imgurl
+
     def update(self):
         if (
             self.map is None
@@ -616,6 +1364,8 @@ class MapXarrayLayerArtist(LayerArtist):
             or self._viewer_state.lon_att is None
         ):
             return
+        # The time axis may have grown if new data was appended
+        self.state.update_time_range()
         self._update_presentation(force=True)
 
     def _update_presentation(self, force=False, **kwargs):
@@ -674,16 +1424,11 @@ class MapXarrayLayerArtist(LayerArtist):
                     return array
                 self.norm_func = normalize_over_full_data
 
-        if force or any(x in changed for x in ["lon_att", "lat_att", "t"]):
+        if force or any(x in changed for x in ["lon_att", "lat_att", "t", "quality_flag"]):
             if isinstance(self.layer, Data):
                 self._sliced_data.indices = (self.state.t, None, None)
             # Check if this is a data or a subset layer
-                data = self._sliced_data.get_data(self.state.data_att)
-                #print(f"data loaded {time()}")
-                #print(f"Data shape: {data.shape}")
-
-                imgurl = make_imageoverlay(data, self.bounds, self.norm_func,
-                                            proj_refinement=1, colormap='coolwarm')
+                imgurl = self._render_frame(self.state.t)
                 #print(f"imgrul made {time()}")
 
                 self.image_overlay_layer.url = imgurl
@@ -694,15 +1439,9 @@ class MapXarrayLayerArtist(LayerArtist):
         self.enable()
 
 
-def project_array(array, bounds, refinement=2):
+def _warp_array(array, bounds, refinement=2):
     """
-    Project a numpy array defined in WGS84 coordinates to Mercator Web coordinate system
-    
-    ipyleaflets use the Mercator Web coordinate system.
-    :arg array: Data in 2D numpy array
-    :arg bounds: Image latitude, longitude bounds, [(lat_min, lon_min), (lat_max, lon_max)]
-    :kwarg int refinement: Scaling factor for output array resolution.
-        refinement=1 implies that output array has the same size as the input.
+    Warp ``array`` from WGS84 to Web Mercator with rasterio
     """
     with rasterio.Env():
 
@@ -734,6 +1473,52 @@ def project_array(array, bounds, refinement=2):
         return destination
 
 
+def reprojection_indices(shape, bounds, refinement=2):
+    """
+    Map the pixels of the Web Mercator projection of an array to the array
+
+    Returns, for each pixel of the projection by `project_array` of an
+    array of ``shape`` within ``bounds``, the index of the pixel it is taken
+    from in the flattened array, or the size of the array if it is outside
+    the array. The map is computed once for each grid, by warping the
+    indices themselves, and cached in an `LRUCache`, unless it is larger
+    than the whole budget of the cache, in which case it is recomputed.
+    """
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    key = (tuple(shape), float(lat_min), float(lon_min), float(lat_max), float(lon_max), refinement)
+    indices = _reprojection_indices.get(key)
+    if indices is None:
+        size = int(np.prod(shape))
+        # Indices are offset by one, as pixels outside the array are set to zero
+        source = np.arange(1, size + 1, dtype=float).reshape(shape)
+        # 32-bit indices halve the size of the maps of all but huge grids
+        dtype = np.int32 if size < np.iinfo(np.int32).max else np.intp
+        indices = _warp_array(source, bounds, refinement).astype(dtype) - 1
+        indices[indices < 0] = size
+        _reprojection_indices.put(key, indices)
+    return indices
+
+
+def project_array(array, bounds, refinement=2):
+    """
+    Project a numpy array defined in WGS84 coordinates to Mercator Web coordinate system
+    
+    ipyleaflets use the Mercator Web coordinate system.
+    :arg array: Data in 2D numpy array
+    :arg bounds: Image latitude, longitude bounds, [(lat_min, lon_min), (lat_max, lon_max)]
+    :kwarg int refinement: Scaling factor for output array resolution.
+        refinement=1 implies that output array has the same size as the input.
+
+    The projection is a single lookup with the index map from
+    `reprojection_indices`, which is shared by all the arrays on a grid
+    (e.g. every time slice of a data cube, and their masks).
+    """
+    indices = reprojection_indices(np.shape(array), bounds, refinement)
+    # Pixels outside the array take the zero appended to it
+    values = np.append(np.asarray(array, dtype=float).ravel(), 0)
+    return values[indices]
+
+
 def make_imageoverlay(array, bounds, norm_func, mask=None, colormap='Blues', proj_refinement=4):
     """
     Make ImageOverlay from numpy array.
@@ -0,0 +1,150 @@
+"""
+Playback of the frames of a layer (e.g. time slices) at a steady rate,
+with the upcoming frames rendered in the background.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ["FramePlayer"]
+
+# Frames are rendered this far ahead of the playback clock
+PREFETCH_FRAMES = 4
+
+# The number of threads rendering frames for each player
+PLAYBACK_WORKERS = 2
+
+
+class FramePlayer:
+    """
+    Step through ``n_frames`` frames at ``fps`` frames per second
+
+    ``render(frame)`` renders a frame in a thread pool, and is expected to
+    cache it (e.g. in an `LRUCache`), and ``show(frame)`` is then called on
+    the event loop to display it, which should find the frame in that cache.
+    While playing, the frames up to ``prefetch`` ahead of the playback clock
+    are rendered in the background.
+
+    The clock does not wait for rendering: each tick shows the latest frame
+    up to the clock that has been rendered, and the frames skipped are
+    counted in ``dropped``. Rendering that is no longer needed, because the
+    clock has passed the frame or the player was moved to another frame with
+    `seek`, is cancelled if it has not started. Playback loops back to the
+    first frame after the last one.
+
+    Playing needs a running asyncio event loop, as in a Jupyter kernel.
+    """
+
+    def __init__(self, render, show, n_frames, fps=5, prefetch=PREFETCH_FRAMES, max_workers=PLAYBACK_WORKERS):
+        self._render = render
+        self._show = show
+        self.n_frames = n_frames
+        self.prefetch = prefetch
+        self.max_workers = max_workers
+        self.frame = 0
+        self.dropped = 0
+        self._fps = fps
+        self._executor = None
+        self._futures = {}
+        self._loop = None
+        self._handle = None
+        # The frame and loop time that the playback clock started from, and
+        # how many frames on from it the frame shown is
+        self._start_frame = 0
+        self._start_time = 0
+        self._position = 0
+
+    @property
+    def playing(self):
+        return self._handle is not None
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @fps.setter
+    def fps(self, fps):
+        self._fps = fps
+        if self.playing:
+            self._restart_clock()
+
+    def play(self):
+        if self.playing or self.n_frames < 1:
+            return
+        self._loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="glue-map-playback")
+        self._restart_clock()
+        self._prefetch(self.frame)
+        self._schedule()
+
+    def pause(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._cancel_stale(set())
+
+    def seek(self, frame):
+        """
+        Move to ``frame``, e.g. when the user picks another frame while playing
+        """
+        if frame == self.frame:
+            return
+        self.frame = frame
+        if self.playing:
+            self._restart_clock()
+            self._prefetch(frame)
+
+    def close(self):
+        # Pausing cancels the frames that have not started rendering, which
+        # is what cancel_futures would do on Python 3.9+
+        self.pause()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _restart_clock(self):
+        self._start_frame = self.frame
+        self._start_time = self._loop.time()
+        self._position = 0
+
+    def _clock(self):
+        # The number of frames since the clock started
+        return int((self._loop.time() - self._start_time) * self._fps)
+
+    def _schedule(self):
+        next_tick = self._start_time + (self._clock() + 1) / self._fps
+        self._handle = self._loop.call_at(next_tick, self._tick)
+
+    def _prefetch(self, frame):
+        # Render the frames from frame to prefetch ahead, and cancel the rest
+        window = [(frame + i) % self.n_frames for i in range(min(self.prefetch + 1, self.n_frames))]
+        self._cancel_stale(set(window))
+        for upcoming in window:
+            if upcoming not in self._futures:
+                self._futures[upcoming] = self._executor.submit(self._render, upcoming)
+
+    def _cancel_stale(self, keep):
+        # Frames that are being rendered are kept, and shown if they are the
+        # latest ones ready when the next tick comes
+        for frame, future in list(self._futures.items()):
+            if frame not in keep and (future.cancel() or future.done()):
+                del self._futures[frame]
+
+    def _tick(self):
+        elapsed = self._clock()
+        try:
+            # The latest rendered frame that the clock has reached
+            lag = elapsed - self._position
+            for step in range(lag, max(lag - self.n_frames, 0), -1):
+                future = self._futures.get((self.frame + step) % self.n_frames)
+                if future is not None and future.done():
+                    self.dropped += step - 1
+                    self._position += step
+                    self.frame = (self.frame + step) % self.n_frames
+                    self._show(self.frame)
+                    break
+            self._prefetch((self._start_frame + elapsed) % self.n_frames)
+        finally:
+            # Unless showing the frame paused playback
+            if self._handle is not None:
+                self._schedule()
@@ -9,13 +9,19 @@ from glue.core.data_combo_helper import ComponentIDComboHelper
 from glue.core.state_objects import StateAttributeLimitsHelper
 from glue.core.subset import Subset
 from glue.viewers.common.state import LayerState, ViewerState
-from ipyleaflet import basemaps, TileLayer
+from ipyleaflet import basemaps, TileLayer, VectorTileLayer
+
+from ..data import TEMPO_QUALITY_LEVELS
 
 # my_logger = logging.getLogger("")
 # my_logger.setLevel(logging.WARNING)
 
 __all__ = ["MapViewerState", "MapRegionLayerState", "MapPointsLayerState"]
 
+# VectorTileLayer takes layer_styles (including JavaScript style functions)
+# and visible from ipyleaflet 0.19, before which there is no Vector Tiles mode
+HAS_VECTOR_TILE_STYLES = "layer_styles" in VectorTileLayer.class_trait_names()
+
 
 class MapViewerState(ViewerState):
     """
@@ -34,6 +40,10 @@ class MapViewerState(ViewerState):
         (40, -100), docstring="(Lon, Lat) at the center of the map"
     )
     zoom_level = CallbackProperty(4, docstring="Zoom level for the map")
+    bounds = CallbackProperty(
+        None,
+        docstring="((south, west), (north, east)) of the visible map, or None before the map is shown",
+    )
 
     # We really need a way to set these automagically for structured data
     lon_att = SelectionCallbackProperty(
@@ -85,6 +95,7 @@ class MapRegionLayerState(LayerState):
     size = CallbackProperty()
     alpha = CallbackProperty()
 
+    display_mode = SelectionCallbackProperty(default_index=0)
     color_mode = SelectionCallbackProperty(default_index=0)
     cmap_att = SelectionCallbackProperty()
     cmap_vmin = CallbackProperty()
@@ -123,6 +134,8 @@ class MapRegionLayerState(LayerState):
 
         self.cmap = colormaps.members[1][1]
 
+        display_modes = ["GeoJSON", "Vector Tiles"] if HAS_VECTOR_TILE_STYLES else ["GeoJSON"]
+        MapRegionLayerState.display_mode.set_choices(self, display_modes)
         MapRegionLayerState.color_mode.set_choices(self, ["Fixed", "Linear"])
 
         if isinstance(layer, Subset):
@@ -177,6 +190,10 @@ class MapPointsLayerState(LayerState):
     alpha = CallbackProperty()
 
     display_mode = SelectionCallbackProperty(default_index=0)
+    heatmap_weight = SelectionCallbackProperty(
+        default_index=0,
+        docstring="What each point adds to the Heatmap: 1, or the value of size_att or cmap_att",
+    )
 
     size_mode = SelectionCallbackProperty(default_index=0)
     size = CallbackProperty()
@@ -192,8 +209,8 @@ class MapPointsLayerState(LayerState):
     cmap = CallbackProperty()
     cmap_mode = color_mode
 
-    #size_limits_cache = CallbackProperty()
-    #cmap_limits_cache = CallbackProperty()
+    size_limits_cache = CallbackProperty({})
+    cmap_limits_cache = CallbackProperty({})
 
     name = ""  # Name for display
 
@@ -240,8 +257,9 @@ class MapPointsLayerState(LayerState):
         self.cmap = colormaps.members[1][1]
 
         MapPointsLayerState.display_mode.set_choices(
-            self, ["Individual Points", "Heatmap"]
+            self, ["Individual Points", "Heatmap", "Density Tiles", "Clustered"]
         )
+        MapPointsLayerState.heatmap_weight.set_choices(self, ["Count", "Size attribute", "Color attribute"])
         MapPointsLayerState.color_mode.set_choices(self, ["Fixed", "Linear"])
         MapPointsLayerState.size_mode.set_choices(self, ["Fixed", "Linear"])
 
@@ -309,6 +327,7 @@ class MapXarrayLayerState(LayerState):
     alpha = CallbackProperty()
 
     t = CallbackProperty(7)
+    t_max = CallbackProperty(0, docstring="The last index along the time axis")
     data_att = SelectionCallbackProperty()
 
     color_mode = SelectionCallbackProperty(default_index=0)
@@ -318,6 +337,11 @@ class MapXarrayLayerState(LayerState):
     cmap = CallbackProperty()
     cmap_mode = color_mode
     as_steps = CallbackProperty(False)
+    quality_flag = SelectionCallbackProperty(
+        default_index=0, docstring="The quality level to show, for data with a quality class"
+    )
+    playing = CallbackProperty(False, docstring="Whether the layer is playing through the time axis")
+    fps = CallbackProperty(5, docstring="The number of time slices to play per second")
     #cmap_limits_cache = CallbackProperty({})
 
     name = ""  # Name for display
@@ -354,9 +378,15 @@ class MapXarrayLayerState(LayerState):
         self.cmap = colormaps.members[1][1]
 
         MapXarrayLayerState.color_mode.set_choices(self, ["Fixed", "Linear"])
+        MapXarrayLayerState.quality_flag.set_choices(self, list(TEMPO_QUALITY_LEVELS))
 
         if isinstance(layer, Subset):
             self.name = f"{self.name} {(self.layer.data.label)}"
+            data = layer.data
+        else:
+            data = layer
+        if getattr(data, "quality_flag", None) is not None:
+            self.quality_flag = data.quality_flag
 
         self.update_from_dict(kwargs)
 
@@ -371,6 +401,17 @@ class MapXarrayLayerState(LayerState):
                 self.cmap_att_helper.set_multiple_data([self.layer])
                 self.data_att_helper.set_multiple_data([self.layer])
                 self.data_att = self.layer.main_components[0]
+                self.update_time_range()
+
+    def update_time_range(self):
+        """
+        Keep t_max (and t) in step with the length of the time axis,
+        which can grow when new data is appended to the layer
+        """
+        if self.layer is not None:
+            self.t_max = self.layer.shape[0] - 1
+            if self.t > self.t_max:
+                self.t = self.t_max
 
     def _layer_changed(self):
         """
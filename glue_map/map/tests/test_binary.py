@@ -0,0 +1,82 @@
+import geopandas
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+from shapely.geometry import GeometryCollection, LineString, MultiPoint, MultiPolygon, Point, Polygon
+
+from glue_map.map.binary import pack_colors, pack_geometries, pack_mask, pack_points, unpack_geometries
+from glue_map.map.geojson import encode_geometries
+from glue_map.map.utils import payload_size
+
+
+def flatten(coordinates):
+    if np.isscalar(coordinates[0]):
+        return list(coordinates)
+    return [value for part in coordinates for value in flatten(part)]
+
+
+@pytest.mark.parametrize("name", ["naturalearth_lowres", "nybb"])
+def test_matches_encode_geometries(name):
+    geometries = geopandas.read_file(geopandas.datasets.get_path(name)).geometry.values
+    ids = np.arange(len(geometries)) * 3
+    unpacked = dict(unpack_geometries(pack_geometries(geometries, ids, 3)))
+    expected = encode_geometries(geometries, 3)
+    assert sorted(unpacked) == ids.tolist()
+    for i, geometry in zip(ids.tolist(), expected):
+        assert unpacked[i]["type"] == geometry["type"]
+        assert_allclose(flatten(unpacked[i]["coordinates"]), flatten(geometry["coordinates"]), atol=1e-9, rtol=0)
+
+
+def test_mixed_geometries():
+    square = Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])
+    geometries = [
+        square,
+        MultiPolygon([square, Polygon([(2, 2), (3, 2), (3, 3)])]),
+        LineString([(0, 0), (-1.23456789, 1)]),
+        None,
+        Polygon(),
+        GeometryCollection([Point(0.1, 0.2)]),
+        Point(1, 2),
+        MultiPoint([(3, 4), (5, 6)]),
+    ]
+    unpacked = dict(unpack_geometries(pack_geometries(geometries, np.arange(len(geometries)), 2)))
+    # Missing, empty and other geometries are left out
+    assert sorted(unpacked) == [0, 1, 2, 6, 7]
+    assert unpacked[0] == {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+    assert unpacked[1]["type"] == "MultiPolygon"
+    assert len(unpacked[1]["coordinates"]) == 2
+    assert unpacked[2] == {"type": "LineString", "coordinates": [[0, 0], [-1.23, 1]]}
+    assert unpacked[6] == {"type": "Point", "coordinates": [1, 2]}
+    assert unpacked[7] == {"type": "MultiPoint", "coordinates": [[3, 4], [5, 6]]}
+
+
+def test_pack_points():
+    rng = np.random.default_rng(0)
+    lat, lon = rng.uniform(-80, 80, 1000), rng.uniform(-180, 180, 1000)
+    packed = pack_points(lat, lon, 4)
+    coordinates = np.array([geometry["coordinates"] for _, geometry in unpack_geometries(packed)])
+    assert_allclose(coordinates, np.column_stack([lon, lat]), atol=0.5e-4, rtol=0)
+    # Less than 8 bytes per point even unsorted, rather than 40 for full floats
+    assert payload_size(packed) < 8 * 1000
+    assert unpack_geometries(pack_points([], [], 4)) == []
+
+
+def test_pack_colors_and_mask():
+    colors = np.array(["#ff0000", "#00ff00", "#ff0000"])
+    packed = pack_colors(colors)
+    index = np.frombuffer(packed["index"], dtype=np.uint8)
+    assert_array_equal(np.array(packed["palette"])[index], colors)
+    assert pack_colors(None) == {}
+
+    many = np.array(["#{:06x}".format(i) for i in range(300)])
+    packed = pack_colors(many)
+    assert packed["width"] == 2
+    assert_array_equal(np.array(packed["palette"])[np.frombuffer(packed["index"], dtype="<u2")], many)
+
+    mask = np.array([True, False, False, True, False, False, False, False, True])
+    assert pack_mask(mask) == bytes([0b1001, 0b1])
+
+
+def test_payload_size():
+    assert payload_size({"a": [1, 2]}) == len('{"a": [1, 2]}')
+    assert payload_size({"a": b"1234", "b": [memoryview(b"12")]}) == len('{"a": null, "b": [null]}') + 6
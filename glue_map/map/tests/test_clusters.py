@@ -0,0 +1,47 @@
+import numpy as np
+
+from glue_map.map.clusters import PointClusters
+
+
+def test_point_clusters():
+    rng = np.random.default_rng(0)
+    n = 50000
+    lat = np.append(rng.normal(40, 3, n), np.nan)
+    lon = np.append(rng.normal(-100, 8, n), 0)
+    clusters = PointClusters(lat, lon)
+    assert len(clusters) == n
+
+    previous = 0
+    for zoom in range(0, 12, 2):
+        cluster_lat, cluster_lon, counts = clusters.clusters(zoom)
+        assert counts.sum() == n
+        assert len(counts) >= previous
+        previous = len(counts)
+        # Cluster positions are the means of their points
+        np.testing.assert_allclose(np.sum(cluster_lat * counts), np.nansum(lat), rtol=1e-9)
+        np.testing.assert_allclose(np.sum(cluster_lon * counts), np.sum(lon[:-1]), rtol=1e-9)
+
+    # A few hundred clusters for a national view, and results are cached per zoom level
+    assert 10 < len(clusters.clusters(4)[2]) < 1000
+    assert clusters.clusters(4.2)[2] is clusters.clusters(4)[2]
+
+
+def test_point_clusters_empty():
+    lat, lon, counts = PointClusters([], []).clusters(3)
+    assert len(lat) == len(lon) == len(counts) == 0
+
+
+def test_point_clusters_weights():
+    rng = np.random.default_rng(1)
+    n = 20000
+    lat = rng.normal(40, 3, n)
+    lon = rng.normal(-100, 8, n)
+    weights = rng.random(n)
+    coarse = PointClusters(lat, lon, weights)
+    fine = PointClusters(lat, lon, weights, cell_levels=6)
+    assert len(fine.totals(4)) > len(coarse.totals(4))
+    for clusters in (coarse, fine):
+        np.testing.assert_allclose(clusters.totals(4).sum(), weights.sum())
+        assert len(clusters.totals(4)) == len(clusters.clusters(4)[0])
+    # Without weights the totals are the counts
+    np.testing.assert_array_equal(PointClusters(lat, lon).totals(4), coarse.clusters(4)[2])
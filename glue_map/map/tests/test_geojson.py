@@ -0,0 +1,71 @@
+import json
+
+import geopandas
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from shapely.geometry import GeometryCollection, LineString, MultiPolygon, Point, Polygon
+
+from glue_map.map.geojson import COORDINATE_PRECISION, geodataframe_to_geojson, grid_precision, zoom_precision
+
+
+def flatten(coordinates):
+    if np.isscalar(coordinates[0]):
+        return list(coordinates)
+    return [value for part in coordinates for value in flatten(part)]
+
+
+@pytest.mark.parametrize("name", ["naturalearth_lowres", "nybb", "naturalearth_cities"])
+def test_matches_to_json(name):
+    gdf = geopandas.read_file(geopandas.datasets.get_path(name))
+    expected = json.loads(gdf.to_json())
+    encoded = geodataframe_to_geojson(gdf, precision=3)
+    assert len(encoded["features"]) == len(expected["features"])
+    for feature, expected_feature in zip(encoded["features"], expected["features"]):
+        assert feature["id"] == expected_feature["id"]
+        assert feature["properties"] == expected_feature["properties"]
+        assert feature["geometry"]["type"] == expected_feature["geometry"]["type"]
+        assert_allclose(
+            flatten(feature["geometry"]["coordinates"]),
+            flatten(expected_feature["geometry"]["coordinates"]),
+            atol=1e-3,
+            rtol=0,
+        )
+    # The encoded collection is plain Python objects, ready to serialize
+    json.dumps(encoded, allow_nan=False)
+
+
+def test_mixed_geometries():
+    square = Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])
+    gdf = geopandas.GeoDataFrame(
+        {"value": [1.5, np.nan, 3, 4, 5, 6]},
+        geometry=[
+            square,
+            MultiPolygon([square, Polygon([(2, 2), (3, 2), (3, 3)])]),
+            LineString([(0, 0), (1.23456789, 1)]),
+            None,
+            Polygon(),
+            GeometryCollection([Point(0.1, 0.2)]),
+        ],
+    )
+    features = geodataframe_to_geojson(gdf, precision=2)["features"]
+    assert [f["id"] for f in features] == ["0", "1", "2", "3", "4", "5"]
+    assert features[0]["geometry"] == {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+    assert features[1]["geometry"]["type"] == "MultiPolygon"
+    assert len(features[1]["geometry"]["coordinates"]) == 2
+    assert features[1]["properties"] == {"value": None}
+    assert features[2]["geometry"] == {"type": "LineString", "coordinates": [[0, 0], [1.23, 1]]}
+    assert features[3]["geometry"] is None
+    assert features[4]["geometry"] is None
+    assert features[5]["geometry"]["type"] == "GeometryCollection"
+
+
+def test_grid_precision():
+    assert grid_precision(0.35) == 1
+    assert grid_precision(0.01) == 2
+    assert grid_precision(1000) == 0
+    assert grid_precision(1e-9) == COORDINATE_PRECISION
+    # Half a pixel is 0.7 degrees at zoom 0, and 7e-4 at zoom 10
+    assert zoom_precision(0) == 1
+    assert zoom_precision(10) == 4
+    assert zoom_precision(10, precision=3) == 3
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from glue_map.map import layer_artist
+from glue_map.map.layer_artist import _warp_array, project_array, reprojection_indices
+from glue_map.map.utils import LRUCache
+
+
+@pytest.mark.parametrize("refinement", [1, 2])
+def test_project_array(refinement):
+    rng = np.random.default_rng(0)
+    bounds = [(17.0, -140.0), (62.0, -45.0)]
+    array = rng.random((50, 80))
+    array[3, 4] = np.nan
+
+    # The same as warping each array with rasterio
+    projected = project_array(array, bounds, refinement)
+    np.testing.assert_array_equal(projected, _warp_array(array, bounds, refinement))
+    assert projected.shape == (50 * refinement, 80 * refinement)
+
+    # The index map is computed once for the grid, and shared with masks
+    indices = reprojection_indices(array.shape, bounds, refinement)
+    assert reprojection_indices(array.shape, [(17, -140), (62, -45)], refinement) is indices
+    mask = (array > 0.5).astype(float)
+    np.testing.assert_array_equal(project_array(mask, bounds, refinement), _warp_array(mask, bounds, refinement))
+    assert reprojection_indices(array.shape, [(17.0, -140.0), (60.0, -45.0)], refinement) is not indices
+
+
+def test_reprojection_indices_cache_budget(monkeypatch):
+    # Index maps are 32-bit, and those larger than the cache budget are
+    # returned without being cached or growing the budget
+    cache = LRUCache(1000)
+    monkeypatch.setattr(layer_artist, "_reprojection_indices", cache)
+    bounds = [(17.0, -140.0), (62.0, -45.0)]
+    indices = reprojection_indices((50, 80), bounds, 2)
+    assert indices.dtype == np.int32
+    assert indices.nbytes > 1000
+    assert len(cache) == 0
+    assert cache.max_bytes == 1000
+    again = reprojection_indices((50, 80), bounds, 2)
+    assert again is not indices
+    np.testing.assert_array_equal(again, indices)
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+
+from glue_map.map.playback import FramePlayer
+
+
+class Recorder:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.rendered = []
+        self.shown = []
+
+    def render(self, frame):
+        assert threading.current_thread() is not threading.main_thread()
+        time.sleep(self.delay)
+        self.rendered.append(frame)
+
+    def show(self, frame):
+        assert frame in self.rendered
+        self.shown.append(frame)
+
+
+def play(player, duration, during=None):
+    async def run():
+        player.play()
+        if during is not None:
+            await asyncio.sleep(duration / 2)
+            during()
+        await asyncio.sleep(duration / 2 if during is not None else duration)
+        player.pause()
+
+    asyncio.run(run())
+
+
+def test_frame_player_loops():
+    recorder = Recorder()
+    player = FramePlayer(recorder.render, recorder.show, 3, fps=50)
+    play(player, 0.3)
+    assert not player.playing
+    assert recorder.shown[:4] == [1, 2, 0, 1]
+    assert player.dropped == 0
+    n_shown = len(recorder.shown)
+    time.sleep(0.05)
+    assert len(recorder.shown) == n_shown
+    player.close()
+
+
+def test_frame_player_drops_frames():
+    # Rendering at 20 frames per second cannot keep up with 100
+    recorder = Recorder(delay=0.05)
+    player = FramePlayer(recorder.render, recorder.show, 1000, fps=100, max_workers=1)
+    play(player, 0.5)
+    assert recorder.shown == sorted(recorder.shown)
+    assert player.dropped > 0
+    assert player.frame == recorder.shown[-1]
+    assert recorder.shown[-1] == len(recorder.shown) + player.dropped
+    # The frames the clock passed before they were started were not rendered
+    assert len(recorder.rendered) < 20
+    player.close()
+
+
+def test_frame_player_seek():
+    recorder = Recorder(delay=0.01)
+    player = FramePlayer(recorder.render, recorder.show, 1000, fps=50, prefetch=2)
+    before = []
+
+    def jump():
+        before.extend(recorder.shown)
+        player.seek(500)
+
+    play(player, 0.4, during=jump)
+    after = recorder.shown[len(before):]
+    assert before and max(before) < 100
+    assert after and all(frame > 500 for frame in after)
+    # Work for the frames before the jump was cancelled
+    assert all(frame < 100 or frame >= 500 for frame in recorder.rendered)
+    player.close()
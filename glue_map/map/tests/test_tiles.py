@@ -0,0 +1,67 @@
+import re
+import urllib.error
+import urllib.request
+from io import BytesIO
+
+import numpy as np
+import PIL.Image
+import pytest
+from glue.config import colormaps
+
+from glue_map.map.tiles import PointDensityTiles, get_tile_server, lonlat_to_unit
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    n = 100000
+    return rng.normal(40, 3, n), rng.normal(-100, 8, n)
+
+
+@pytest.mark.parametrize("z,x,y", [(0, 0, 0), (4, 3, 6), (7, 28, 48)])
+def test_density_counts(points, z, x, y):
+    lat, lon = points
+    tiles = PointDensityTiles(lat, lon, colormaps.members[0][1])
+
+    # Brute force: the pixel of every point in the (z, x, y) tile
+    ux, uy = lonlat_to_unit(lon, lat)
+    px = np.floor(ux * 2 ** z * 256).astype(int) - x * 256
+    py = np.floor(uy * 2 ** z * 256).astype(int) - y * 256
+    inside = (px >= 0) & (px < 256) & (py >= 0) & (py < 256)
+    expected = np.bincount(py[inside] * 256 + px[inside], minlength=256 * 256).reshape(256, 256)
+
+    counts = tiles.counts(z, x, y)
+    assert counts.sum() > 0
+    np.testing.assert_array_equal(counts, expected)
+    assert tiles.max_count(z) >= counts.max()
+
+
+def test_density_tile_image(points):
+    lat, lon = points
+    tiles = PointDensityTiles(lat, lon, colormaps.members[0][1])
+    image = np.asarray(PIL.Image.open(BytesIO(tiles(4, 3, 6))))
+    assert image.shape == (256, 256, 4)
+    np.testing.assert_array_equal(image[..., 3] > 0, tiles.counts(4, 3, 6) > 0)
+    assert tiles(4, 0, 0) is None
+    assert tiles(30, 0, 0) is None
+
+
+def test_tile_server(points):
+    lat, lon = points
+    server = get_tile_server()
+    assert get_tile_server() is server
+    url = server.register("test-density", PointDensityTiles(lat, lon, colormaps.members[0][1]))
+    try:
+        response = urllib.request.urlopen(url.format(z=4, x=3, y=6) + "?v=1")
+        assert response.headers["Content-Type"] == "image/png"
+        assert PIL.Image.open(BytesIO(response.read())).size == (256, 256)
+        # Empty tiles are transparent images
+        response = urllib.request.urlopen(url.format(z=4, x=0, y=0))
+        assert response.status == 200
+        # Tiles are only served to those who were given the URL with its token
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(re.sub(r"/[^/]+/test-density/", "/guess/test-density/", url).format(z=4, x=3, y=6))
+    finally:
+        server.unregister("test-density")
+    with pytest.raises(urllib.error.HTTPError):
+        urllib.request.urlopen(url.format(z=4, x=3, y=6))
@@ -0,0 +1,173 @@
+import base64
+import json
+import re
+import struct
+
+import geopandas
+import numpy as np
+import pytest
+import shapely
+
+from glue_map.data import GeoRegionData
+from glue_map.map.vector_tiles import EXTENT, RegionVectorTiles, _varints, tile_bounds, vector_tile_style
+
+
+def read_varint(buffer, i):
+    value, shift = 0, 0
+    while True:
+        byte = buffer[i]
+        value |= (byte & 0x7F) << shift
+        i += 1
+        shift += 7
+        if byte < 0x80:
+            return value, i
+
+
+def read_fields(buffer):
+    # The (field, value) pairs of a protobuf message
+    i = 0
+    while i < len(buffer):
+        key, i = read_varint(buffer, i)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, i = read_varint(buffer, i)
+        elif wire_type == 1:
+            value, i = struct.unpack("<d", buffer[i:i + 8])[0], i + 8
+        elif wire_type == 2:
+            length, i = read_varint(buffer, i)
+            value, i = buffer[i:i + length], i + length
+        else:
+            raise ValueError(wire_type)
+        yield field, value
+
+
+def read_packed(buffer):
+    values, i = [], 0
+    while i < len(buffer):
+        value, i = read_varint(buffer, i)
+        values.append(value)
+    return values
+
+
+def decode_polygons(commands):
+    # The rings drawn by polygon geometry commands
+    rings, x, y, i = [], 0, 0, 0
+    zigzag = lambda n: (n >> 1) ^ -(n & 1)  # noqa: E731
+    while i < len(commands):
+        command, count = commands[i] & 0x7, commands[i] >> 3
+        i += 1
+        if command == 7:
+            continue
+        for _ in range(count):
+            x += zigzag(commands[i])
+            y += zigzag(commands[i + 1])
+            i += 2
+            if command == 1:
+                rings.append([])
+            rings[-1].append((x, y))
+    return [np.array(ring) for ring in rings]
+
+
+def decode_tile(tile):
+    """
+    The features of the single layer of a tile, as dicts of their id,
+    properties and polygon rings
+    """
+    (field, layer), = read_fields(tile)
+    assert field == 3
+    keys, values, features = [], [], []
+    for field, value in read_fields(layer):
+        if field == 1:
+            assert value == b"regions"
+        elif field == 2:
+            features.append(dict(read_fields(value)))
+        elif field == 3:
+            keys.append(value.decode())
+        elif field == 4:
+            values.append(dict(read_fields(value))[3])
+        elif field == 5:
+            assert value == EXTENT
+    decoded = []
+    for feature in features:
+        tags = read_packed(feature[2])
+        properties = {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])}
+        assert feature[3] == 3
+        decoded.append({"id": feature[1], "properties": properties, "rings": decode_polygons(read_packed(feature[4]))})
+    return decoded
+
+
+def signed_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)
+
+
+@pytest.fixture
+def countries():
+    gdf = geopandas.read_file(geopandas.datasets.get_path("naturalearth_lowres"))
+    return GeoRegionData(gdf, "countries")
+
+
+def test_varints():
+    values = np.array([0, 1, 127, 128, 300, 2 ** 35 + 5])
+    encoded = _varints(values)
+    assert read_packed(encoded) == values.tolist()
+    assert encoded[:4] == b"\x00\x01\x7f\x80"
+
+
+@pytest.mark.parametrize("z,x,y", [(0, 0, 0), (3, 2, 2), (5, 16, 10)])
+def test_region_tiles(countries, z, x, y):
+    tiles = RegionVectorTiles(countries)
+    features = decode_tile(tiles(z, x, y))
+
+    # The regions in the tile are the ones whose simplified geometry meets it
+    west, south, east, north = tile_bounds(z, x, y)
+    geometries = countries.simplification.level(z)
+    expected = np.flatnonzero(shapely.intersects(geometries, shapely.box(west, south, east, north)))
+    ids = [feature["id"] for feature in features]
+    assert set(expected) <= set(ids)
+    assert ids == sorted(ids)
+
+    for feature in features:
+        # The id is the only property, so the tiles do not change with the colours
+        assert feature["properties"] == {"id": feature["id"]}
+        # Exterior rings are clockwise on screen, holes anticlockwise, and
+        # everything is within the buffer around the tile
+        assert signed_area(feature["rings"][0]) > 0
+        coords = np.concatenate(feature["rings"])
+        assert coords.min() >= -128 and coords.max() <= EXTENT + 128
+
+
+def test_region_tiles_rows_and_cache(countries):
+    usa = np.flatnonzero(countries["name"] == "United States of America")
+    tiles = RegionVectorTiles(countries, rows=usa)
+    assert [feature["id"] for feature in decode_tile(tiles(1, 0, 0))] == usa.tolist()
+    assert decode_tile(tiles(1, 0, 0))[0]["properties"] == {"id": usa[0]}
+    assert tiles.cache.hits == 1
+
+    # Tiles with no regions, and tiles outside the world, are empty
+    assert tiles(1, 1, 1) is None
+    assert tiles(1, 2, 0) is None
+    assert tiles(1, 1, 1) is None
+    assert tiles.cache.hits == 2
+
+
+@pytest.mark.parametrize("n_colors", [10, 300])
+def test_vector_tile_style(n_colors):
+    style = {"fillOpacity": 0.5, "weight": 1, "fillColor": "#ff0000", "color": "#ff0000"}
+    assert vector_tile_style(style) == {"regions": {"fill": True, **style}}
+
+    colors = np.array(["#{:06x}".format(i * 997) for i in range(n_colors)])[np.arange(500) % n_colors]
+    js = vector_tile_style({"fillOpacity": 0.5}, colors)
+    assert js.startswith("(function () {")
+    # The colour of each id is its entry of the palette at its position in the index
+    palette = json.loads(re.search(r"var palette = (\[.*?\]);", js).group(1))
+    index = base64.b64decode(re.search(r'var index = new \w+\(decode\("(.*?)"\)', js).group(1))
+    index = np.frombuffer(index, dtype="<u1" if n_colors <= 256 else "<u2")
+    assert (np.array(palette)[index] == colors).all()
+
+    # Subsets only draw their regions, with one bit for each region of the data
+    selected = np.arange(500) % 3 == 0
+    js = vector_tile_style({"fillOpacity": 0.5}, selected=selected)
+    bits = base64.b64decode(re.search(r'var selected = decode\("(.*?)"\)', js).group(1))
+    assert len(bits) == 63
+    assert (np.unpackbits(np.frombuffer(bits, dtype=np.uint8), bitorder="little")[:500] == selected).all()
@@ -1,19 +1,63 @@
+import asyncio
+import json
 import os
+import re
 
 import geopandas
 import glue_jupyter as gj
 import numpy as np
 import pandas as pd
 import pytest
+import shapely
+import xarray as xr
+from glue.config import colormaps
 from glue.core import Data
+from glue.utils import color2hex
+from ipyleaflet import TileLayer, VectorTileLayer
 from numpy.testing import assert_allclose
 
-from glue_map.data import GeoRegionData
-from glue_map.map.state import MapRegionLayerState
+from glue_map.data import GeoRegionData, XarrayCoordinates, XarrayData
+from glue_map.map.binary import HAS_ANYWIDGET, FeatureChannel, unpack_geometries
+from glue_map.map.geojson import region_features
+from glue_map.map.layer_artist import (
+    PointsGeoJSON,
+    SharedRegionGeometry,
+    SharedRegionTiles,
+    VectorMapLayerArtist,
+    points_to_geojson,
+)
+from glue_map.map.state import HAS_VECTOR_TILE_STYLES, MapRegionLayerState
+from glue_map.map.utils import Debounced, LRUCache, get_geom_type, payload_meter, values_to_hex, values_to_radii
 
 DATA = os.path.join(os.path.dirname(__file__), "data")
 
 
+@pytest.fixture(autouse=True)
+def json_transport(monkeypatch):
+    # Most tests check the GeoJSON the layers send without anywidget, the
+    # binary transport is tested on its own
+    monkeypatch.setattr(VectorMapLayerArtist, "binary_transport", False)
+
+
+def channel_features(channel):
+    """
+    The ids, GeoJSON geometries and colours of the features of a
+    FeatureChannel, as its front end decodes them
+    """
+    colors = channel.colors
+    lookup = None
+    if colors:
+        index = np.frombuffer(colors["index"], dtype="<u1" if colors["width"] == 1 else "<u2")
+        lookup = np.array(colors["palette"])[index]
+    features = unpack_geometries((channel.source or channel).geometry)
+    if channel.kind == "regions":
+        if channel.selected is not None:
+            selected = np.unpackbits(np.frombuffer(channel.selected, dtype=np.uint8), bitorder="little")
+            features = [(i, geometry) for i, geometry in features if selected[i]]
+        return [(i, geometry, None if lookup is None else lookup[i]) for i, geometry in features]
+    return [(i, geometry, None if lookup is None else lookup[n]) for n, (i, geometry) in enumerate(features)]
+
+
 @pytest.fixture
 def mapapp(mapdata):
     app = gj.jglue(mapdata=mapdata)
@@ -59,6 +103,24 @@ def test_state_with_geopandas(mapapp, earthdata):
     assert isinstance(s.layers[0].state, MapRegionLayerState)
 
 
+def test_get_geom_type(earthdata, cities):
+    assert get_geom_type(None) is None
+    assert get_geom_type(Data(lat=[40, 41], lon=[-70, -71], label="points")) == "points"
+    assert get_geom_type(cities) == "points"
+    assert get_geom_type(earthdata) == "regions"
+
+    subset = earthdata.new_subset()
+    assert get_geom_type(subset) == "regions"
+    assert earthdata._geom_type == "regions"
+
+    gdf = geopandas.GeoDataFrame(
+        {"name": ["a", "b"]},
+        geometry=[cities.geometry[0], earthdata.geometry[0]],
+        crs=earthdata.meta["crs"],
+    )
+    assert get_geom_type(GeoRegionData(gdf, "mixed")) == "regions"
+
+
 def test_make_map_with_data(mapapp, mapdata):
     s = mapapp.new_data_viewer("map", data=mapdata)
     assert len(s.layers) == 1
@@ -121,3 +183,769 @@ def test_adding_data_to_empty_map(mapapp, mapdata):
     s = mapapp.new_data_viewer("map", data=None)
     s.add_data(mapdata)
     assert len(s.layers) == 1
+
+
+def test_points_to_geojson():
+    lat = np.array([1.0, 2.0, np.nan, 4.0])
+    lon = np.array([5.0, 6.0, 7.0, 8.0])
+    colors = np.array(["#ff0000", "#00ff00", "#ff0000", "#ff0000"])
+    radii = np.array([3, 3, 3, 5])
+
+    geojson = points_to_geojson(lat, lon)
+    assert len(geojson["features"]) == 1
+    assert geojson["features"][0]["geometry"]["coordinates"] == [[5.0, 1.0], [6.0, 2.0], [8.0, 4.0]]
+
+    features = points_to_geojson(lat, lon, colors=colors, radii=radii)["features"]
+    styles = {
+        (f["properties"]["style"]["fillColor"], f["properties"]["style"]["radius"]): f["geometry"]["coordinates"]
+        for f in features
+    }
+    assert styles == {("#00ff00", 3): [[6.0, 2.0]], ("#ff0000", 3): [[5.0, 1.0]], ("#ff0000", 5): [[8.0, 4.0]]}
+
+
+def test_individual_points_single_layer(mapapp):
+    n = 10000
+    rng = np.random.default_rng(0)
+    points = Data(lat=rng.uniform(25, 50, n), lon=rng.uniform(-125, -70, n), val=rng.random(n), label="points")
+    mapapp.add_data(points)
+    s = mapapp.new_data_viewer("map", data=points)
+    s.state.lat_att = points.id["lat"]
+    s.state.lon_att = points.id["lon"]
+    layer = s.layers[0]
+    assert layer.state.display_mode == "Individual Points"
+    assert isinstance(layer.map_layer, PointsGeoJSON)
+    assert layer.map_layer in s.map.layers
+
+    def n_points():
+        return sum(len(f["geometry"]["coordinates"]) for f in layer.map_layer.data["features"])
+
+    assert n_points() == n
+    assert layer.map_layer.style["fillColor"] == layer.state.color
+
+    layer.state.color_mode = "Linear"
+    layer.state.cmap_att = points.id["val"]
+    assert n_points() == n
+    assert "fillColor" not in layer.map_layer.style
+    assert len(layer.map_layer.data["features"]) > 1
+
+    data = layer.map_layer.data
+    layer.state.alpha = 0.3
+    assert layer.map_layer.data is data
+    assert layer.map_layer.style["fillOpacity"] == 0.3
+
+
+@pytest.mark.parametrize("cmap", [cmap for _, cmap in colormaps.members[:4]])
+def test_values_to_hex(cmap):
+    values = np.concatenate([np.linspace(-5, 15, 1001), [np.nan]])
+    expected = [color2hex(cmap(val)) for val in (values - 2) / 8]
+    assert list(values_to_hex(values, 2, 10, cmap)) == expected
+
+
+def test_values_to_radii():
+    values = np.array([0.0, 5.0, 10.0, np.nan])
+    assert list(values_to_radii(values, 0, 10, 1)) == [5, 7, 10, 5]
+    assert list(values_to_radii(values, 0, 10, 2)) == [10, 15, 20, 10]
+
+
+def test_debounced():
+    calls = []
+    update = Debounced(calls.append, wait=0.01)
+
+    # Without an event loop, calls go straight through
+    update(1)
+    assert calls == [1]
+
+    async def drag():
+        for i in range(2, 10):
+            update(i)
+        assert calls == [1]
+        await asyncio.sleep(0.05)
+
+    asyncio.run(drag())
+    assert calls == [1, 9]
+
+
+def test_lru_cache():
+    cache = LRUCache(10)
+    cache.put("a", b"1234")
+    cache.put("b", np.zeros(4, dtype=np.uint8))
+    assert cache.get("a") == b"1234"
+    # "b" is the least recently used
+    cache.put("c", b"1234")
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.nbytes == 8
+    cache.put("d", b"too large for the cache")
+    assert "d" not in cache
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.max_bytes = 4
+    assert "a" not in cache and "c" in cache
+
+
+def test_density_tiles_mode(mapapp):
+    rng = np.random.default_rng(0)
+    points = Data(lat=rng.normal(40, 3, 10000), lon=rng.normal(-100, 8, 10000), label="points")
+    mapapp.add_data(points)
+    s = mapapp.new_data_viewer("map", data=points)
+    s.state.lat_att = points.id["lat"]
+    s.state.lon_att = points.id["lon"]
+    layer = s.layers[0]
+
+    layer.state.display_mode = "Density Tiles"
+    assert isinstance(layer.map_layer, TileLayer)
+    assert layer.map_layer in s.map.layers
+    assert len(layer._tiles) == 10000
+    url = layer.map_layer.url
+
+    layer.state.cmap = colormaps.members[3][1]
+    assert layer._tiles.cmap is layer.state.cmap
+    assert layer.map_layer.url != url
+
+    layer.state.alpha = 0.4
+    assert layer.map_layer.opacity == 0.4
+
+    layer.state.display_mode = "Heatmap"
+    assert layer.map_layer in s.map.layers
+    assert len(s.map.layers) == 2
+
+
+def test_clustered_mode(mapapp):
+    rng = np.random.default_rng(0)
+    points = Data(lat=rng.normal(40, 3, 10000), lon=rng.normal(-100, 8, 10000), label="points")
+    mapapp.add_data(points)
+    s = mapapp.new_data_viewer("map", data=points)
+    s.state.lat_att = points.id["lat"]
+    s.state.lon_att = points.id["lon"]
+    s.state.zoom_level = 3
+    layer = s.layers[0]
+
+    layer.state.display_mode = "Clustered"
+    assert isinstance(layer.map_layer, PointsGeoJSON)
+    index = layer._clusters
+    features = layer.map_layer.data["features"]
+    assert sum(f["properties"]["count"] for f in features) == 10000
+    assert len(features) < 1000
+
+    s.state.zoom_level = 7
+    assert layer._clusters is index
+    assert len(layer.map_layer.data["features"]) > len(features)
+    assert sum(f["properties"]["count"] for f in layer.map_layer.data["features"]) == 10000
+
+    # The index is rebuilt when the data changes, e.g. for a new subset
+    layer.update()
+    assert layer._clusters is not index
+
+    mapapp.data_collection.new_subset_group(subset_state=points.id["lat"] > 40, label="north")
+    subset_layer = s.layers[1]
+    subset_layer.state.display_mode = "Clustered"
+    counts = [f["properties"]["count"] for f in subset_layer.map_layer.data["features"]]
+    assert sum(counts) == (points["lat"] > 40).sum()
+
+
+def test_heatmap_binning(mapapp):
+    n = 50000
+    rng = np.random.default_rng(0)
+    points = Data(lat=rng.normal(40, 3, n), lon=rng.normal(-100, 8, n), val=rng.random(n), label="points")
+    mapapp.add_data(points)
+    s = mapapp.new_data_viewer("map", data=points)
+    s.state.lat_att = points.id["lat"]
+    s.state.lon_att = points.id["lon"]
+    s.state.zoom_level = 4
+    layer = s.layers[0]
+    layer.state.display_mode = "Heatmap"
+
+    # Binned (lat, lon, weight) locations, with every point counted once
+    locations = np.array(layer.map_layer.locations)
+    assert locations.shape[1] == 3
+    assert len(locations) < n / 5
+    assert locations[:, 2].sum() == n
+    bins = layer._heat_bins
+
+    # Bins follow the zoom level, without rebuilding the index
+    s.state.zoom_level = 6
+    assert layer._heat_bins is bins
+    assert len(layer.map_layer.locations) > len(locations)
+
+    layer.state.cmap_att = points.id["val"]
+    layer.state.heatmap_weight = "Color attribute"
+    weights = np.array(layer.map_layer.locations)[:, 2]
+    assert_allclose(weights.sum(), n)
+    assert layer._heat_bins is not bins
+
+
+def test_viewport_culling(mapapp, mapdata):
+    n = 10000
+    rng = np.random.default_rng(0)
+    points = Data(lat=rng.uniform(25, 50, n), lon=rng.uniform(-125, -70, n), val=rng.random(n), label="points")
+    mapapp.add_data(points)
+    s = mapapp.new_data_viewer("map", data=points)
+    s.state.lat_att = points.id["lat"]
+    s.state.lon_att = points.id["lon"]
+    layer = s.layers[0]
+    layer.state.color_mode = "Linear"
+    layer.state.cmap_att = points.id["val"]
+
+    def sent_points():
+        coords = [c for f in layer.map_layer.data["features"] for c in f["geometry"]["coordinates"]]
+        return np.array(coords).reshape(-1, 2)
+
+    # Everything is sent until the map reports its bounds
+    assert s.state.bounds is None
+    assert len(sent_points()) == n
+
+    # The bounds are set from the map, which reports them as lists
+    s.map.set_trait("bounds", [[35, -100], [40, -90]])
+    assert s.state.bounds == ((35, -100), (40, -90))
+    lon, lat = sent_points().T
+    inside = (points["lat"] >= 32.5) & (points["lat"] <= 42.5) & (points["lon"] >= -105) & (points["lon"] <= -85)
+    assert len(lat) == inside.sum()
+    assert lat.min() >= 32.5 and lon.max() <= -85
+
+    # Small pans stay within the margin, so nothing is resent
+    data = layer.map_layer.data
+    s.map.set_trait("bounds", [[36, -99], [41, -89]])
+    assert layer.map_layer.data is data
+    s.map.set_trait("bounds", [[45, -80], [50, -70]])
+    assert layer.map_layer.data is not data
+    assert sent_points()[:, 1].min() >= 42.5
+
+    layer.state.display_mode = "Heatmap"
+    assert 0 < len(layer.map_layer.locations) < n
+
+    # Regions are culled with the spatial index of their GeoDataFrame
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    regions = s.layers[0]
+    assert len(regions.map_layer.data["features"]) == mapdata.size
+    s.map.set_trait("bounds", [[43, -72], [46, -68]])
+    sent = {f["properties"]["name"] for f in regions.map_layer.data["features"]}
+    assert 0 < len(sent) < mapdata.size
+    assert "Maine" in sent and "California" not in sent
+
+
+def test_region_simplification_levels(mapapp, mapdata):
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    layer = s.layers[0]
+
+    def n_coordinates():
+        return sum(
+            len(json.dumps(f["geometry"]["coordinates"]).split("],")) for f in layer.map_layer.data["features"]
+        )
+
+    assert s.state.zoom_level == 4
+    coarse = n_coordinates()
+    data = layer.map_layer.data
+
+    # Zooming within a band sends nothing new, zooming into another band
+    # sends the geometries simplified for it
+    s.state.zoom_level = 5
+    assert layer.map_layer.data is data
+    s.state.zoom_level = 14
+    assert n_coordinates() > coarse
+    assert len(layer.map_layer.data["features"]) == mapdata.size
+    s.state.zoom_level = 4
+    assert n_coordinates() == coarse
+
+
+def test_point_select_tool(mapapp, mapdata):
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    s.state.lat_att, s.state.lon_att = mapdata._centroid_component_ids
+    region_layer = s.layers[0]
+    s.toolbar.active_tool = s.toolbar.tools["ipyleaflet:pointselect"]
+
+    # Clicks on features without an id (e.g. points) select nothing
+    region_layer.map_layer._click_callbacks(event="click", feature={"type": "Feature", "geometry": None})
+    assert len(mapapp.data_collection.subset_groups) == 0
+
+    # Regions are selected with their full geometry, not the simplified one
+    # that was clicked on
+    geometries = mapdata.simplification.geometry
+    feature = next(
+        f for f in region_layer.map_layer.data["features"]
+        if f["geometry"]["type"] == "Polygon"
+        and len(f["geometry"]["coordinates"][0]) < shapely.get_num_coordinates(geometries[int(f["id"])])
+    )
+    row = int(feature["id"])
+    region_layer.map_layer._click_callbacks(event="click", feature=feature, id=feature["id"])
+    subset = mapdata.subsets[0]
+    assert subset.to_mask()[row]
+    roi = subset.subset_state.roi
+    assert len(roi.vx) == shapely.get_num_coordinates(geometries[row])
+    s.toolbar.active_tool = None
+
+
+@pytest.mark.skipif(not HAS_VECTOR_TILE_STYLES, reason="ipyleaflet VectorTileLayer has no layer_styles")
+def test_point_select_tool_vector_tiles(mapapp, mapdata):
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    s.state.lat_att, s.state.lon_att = mapdata._centroid_component_ids
+    region_layer = s.layers[0]
+    s.toolbar.active_tool = s.toolbar.tools["ipyleaflet:pointselect"]
+
+    # The regions stay selectable when the layer switches to vector tiles,
+    # whose features carry the row as their id property
+    region_layer.state.display_mode = "Vector Tiles"
+    assert region_layer.map_layer.interactive
+    region_layer.map_layer._handle_mouse_events(
+        None, {"event": "interaction", "type": "click", "properties": {"id": 3, "value": 0.5}}, []
+    )
+    subset = mapdata.subsets[0]
+    assert subset.to_mask()[3]
+
+    # As are the regions of layers added after the tool was activated,
+    # but only while it is active
+    other = GeoRegionData(geopandas.read_file(DATA + "/us-states.json").iloc[:5], "other")
+    mapapp.data_collection.append(other)
+    s.add_data(other)
+    other_layer = next(layer for layer in s.layers if layer.layer is other)
+    assert len(other_layer._click_callbacks.callbacks) == 1
+    s.toolbar.active_tool = None
+    assert len(region_layer._click_callbacks.callbacks) == 0
+    assert len(other_layer._click_callbacks.callbacks) == 0
+
+
+def test_region_linear_colors(mapapp, mapdata):
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    layer = s.layers[0]
+    layer.state.cmap_att = mapdata.id["Count_Person"]
+    layer.state.color_mode = "Linear"
+    assert layer.map_layer.style_callback is None
+    assert "fillColor" not in layer.map_layer.style
+
+    def feature_colors():
+        return {f["id"]: f["properties"]["style"]["fillColor"] for f in layer.map_layer.data["features"]}
+
+    values = mapdata["Count_Person"]
+    expected = values_to_hex(values, layer.state.cmap_vmin, layer.state.cmap_vmax, layer.state.cmap)
+    assert feature_colors() == {str(i): color for i, color in enumerate(expected)}
+
+    # Restyling reuses the encoded geometries
+    geometry = layer.map_layer.data["features"][0]["geometry"]
+    layer.state.cmap_vmax = np.median(values)
+    assert layer.map_layer.data["features"][0]["geometry"] is geometry
+    expected = values_to_hex(values, layer.state.cmap_vmin, layer.state.cmap_vmax, layer.state.cmap)
+    assert feature_colors() == {str(i): color for i, color in enumerate(expected)}
+
+    layer.state.color_mode = "Fixed"
+    assert layer.map_layer.style["fillColor"] == layer.state.color
+    layer.state.alpha = 0.4
+    assert layer.map_layer.style["fillColor"] == layer.state.color
+    assert layer.map_layer.style["fillOpacity"] == 0.4
+
+
+def test_region_subsets_share_features(mapapp, mapdata):
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    data_layer = s.layers[0]
+    geometries = {f["id"]: f["geometry"] for f in data_layer.map_layer.data["features"]}
+
+    subset_group = mapapp.data_collection.new_subset_group(
+        subset_state=mapdata.id["Count_Person"] > 10_000_000, label="big"
+    )
+    subset_layer = s.layers[1]
+    selected = np.flatnonzero(mapdata["Count_Person"] > 10_000_000)
+    features = subset_layer.map_layer.data["features"]
+    # Features have the ids of the regions in the data, and the geometries
+    # encoded for the data layer are reused rather than encoded again
+    assert [f["id"] for f in features] == [str(i) for i in selected]
+    assert all(f["geometry"] is geometries[f["id"]] for f in features)
+    assert features[0]["properties"]["name"] == mapdata["name"][selected[0]]
+
+    subset_group.subset_state = mapdata.id["Count_Person"] < 1_000_000
+    selected = np.flatnonzero(mapdata["Count_Person"] < 1_000_000)
+    features = subset_layer.map_layer.data["features"]
+    assert [f["id"] for f in features] == [str(i) for i in selected]
+    assert all(f["geometry"] is geometries[f["id"]] for f in features)
+
+
+@pytest.mark.skipif(not HAS_ANYWIDGET, reason="anywidget is not installed")
+def test_region_subsets_share_geometry(mapapp, mapdata, monkeypatch):
+    monkeypatch.setattr(VectorMapLayerArtist, "binary_transport", True)
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    data_layer = s.layers[0]
+    subset_group = mapapp.data_collection.new_subset_group(
+        subset_state=mapdata.id["Count_Person"] > 10_000_000, label="big"
+    )
+    subset_layer = s.layers[1]
+
+    # Both layers take the geometries from the channel of the data on the map
+    source = data_layer._channel.source
+    assert subset_layer._channel.source is source
+    assert data_layer._channel.selected is None
+    selected = np.flatnonzero(mapdata["Count_Person"] > 10_000_000)
+    assert [i for i, _, _ in channel_features(subset_layer._channel)] == selected.tolist()
+
+    updates = []
+
+    def record(layer_artist, name, nbytes):
+        updates.append((layer_artist, name, nbytes))
+
+    payload_meter.add_callback(record)
+    try:
+        # Changing the selection only sends a bit for each region
+        subset_group.subset_state = mapdata.id["Count_Person"] < 1_000_000
+        assert [(layer, name) for layer, name, _ in updates] == [(subset_layer, "selected")]
+        assert updates[0][2] < 16
+        selected = np.flatnonzero(mapdata["Count_Person"] < 1_000_000)
+        assert [i for i, _, _ in channel_features(subset_layer._channel)] == selected.tolist()
+
+        # Both layers are culled to the same bounds, which are sent once
+        del updates[:]
+        s.map.set_trait("bounds", [[43, -72], [46, -68]])
+        assert [name for _, name, _ in updates] == ["geometry"]
+        assert 0 < len(channel_features(data_layer._channel)) < mapdata.size
+    finally:
+        payload_meter.remove_callback(record)
+
+    # The shared channel is closed with the last layer of the data
+    subset_layer.remove()
+    assert source.comm is not None
+    data_layer.remove()
+    assert source.comm is None
+    assert (s.map.model_id, mapdata.uuid) not in SharedRegionGeometry._instances
+
+
+@pytest.mark.skipif(not HAS_VECTOR_TILE_STYLES, reason="ipyleaflet is too old for styled vector tiles")
+def test_region_subsets_share_vector_tiles(mapapp, mapdata):
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    data_layer = s.layers[0]
+    data_layer.state.display_mode = "Vector Tiles"
+    subset_group = mapapp.data_collection.new_subset_group(
+        subset_state=mapdata.id["Count_Person"] > 10_000_000, label="big"
+    )
+    subset_layer = s.layers[1]
+    subset_layer.state.display_mode = "Vector Tiles"
+
+    # The subset layer shows the tiles of the data, with only the selected
+    # regions drawn by its style
+    url = data_layer.map_layer.url
+    assert subset_layer.map_layer.url == url
+    assert subset_layer._tiles is data_layer._tiles
+    styles = subset_layer.map_layer.layer_styles
+    assert "selected" in styles
+    assert "selected" not in json.dumps(data_layer.map_layer.layer_styles)
+
+    subset_group.subset_state = mapdata.id["Count_Person"] < 1_000_000
+    assert subset_layer.map_layer.url == url
+    assert subset_layer.map_layer.layer_styles != styles
+
+    subset_layer.remove()
+    data_layer.remove()
+    assert mapdata.uuid not in SharedRegionTiles._instances
+
+
+@pytest.mark.skipif(not HAS_VECTOR_TILE_STYLES, reason="ipyleaflet is too old for styled vector tiles")
+def test_region_vector_tiles_mode(mapapp, mapdata):
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    layer = s.layers[0]
+    layer.state.display_mode = "Vector Tiles"
+    assert isinstance(layer.map_layer, VectorTileLayer)
+    assert layer.map_layer in s.map.layers
+    assert layer.map_layer.layer_styles["regions"]["fillColor"] == layer.state.color
+    url = layer.map_layer.url
+
+    # The tiles only carry the ids of the regions, which the style colours
+    # them by, so changing the colours only restyles the tiles
+    layer.state.cmap_att = mapdata.id["Count_Person"]
+    url = layer.map_layer.url
+    layer.state.color_mode = "Linear"
+    assert layer.map_layer.url == url
+    assert isinstance(layer.map_layer.layer_styles, str)
+    tile = layer._render_tile(0, 0, 0)
+    assert b"value" not in tile
+    styles = layer.map_layer.layer_styles
+    layer.state.cmap_att = mapdata.id["Median_Age_Person"]
+    assert layer.map_layer.url == url
+    assert layer.map_layer.layer_styles != styles
+    assert layer._render_tile(0, 0, 0) == tile
+
+    styles = layer.map_layer.layer_styles
+    layer.state.cmap_vmax = np.median(mapdata["Count_Person"])
+    layer.state.alpha = 0.3
+    assert layer.map_layer.url == url
+    assert layer.map_layer.layer_styles != styles
+
+    layer.state.visible = False
+    assert not layer.map_layer.visible
+    layer.state.visible = True
+
+    layer.state.display_mode = "GeoJSON"
+    assert layer.map_layer in s.map.layers
+    assert len(layer.map_layer.data["features"]) == mapdata.size
+    layer.remove()
+    assert layer._tiles is None
+
+
+def test_region_vector_tiles_mode_unavailable(mapapp, mapdata, monkeypatch):
+    monkeypatch.setattr("glue_map.map.state.HAS_VECTOR_TILE_STYLES", False)
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    layer = s.layers[0]
+    assert MapRegionLayerState.display_mode.get_choice_labels(layer.state) == ["GeoJSON"]
+
+
+def test_payload_meter(mapapp, mapdata):
+    updates = []
+
+    def record(layer_artist, name, nbytes):
+        updates.append((layer_artist, name, nbytes))
+
+    payload_meter.add_callback(record)
+    try:
+        s = mapapp.new_data_viewer("map", data=mapdata)
+        layer = s.layers[0]
+        assert updates[-1][:2] == (layer, "data")
+        assert updates[-1][2] == len(json.dumps(layer.map_layer.data, ensure_ascii=False).encode())
+
+        # Coordinates are rounded to a grid of about half a pixel at the zoom level
+        s.state.zoom_level = 0
+        geometries = json.dumps([f["geometry"] for f in layer.map_layer.data["features"]])
+        assert max(len(decimals) for decimals in re.findall(r"\.(\d+)", geometries)) == 1
+        low_zoom = updates[-1][2]
+        s.state.zoom_level = 14
+        assert updates[-1][2] > 1.2 * low_zoom
+
+        rng = np.random.default_rng(0)
+        points = Data(lat=rng.uniform(25, 50, 1000), lon=rng.uniform(-125, -70, 1000), label="points")
+        mapapp.add_data(points)
+        s = mapapp.new_data_viewer("map", data=points)
+        s.state.lat_att = points.id["lat"]
+        s.state.lon_att = points.id["lon"]
+        layer = s.layers[0]
+        layer.state.display_mode = "Individual Points"
+        layer_artist, name, nbytes = updates[-1]
+        assert (layer_artist, name) == (layer, "data")
+        # Less than 24 bytes per point, rather than 40 for full floats
+        assert nbytes < 24 * 1000
+    finally:
+        payload_meter.remove_callback(record)
+    n_updates = len(updates)
+    layer.state.display_mode = "Clustered"
+    assert len(updates) == n_updates
+
+
+@pytest.mark.skipif(not HAS_ANYWIDGET, reason="anywidget is not installed")
+def test_region_binary_transport(mapapp, mapdata, monkeypatch):
+    monkeypatch.setattr(VectorMapLayerArtist, "binary_transport", True)
+    updates = []
+
+    def record(layer_artist, name, nbytes):
+        updates.append((name, nbytes))
+
+    payload_meter.add_callback(record)
+    try:
+        s = mapapp.new_data_viewer("map", data=mapdata)
+        layer = s.layers[0]
+        channel = layer._channel
+        assert isinstance(channel, FeatureChannel)
+        assert channel.layer is layer.map_layer
+        assert layer.map_layer.data["features"] == []
+
+        # The geometries have the rows as their ids, and are the GeoJSON
+        # geometries in a fraction of the bytes
+        features = channel_features(channel)
+        expected = region_features(mapdata, np.arange(mapdata.size), s.state.zoom_level)["features"]
+        assert [i for i, _, _ in features] == list(range(mapdata.size))
+        assert [geometry for _, geometry, _ in features] == [f["geometry"] for f in expected]
+        geojson_nbytes = len(json.dumps([f["geometry"] for f in expected]))
+        assert updates[0][0] == "geometry"
+        assert updates[0][1] < geojson_nbytes / 5
+
+        # Changing the colours only sends the colours (the first change of
+        # the layer state reports every property as changed)
+        layer.state.cmap_att = mapdata.id["Count_Person"]
+        del updates[:]
+        layer.state.color_mode = "Linear"
+        layer.state.cmap_vmax = np.median(mapdata["Count_Person"])
+        assert {name for name, _ in updates} == {"colors"}
+        expected = values_to_hex(
+            mapdata["Count_Person"], layer.state.cmap_vmin, layer.state.cmap_vmax, layer.state.cmap
+        )
+        channel = layer._channel
+        assert [color for _, _, color in channel_features(channel)] == expected.tolist()
+
+        if HAS_VECTOR_TILE_STYLES:
+            # Vector tiles do not go through a channel
+            layer.state.display_mode = "Vector Tiles"
+            assert layer._channel is None
+            layer.state.display_mode = "GeoJSON"
+            assert layer._channel.layer is layer.map_layer
+            assert len(channel_features(layer._channel)) == mapdata.size
+    finally:
+        payload_meter.remove_callback(record)
+    layer.remove()
+    assert layer._channel is None
+
+
+@pytest.mark.skipif(not HAS_ANYWIDGET, reason="anywidget is not installed")
+def test_points_binary_transport(mapapp, monkeypatch):
+    monkeypatch.setattr(VectorMapLayerArtist, "binary_transport", True)
+    n = 1000
+    rng = np.random.default_rng(0)
+    points = Data(lat=rng.uniform(25, 50, n), lon=rng.uniform(-125, -70, n), val=rng.random(n), label="points")
+    mapapp.add_data(points)
+    s = mapapp.new_data_viewer("map", data=points)
+    s.state.lat_att = points.id["lat"]
+    s.state.lon_att = points.id["lon"]
+    layer = s.layers[0]
+    assert layer.state.display_mode == "Individual Points"
+    layer.state.cmap_att = points.id["val"]
+
+    updates = []
+
+    def record(layer_artist, name, nbytes):
+        updates.append((name, nbytes))
+
+    payload_meter.add_callback(record)
+    try:
+        layer.state.color_mode = "Linear"
+        assert {name for name, _ in updates} == {"colors"}
+
+        # The points are sent in the order of layer._sent_points
+        sent = layer._sent_points
+        features = channel_features(layer._channel)
+        assert sorted(sent.tolist()) == list(range(n))
+        coordinates = np.array([geometry["coordinates"] for _, geometry, _ in features])
+        assert_allclose(coordinates, np.column_stack([points["lon"][sent], points["lat"][sent]]), atol=1e-6)
+        expected = values_to_hex(points["val"], layer.state.cmap_vmin, layer.state.cmap_vmax, layer.state.cmap)
+        assert [color for _, _, color in features] == expected[sent].tolist()
+
+        del updates[:]
+        layer.state.display_mode = "Heatmap"
+        assert {name for name, _ in updates} == {"geometry", "weights"}
+        weights = np.frombuffer(layer._channel.weights, dtype="<f4")
+        assert len(weights) == len(unpack_geometries(layer._channel.geometry))
+        assert_allclose(weights.sum(), n)
+    finally:
+        payload_meter.remove_callback(record)
+
+
+@pytest.mark.skipif(not HAS_ANYWIDGET, reason="anywidget is not installed")
+def test_region_color_change_sends_no_geometry(mapapp, mapdata, monkeypatch):
+    monkeypatch.setattr(VectorMapLayerArtist, "binary_transport", True)
+    s = mapapp.new_data_viewer("map", data=mapdata)
+    layer = s.layers[0]
+    # The first change of the layer state reports every property as changed
+    layer.state.cmap_att = mapdata.id["Count_Person"]
+    data = layer.map_layer.data
+    geometry = layer._channel.geometry
+
+    updates = []
+
+    def record(layer_artist, name, nbytes):
+        updates.append(name)
+
+    payload_meter.add_callback(record)
+    try:
+        layer.state.color_mode = "Linear"
+        layer.state.cmap = colormaps.members[2][1]
+        layer.state.cmap_vmax = np.median(mapdata["Count_Person"])
+        layer.state.cmap_att = mapdata.id["Median_Age_Person"]
+        assert set(updates) == {"colors"}
+        assert layer.map_layer.data is data
+        assert layer._channel.geometry is geometry
+
+        if HAS_VECTOR_TILE_STYLES:
+            layer.state.display_mode = "Vector Tiles"
+            url = layer.map_layer.url
+            del updates[:]
+            layer.state.cmap_vmin = 40
+            layer.state.cmap_att = mapdata.id["Count_Person"]
+            assert updates == []
+            assert layer.map_layer.url == url
+    finally:
+        payload_meter.remove_callback(record)
+
+
+@pytest.fixture
+def cube():
+    nt, ny, nx = 4, 20, 30
+    xarr = xr.DataArray(
+        np.random.default_rng(0).random((nt, ny, nx)),
+        name="no2",
+        dims=("time", "latitude", "longitude"),
+        coords={"time": np.arange(nt), "latitude": np.linspace(20, 50, ny), "longitude": np.linspace(-120, -70, nx)},
+    )
+    return XarrayData(xarr, label="cube", coords=XarrayCoordinates(xarr, n_dim=3))
+
+
+def test_xarray_frame_cache(mapapp, cube):
+    mapapp.add_data(cube)
+    s = mapapp.new_data_viewer("map", data=cube)
+    layer = s.layers[0]
+    cache = layer.frame_cache
+    urls = {}
+    for t in [0, 1, 2]:
+        layer.state.t = t
+        urls[t] = layer.image_overlay_layer.url
+    misses = cache.misses
+
+    # Going back to a frame is a cache hit
+    layer.state.t = 1
+    assert layer.image_overlay_layer.url == urls[1]
+    assert cache.misses == misses
+    assert cache.hits >= 1
+
+    # Each frame is rendered from its own time slice
+    assert len(set(urls.values())) == 3
+
+    # Frames beyond the limit are dropped, least recently used first
+    cache.max_bytes = cache.nbytes - 1
+    assert len(cache) == 2
+    misses = cache.misses
+    layer.state.t = 2
+    layer.state.t = 1
+    assert cache.misses == misses
+
+    # Replacing the array clears the frames
+    cube.update_xarray(cube.xarr + 1)
+    layer.state.t = 2
+    assert layer.image_overlay_layer.url != urls[2]
+
+
+def test_xarray_playback(mapapp, cube):
+    mapapp.add_data(cube)
+    s = mapapp.new_data_viewer("map", data=cube)
+    layer = s.layers[0]
+    layer.state.t = 0
+    shown = []
+    jumps = []
+    layer.state.add_callback("t", shown.append)
+
+    async def play():
+        layer.state.fps = 20
+        layer.state.playing = True
+        await asyncio.sleep(0.5)
+        # Picking a time slice while playing carries on from there
+        jumps.append((len(shown), (layer.state.t + 2) % 4))
+        layer.state.t = jumps[0][1]
+        await asyncio.sleep(0.3)
+        layer.state.playing = False
+
+    asyncio.run(play())
+    assert not layer.player.playing
+    assert len(set(shown)) == 4
+    assert shown[0] == 1
+    (i, t), = jumps
+    assert shown[i:i + 2] == [t, (t + 1) % 4]
+    # The slices were rendered ahead in the background, and shown from the cache
+    assert layer.frame_cache.hits >= len(shown) - 2
+
+
+def test_xarray_layer_time_range_grows(mapapp, cube):
+    mapapp.add_data(cube)
+    s = mapapp.new_data_viewer("map", data=cube)
+    layer = s.layers[0]
+    assert layer.state.t_max == 3
+    assert layer.player.n_frames == 4
+
+    # Appending time slices (as append_tempo_data does) extends the existing layer
+    later = cube.xarr.assign_coords(time=cube.xarr.time + 4)
+    longer = xr.concat([cube.xarr, later, later.isel(time=[0, 1]).assign_coords(time=[8, 9])], dim="time")
+    cube.update_xarray(longer)
+    assert s.layers[0] is layer
+    assert layer.state.t_max == 9
+    assert layer.player.n_frames == 10
+    # The new slices are shown, slice 9 being a copy of slice 5
+    layer.state.t = 5
+    url = layer.image_overlay_layer.url
+    layer.state.t = 8
+    assert layer.image_overlay_layer.url != url
+    layer.state.t = 9
+    assert layer.image_overlay_layer.url == url
@@ -0,0 +1,66 @@
+import geopandas
+import numpy as np
+import pytest
+
+from glue_map.map.viewport import (
+    PointViewportIndex,
+    bounds_contain,
+    expand_bounds,
+    lon_ranges,
+    region_viewport_indices,
+)
+
+
+def brute_force(lat, lon, bounds):
+    (south, west), (north, east) = bounds
+    inside = (lat >= south) & (lat <= north)
+    within_lon = np.zeros_like(inside)
+    for lon_min, lon_max in lon_ranges(west, east):
+        within_lon |= (lon >= lon_min) & (lon <= lon_max)
+    return np.flatnonzero(inside & within_lon)
+
+
+@pytest.mark.parametrize(
+    "bounds",
+    [
+        ((30, -110), (45, -90)),  # a country
+        ((40, -100.01), (40.01, -100)),  # a few city blocks
+        ((-90, -180), (90, 180)),  # the world
+        ((-20, 170), (20, 200)),  # across the antimeridian
+        ((-20, -500), (20, 500)),  # wrapped more than once
+        ((89, 0), (90, 10)),  # beyond the Web Mercator limit
+    ],
+)
+def test_point_viewport_index(bounds):
+    rng = np.random.default_rng(0)
+    n = 100000
+    lat = np.concatenate([rng.normal(40, 3, n), rng.uniform(-90, 90, n), [np.nan]])
+    lon = np.concatenate([rng.normal(-100, 8, n), rng.uniform(-180, 180, n), [0]])
+    index = PointViewportIndex(lat, lon)
+    assert len(index) == 2 * n
+    np.testing.assert_array_equal(index.query(bounds), brute_force(lat, lon, bounds))
+
+
+def test_bounds():
+    bounds = ((30, -110), (40, -90))
+    expanded = expand_bounds(bounds)
+    assert expanded == ((25, -120), (45, -80))
+    assert expand_bounds(((-80, 0), (80, 10))) == ((-90, -5), (90, 15))
+    assert bounds_contain(expanded, bounds)
+    assert not bounds_contain(bounds, expanded)
+    assert bounds_contain(((-90, -400), (90, 400)), ((0, 170), (10, 190)))
+    assert lon_ranges(170, 190) == [(170, 180), (-180, -170)]
+    assert lon_ranges(-190, -170) == [(170, 180), (-180, -170)]
+
+
+def test_region_viewport_indices():
+    gdf = geopandas.read_file(geopandas.datasets.get_path("naturalearth_lowres"))
+    visible = region_viewport_indices(gdf.sindex, ((30, -110), (45, -90)))
+    # Candidates are found from bounding boxes, e.g. Russia's spans the world
+    assert "United States of America" in set(gdf.name.iloc[visible])
+    assert "France" not in set(gdf.name.iloc[visible])
+    assert len(visible) < 10
+    # Fiji and Russia cross the antimeridian
+    visible = region_viewport_indices(gdf.sindex, ((-20, 175), (-15, 185)))
+    assert "Fiji" in set(gdf.name.iloc[visible])
+    assert len(region_viewport_indices(gdf.sindex, ((-90, -180), (90, 180)))) == len(gdf)
@@ -0,0 +1,252 @@
+"""
+Map tiles rendered in the kernel and served to the browser from a small
+HTTP server running in the same process.
+"""
+import hmac
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+import PIL.Image
+from glue.logger import logger
+
+__all__ = ["TileServer", "get_tile_server", "PointDensityTiles"]
+
+TILE_SIZE = 256
+
+# Points are indexed on a quadtree with this many levels, which resolves the
+# pixels of tiles up to zoom level MAX_LEVEL - 8
+MAX_LEVEL = 24
+MAX_TILE_ZOOM = MAX_LEVEL - 8
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "pbf": "application/x-protobuf",
+}
+
+
+def _empty_png():
+    buffer = BytesIO()
+    PIL.Image.new("RGBA", (1, 1)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# What is sent for tiles that have nothing in them
+EMPTY_TILES = {
+    "png": _empty_png(),
+    "pbf": b"",
+}
+
+
+class TileServer:
+    """
+    An HTTP server for map tiles, running in a daemon thread of the kernel
+
+    Tile sources are registered under a name. A source is called with
+    ``(z, x, y)`` from the server thread and returns the encoded tile as
+    bytes, or None if the tile is empty.
+
+    The tile URLs point at the loopback interface, so the browser has to
+    run on the same machine as the kernel. They start with a random token,
+    so only the pages the URLs are sent to (i.e. the notebook) can fetch
+    tiles, and not any other page open in the browser.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self._sources = {}
+        self._token = secrets.token_urlsafe(16)
+
+        tile_server = self
+
+        class TileRequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                tile_server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), TileRequestHandler)
+        self._httpd.daemon_threads = True
+        self.host, self.port = self._httpd.server_address[:2]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="glue-map-tiles", daemon=True)
+        self._thread.start()
+
+    def register(self, name, source, extension="png"):
+        """
+        Serve the tiles of ``source`` under ``name`` and return the XYZ URL template
+        """
+        self._sources[name] = (source, extension)
+        return f"http://{self.host}:{self.port}/{self._token}/{name}/{{z}}/{{x}}/{{y}}.{extension}"
+
+    def unregister(self, name):
+        self._sources.pop(name, None)
+
+    def _handle(self, request):
+        try:
+            token, name, z, x, tail = request.path.split("?")[0].strip("/").split("/")
+            if not hmac.compare_digest(token, self._token):
+                raise KeyError(token)
+            y, extension = tail.split(".")
+            z, x, y = int(z), int(x), int(y)
+            source, source_extension = self._sources[name]
+            if extension != source_extension:
+                raise KeyError(extension)
+        except (KeyError, ValueError):
+            request.send_error(404)
+            return
+
+        try:
+            body = source(z, x, y)
+        except Exception:
+            logger.exception(f"Could not render tile {z}/{x}/{y} of {name}")
+            request.send_error(500)
+            return
+        if body is None:
+            body = EMPTY_TILES[extension]
+
+        request.send_response(200)
+        request.send_header("Content-Type", CONTENT_TYPES[extension])
+        request.send_header("Content-Length", str(len(body)))
+        # Vector tiles are fetched from the notebook page, whose origin is not
+        # known here. The token in the URL is what keeps other pages out.
+        request.send_header("Access-Control-Allow-Origin", "*")
+        request.end_headers()
+        request.wfile.write(body)
+
+
+_tile_server = None
+_tile_server_lock = threading.Lock()
+
+
+def get_tile_server():
+    """
+    Return the tile server for this process, starting it on first use
+    """
+    global _tile_server
+    with _tile_server_lock:
+        if _tile_server is None:
+            _tile_server = TileServer()
+        return _tile_server
+
+
+def lonlat_to_unit(lon, lat):
+    """
+    Web Mercator coordinates scaled to [0, 1], with y increasing southwards
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.clip(np.asarray(lat, dtype=float), -85.0511287798, 85.0511287798)
+    x = (lon + 180) / 360
+    y = (1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2
+    return x, y
+
+
+def _interleave(v):
+    """
+    Spread the bits of ``v`` (up to 32 bits) to the even bits of a uint64
+    """
+    v = np.asarray(v, dtype=np.uint64) & np.uint64(0x00000000FFFFFFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return v
+
+
+def _deinterleave(v):
+    """
+    Gather the even bits of ``v`` (the inverse of `_interleave`)
+    """
+    v = np.asarray(v, dtype=np.uint64) & np.uint64(0x5555555555555555)
+    v = (v | (v >> np.uint64(1))) & np.uint64(0x3333333333333333)
+    v = (v | (v >> np.uint64(2))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v >> np.uint64(4))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v >> np.uint64(8))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v >> np.uint64(16))) & np.uint64(0x00000000FFFFFFFF)
+    return v
+
+
+def quadtree_codes(lon, lat, level=MAX_LEVEL):
+    """
+    Interleaved (Morton) codes of points on a quadtree with ``level`` levels
+
+    All the points in the tile ``(z, x, y)`` for ``z <= level`` have codes
+    between ``morton(x, y) << 2 * (level - z)`` and ``(morton(x, y) + 1) << 2 * (level - z)``.
+    """
+    x, y = lonlat_to_unit(lon, lat)
+    n = 2 ** level
+    ix = np.clip(x * n, 0, n - 1).astype(np.uint64)
+    iy = np.clip(y * n, 0, n - 1).astype(np.uint64)
+    return _interleave(ix) | (_interleave(iy) << np.uint64(1))
+
+
+class PointDensityTiles:
+    """
+    Render the density of points as colour-mapped XYZ raster tiles
+
+    The points are sorted along a quadtree curve once, so the points in any
+    tile are a contiguous slice found with ``searchsorted``, and a tile is a
+    ``bincount`` of that slice into its 256x256 pixels. The counts are scaled
+    logarithmically up to the densest pixel at the same zoom level, so that
+    neighbouring tiles match.
+    """
+
+    def __init__(self, lat, lon, cmap):
+        lat = np.asarray(lat, dtype=float).ravel()
+        lon = np.asarray(lon, dtype=float).ravel()
+        keep = np.isfinite(lat) & np.isfinite(lon)
+        self._codes = np.sort(quadtree_codes(lon[keep], lat[keep]))
+        self._max_counts = {}
+        self.cmap = cmap
+
+    def __len__(self):
+        return len(self._codes)
+
+    def max_count(self, z):
+        """
+        The number of points in the densest pixel of the tiles at zoom ``z``
+        """
+        if z not in self._max_counts:
+            if len(self._codes) == 0:
+                self._max_counts[z] = 0
+            else:
+                pixels = self._codes >> np.uint64(2 * (MAX_LEVEL - z - 8))
+                edges = np.flatnonzero(pixels[1:] != pixels[:-1]) + 1
+                self._max_counts[z] = int(np.diff(edges, prepend=0, append=len(pixels)).max())
+        return self._max_counts[z]
+
+    def counts(self, z, x, y):
+        """
+        The number of points in each pixel of the tile ``(z, x, y)``
+        """
+        shift = np.uint64(2 * (MAX_LEVEL - z))
+        tile = _interleave(x) | (_interleave(y) << np.uint64(1))
+        start, stop = np.searchsorted(self._codes, [tile << shift, (tile + np.uint64(1)) << shift])
+        # The 16 bits below the tile code give the pixel within the tile
+        local = (self._codes[start:stop] >> np.uint64(2 * (MAX_LEVEL - z - 8))) & np.uint64(0xFFFF)
+        px = _deinterleave(local).astype(np.intp)
+        py = _deinterleave(local >> np.uint64(1)).astype(np.intp)
+        return np.bincount(py * TILE_SIZE + px, minlength=TILE_SIZE * TILE_SIZE).reshape(TILE_SIZE, TILE_SIZE)
+
+    def render(self, counts, max_count):
+        """
+        Colour-map pixel counts into an RGBA image, leaving empty pixels transparent
+        """
+        lut = np.round(self.cmap(np.arange(self.cmap.N)) * 255).astype(np.uint8)
+        scaled = np.log1p(counts) / np.log1p(max(max_count, 1))
+        image = lut[np.minimum((scaled * self.cmap.N).astype(int), self.cmap.N - 1)]
+        image[counts == 0] = 0
+        return image
+
+    def __call__(self, z, x, y):
+        if not (0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+        counts = self.counts(z, x, y)
+        if not counts.any():
+            return None
+        buffer = BytesIO()
+        PIL.Image.fromarray(self.render(counts, self.max_count(z)), mode="RGBA").save(buffer, format="PNG")
+        return buffer.getvalue()
@@ -1,7 +1,8 @@
 import os
 import time
+from functools import partial
 
-import numpy as np
+import shapely
 from glue.config import viewer_tool
 from glue.core.roi import PolygonalROI, RectangularROI
 from glue.core.subset import MultiOrState, OrState, RoiSubsetState
@@ -9,6 +10,8 @@ from glue.viewers.common.tool import CheckableTool, Tool
 from ipyleaflet import Rectangle
 from ipywidgets import CallbackDispatcher
 
+from .layer_artist import MapRegionLayerArtist
+
 __all__ = []
 
 ICON_WIDTH = 20
@@ -55,6 +58,7 @@ class PointSelect(IpyLeafletSelectionTool):
     def __init__(self, viewer):
         super(PointSelect, self).__init__(viewer)
         self.list_of_region_ids = []
+        self._region_callbacks = {}
         # print("PointSelect created...")
 
     def activate(self):
@@ -62,79 +66,79 @@ class PointSelect(IpyLeafletSelectionTool):
         Capture point-select clicks. This is to select regions...
         """
         #print("PointSelect activated...")
-
-        def on_click(event, feature, **kwargs):
-            # print("On click called...")
-            self.list_of_region_ids = []
-            # print(f"{feature=}")
-            feature_id = feature["id"]  # This is the name of features in our geodata
-            # print(feature_id)
-            # List of region_ids should start with the current subset (how to get this?)
-            active_subset = self.viewer.toolbar_active_subset.selected
-            if active_subset:
-                # print(f'activate_subset is: {active_subset}')
-                existing_subset_states = (
-                    self.viewer.session.data_collection.subset_groups[
-                        active_subset[0]
-                    ].subset_state
-                )
-            else:
-                # print("No active_subset")
-                existing_subset_states = None
-            self.list_of_region_ids.append(int(feature_id))
-            self.list_of_region_ids = list(set(self.list_of_region_ids))
-            # print(f"List of region ids to draw... {self.list_of_region_ids}")
-
-            try:
-                coord = feature["geometry"]["coordinates"]
-                new_subset_states = []
-                # print(np.array(coord).shape)
-                # I think this should loop through MultiPolygon types
-                for region in coord:
-                    # print(np.array(coord).shape)
-                    lons = []
-                    lats = []
-                    for k in np.squeeze(region):
-                        lons.append(k[0])
-                        lats.append(k[1])
-                    roi = PolygonalROI(vx=lons, vy=lats)
-                    new_subset_state = RoiSubsetState(
-                        xatt=self.viewer.state.lon_att,
-                        yatt=self.viewer.state.lat_att,
-                        roi=roi,
-                    )
-                    new_subset_states.append(new_subset_state)
-                if len(new_subset_states) == 1:
-                    final_subset_state = new_subset_states[0]
-                else:
-                    final_subset_state = MultiOrState(new_subset_states)
-
-                if existing_subset_states is not None:
-                    final_subset_state = OrState(
-                        existing_subset_states, final_subset_state
-                    )
-                else:
-                    pass
-                self.viewer.apply_subset_state(
-                    final_subset_state, override_mode=None
-                )  # What does override_mode do?
-
-            except OSError:
-                print("Feature has no geometry defined...")
-                pass
-
-        for map_layer in self.viewer.map.layers:
-            # Perhaps (perhaps not) make this limited to RegionLayerArtists?
-            map_layer.on_click(on_click)
+        self._connect_region_layers()
+        # Regions added while the tool is active can be selected too
+        self.viewer.state.add_callback("layers", self._connect_region_layers)
+
+    def _connect_region_layers(self, *args):
+        # Only regions can be selected, points have no geometry to select
+        # with. The layer artists pass clicks on from whichever map layer
+        # they currently show.
+        for layer_artist in self.viewer.layers:
+            if isinstance(layer_artist, MapRegionLayerArtist) and layer_artist not in self._region_callbacks:
+                callback = partial(self._select_region, layer_artist.layer.data)
+                layer_artist.on_click(callback)
+                self._region_callbacks[layer_artist] = callback
+
+    def _select_region(self, data, feature_id):
+        # print("On click called...")
+        self.list_of_region_ids = []
+        # feature_id is the position of the region in our geodata
+        # List of region_ids should start with the current subset (how to get this?)
+        active_subset = self.viewer.toolbar_active_subset.selected
+        if active_subset:
+            # print(f'activate_subset is: {active_subset}')
+            existing_subset_states = (
+                self.viewer.session.data_collection.subset_groups[
+                    active_subset[0]
+                ].subset_state
+            )
+        else:
+            # print("No active_subset")
+            existing_subset_states = None
+        self.list_of_region_ids.append(feature_id)
+        self.list_of_region_ids = list(set(self.list_of_region_ids))
+        # print(f"List of region ids to draw... {self.list_of_region_ids}")
+
+        # The full geometry of the region, since the one in the feature is
+        # simplified and rounded for the zoom level it was clicked at
+        geometry = data.simplification.geometry[feature_id]
+        new_subset_states = []
+        for polygon in shapely.get_parts(geometry):
+            if shapely.get_type_id(polygon) != 3:
+                continue
+            lons, lats = shapely.get_coordinates(shapely.get_exterior_ring(polygon)).T
+            roi = PolygonalROI(vx=lons, vy=lats)
+            new_subset_state = RoiSubsetState(
+                xatt=self.viewer.state.lon_att,
+                yatt=self.viewer.state.lat_att,
+                roi=roi,
+            )
+            new_subset_states.append(new_subset_state)
+        if not new_subset_states:
+            print("Feature has no polygons defined...")
+            return
+        if len(new_subset_states) == 1:
+            final_subset_state = new_subset_states[0]
+        else:
+            final_subset_state = MultiOrState(new_subset_states)
+
+        if existing_subset_states is not None:
+            final_subset_state = OrState(
+                existing_subset_states, final_subset_state
+            )
+        self.viewer.apply_subset_state(
+            final_subset_state, override_mode=None
+        )  # What does override_mode do?
 
     def deactivate(self):
-        for map_layer in self.viewer.map.layers:
-            map_layer._click_callbacks = (
-                CallbackDispatcher()
-            )  # This removes all on_click callbacks, but seems to work
-            self.list_of_region_ids = (
-                []
-            )  # We need to trigger this when we switch modes too (to do a new region)
+        self.viewer.state.remove_callback("layers", self._connect_region_layers)
+        for layer_artist, callback in self._region_callbacks.items():
+            layer_artist.on_click(callback, remove=True)
+        self._region_callbacks = {}
+        self.list_of_region_ids = (
+            []
+        )  # We need to trigger this when we switch modes too (to do a new region)
 
     def close(self):
         pass
@@ -1,5 +1,11 @@
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
 from glue.core import Data
-from glue_map.data import XarrayData
+from glue_map.data import GeoRegionData, XarrayData
 
 def sim(base_url):
     return('http://localhost:8888')
@@ -8,35 +14,222 @@ def get_geom_type(layer):
     """
     Get the type of map-like data in layer
 
+    This is "xarray", "points", "lines" or "regions", or None if the data
+    cannot be shown on a map. Subsets have the type of their parent data,
+    and the geometry scan for GeoRegionData is cached on the data object.
     """
     if layer is None:
         return None
-    elif layer.ndim > 1:
-        if isinstance(layer, XarrayData):
-            layer_type = "xarray"
-        elif isinstance(layer.data, XarrayData):
-            #print("layer.data is XarrayData")
-            layer_type = "xarray"
-        return layer_type
-    elif layer.ndim == 1:
-        if isinstance(layer, Data):
-            try:
-                geom_type = layer.geometry.geom_type
-            except AttributeError:
-                layer_type = "points"
-        else:
-            try:
-                geom_type = layer.data.geometry.geom_type
-            except AttributeError:
-                layer_type = "points"
-        try:
-            layer_type = "regions"
-            if (geom_type == "Point").all():
-                layer_type = "points"
-            elif (geom_type == "LineString").all():
-                layer_type = "lines"
-        except:  # noqa 722
-            layer_type = "points"
-        return layer_type
+    data = layer if isinstance(layer, Data) else layer.data
+    if isinstance(data, XarrayData):
+        return "xarray"
+    elif data.ndim == 1:
+        if isinstance(data, GeoRegionData):
+            return data.geom_type
+        return "points"
     else:
         return None
+
+
+def colormap_lut(cmap):
+    """
+    Hex colours for every entry of ``cmap`` (256 for most colormaps),
+    followed by its under, over and bad colours
+    """
+    rgba = np.concatenate([cmap(np.arange(cmap.N)), cmap(np.array([-np.inf, np.inf, np.nan]))])
+    rgb = np.round(rgba[:, :3] * 255).astype(int)
+    return np.array(["#{:02x}{:02x}{:02x}".format(*color) for color in rgb])
+
+
+def values_to_hex(values, vmin, vmax, cmap):
+    """
+    Map ``values`` linearly between ``vmin`` and ``vmax`` onto ``cmap`` and
+    return hex colours, the same as ``color2hex(cmap(value))`` for each value
+    but as a single lookup into `colormap_lut`
+    """
+    lut = colormap_lut(cmap)
+    n = cmap.N
+    diff = vmax - vmin or 1  # to avoid div by zero
+    with np.errstate(invalid="ignore"):
+        scaled = (np.asarray(values, dtype=float) - vmin) * (n / diff)
+        index = np.clip(scaled, -1, n).astype(int)
+        # As for matplotlib colormaps, 1 is the last colour, not the over colour
+        index[scaled == n] = n - 1
+        index[scaled < 0] = n  # under
+        index[scaled > n] = n + 1  # over
+    index[np.isnan(scaled)] = n + 2  # bad
+    return lut[index]
+
+
+def values_to_radii(values, vmin, vmax, size_scaling):
+    """
+    Marker radii for ``values`` scaled linearly between ``vmin`` and ``vmax``,
+    from 5 to 10 times ``size_scaling`` so that every point is shown
+    """
+    diff = vmax - vmin or 1
+    normalized = np.nan_to_num((np.asarray(values, dtype=float) - vmin) / diff)
+    return ((normalized + 1) * size_scaling * 5).astype(int)
+
+
+class Debounced:
+    """
+    Wrap ``func`` so that it is only called once calls have stopped for
+    ``wait`` seconds, with the arguments of the last call
+
+    The delayed call is scheduled on the running asyncio event loop, which
+    is where widget messages are handled in a Jupyter kernel. Without a
+    running loop (e.g. in scripts and tests) ``func`` is called immediately.
+    """
+
+    def __init__(self, func, wait=0.2):
+        self.func = func
+        self.wait = wait
+        self._handle = None
+
+    def __call__(self, *args, **kwargs):
+        self.cancel()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.func(*args, **kwargs)
+            return
+        self._handle = loop.call_later(self.wait, lambda: self.func(*args, **kwargs))
+
+    def cancel(self):
+        """
+        Drop the pending call, if any
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+class LRUCache:
+    """
+    A thread-safe cache that holds at most ``max_bytes`` of values, dropping
+    the least recently used ones first
+
+    The size of each value is ``sizeof(value)``, which by default is its
+    ``nbytes`` if it has one (e.g. numpy arrays) and otherwise its length
+    (e.g. bytes). A value larger than ``max_bytes`` is not cached at all.
+    """
+
+    def __init__(self, max_bytes, sizeof=None):
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda value: getattr(value, "nbytes", None) or len(value))
+        self._items = OrderedDict()
+        self._sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        """
+        The most bytes of values to hold, which can be changed at any time
+        """
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._items[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+    def _evict(self):
+        while self.nbytes > self._max_bytes:
+            self._discard(next(iter(self._items)))
+
+    def _discard(self, key):
+        if key in self._items:
+            del self._items[key]
+            self.nbytes -= self._sizes.pop(key)
+
+
+def payload_size(value):
+    """
+    The size in bytes of a widget state value as the kernel sends it: bytes
+    (anywhere in dicts and lists) as binary buffers, and the rest as JSON
+    """
+    buffers = []
+
+    def strip(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            buffers.append(memoryview(value).nbytes)
+            return None
+        if isinstance(value, dict):
+            return {key: strip(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [strip(item) for item in value]
+        return value
+
+    text = json.dumps(strip(value), ensure_ascii=False)
+    return len(text.encode("utf8")) + sum(buffers)
+
+
+class PayloadMeter:
+    """
+    Measure the features and locations that map layers send to the browser
+
+    Layer artists call `record` with every value they send as widget state.
+    While there are callbacks (added with `add_callback`), the size in bytes
+    of the value as the kernel sends it is computed (see `payload_size`), added to ``nbytes``, and passed to
+    each callback along with the layer artist and the name of the widget
+    trait, e.g. ``callback(layer_artist, "data", 12345)``.
+    """
+
+    def __init__(self):
+        self._callbacks = []
+        self.nbytes = 0
+        self.updates = 0
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def record(self, layer_artist, name, value):
+        if not self._callbacks:
+            return
+        nbytes = payload_size(value)
+        self.nbytes += nbytes
+        self.updates += 1
+        for callback in list(self._callbacks):
+            callback(layer_artist, name, nbytes)
+
+
+payload_meter = PayloadMeter()
@@ -0,0 +1,313 @@
+"""
+Mapbox Vector Tiles (https://github.com/mapbox/vector-tile-spec) of
+regions, cut in the kernel and served to the browser from the local tile
+server.
+"""
+import json
+import struct
+from base64 import b64encode
+
+import numpy as np
+import shapely
+
+from .tiles import lonlat_to_unit
+from .utils import LRUCache
+
+__all__ = ["RegionVectorTiles", "vector_tile_style"]
+
+# The name of the layer in every tile
+LAYER_NAME = "regions"
+
+# Tile coordinates run from 0 to EXTENT, and geometries are clipped
+# BUFFER units outside the tile so that borders are not drawn at its edges
+EXTENT = 4096
+BUFFER = 64
+
+# Tiles are cached up to this many bytes for each tile source
+TILE_CACHE_BYTES = 64 * 1024 ** 2
+
+# Command ids of the geometry encoding
+MOVE_TO = 1
+LINE_TO = 2
+CLOSE_PATH = 7
+
+# Feature geometry types
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _varints(values):
+    """
+    The concatenated varint encoding of an array of non-negative integers
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b""
+    n_bytes = np.ones(len(values), dtype=int)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        n_bytes += rest > 0
+        rest >>= np.uint64(7)
+    position = np.arange(n_bytes.max())
+    groups = (values[:, None] >> (position * 7).astype(np.uint64)) & np.uint64(0x7F)
+    groups |= np.where(position < n_bytes[:, None] - 1, np.uint64(0x80), np.uint64(0))
+    return groups.astype(np.uint8)[position < n_bytes[:, None]].tobytes()
+
+
+def _zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _key(field, wire_type):
+    return _varint(field << 3 | wire_type)
+
+
+def _message(field, payload):
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _command(command, count):
+    return (command & 0x7) | (count << 3)
+
+
+def _ring_commands(points, cursor, closed):
+    """
+    The commands drawing ``points`` (integer tile coordinates) from
+    ``cursor``, or None if too few points are left once repeated points are
+    dropped
+    """
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = (np.diff(points, axis=0) != 0).any(axis=1)
+    points = points[keep]
+    if closed and len(points) > 1 and (points[0] == points[-1]).all():
+        points = points[:-1]
+    if len(points) < (3 if closed else 2):
+        return None
+    deltas = np.diff(points, axis=0, prepend=[cursor]).ravel()
+    commands = [
+        [_command(MOVE_TO, 1)], _zigzag(deltas[:2]), [_command(LINE_TO, len(points) - 1)], _zigzag(deltas[2:])
+    ]
+    if closed:
+        commands.append([_command(CLOSE_PATH, 1)])
+    return np.concatenate(commands).astype(np.uint64), points[-1]
+
+
+def _signed_area(points):
+    # Twice the area by the surveyor's formula, positive for rings that are
+    # clockwise on screen (y down), as MVT exterior rings must be
+    x, y = points[:, 0], points[:, 1]
+    return np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)
+
+
+def encode_geometry(geometry):
+    """
+    The MVT geometry type and commands for a shapely geometry in integer
+    tile coordinates, or (None, None) if nothing of it is left to draw
+    """
+    cursor = np.zeros(2, dtype=np.int64)
+    commands = []
+    type_id = shapely.get_type_id(geometry)
+    if type_id in (0, 4):  # (Multi)Point
+        points = shapely.get_coordinates(geometry).astype(np.int64)
+        if len(points) == 0:
+            return None, None
+        deltas = np.diff(points, axis=0, prepend=[cursor]).ravel()
+        return POINT, np.concatenate([[_command(MOVE_TO, len(points))], _zigzag(deltas)]).astype(np.uint64)
+    elif type_id in (1, 5):  # (Multi)LineString
+        for part in shapely.get_parts(geometry):
+            encoded = _ring_commands(shapely.get_coordinates(part).astype(np.int64), cursor, closed=False)
+            if encoded is not None:
+                commands.append(encoded[0])
+                cursor = encoded[1]
+        geom_type = LINESTRING
+    elif type_id in (3, 6):  # (Multi)Polygon
+        for polygon in shapely.get_parts(geometry):
+            holes = shapely.get_interior_ring(polygon, range(shapely.get_num_interior_rings(polygon)))
+            rings = [shapely.get_exterior_ring(polygon), *holes]
+            for i, ring in enumerate(rings):
+                points = shapely.get_coordinates(ring).astype(np.int64)
+                area = _signed_area(points)
+                if area == 0:
+                    if i == 0:
+                        break  # Nothing is left of the polygon
+                    continue
+                if (area > 0) != (i == 0):
+                    points = points[::-1]
+                encoded = _ring_commands(points, cursor, closed=True)
+                if encoded is None:
+                    if i == 0:
+                        break
+                    continue
+                commands.append(encoded[0])
+                cursor = encoded[1]
+        geom_type = POLYGON
+    else:
+        return None, None
+    if not commands:
+        return None, None
+    return geom_type, np.concatenate(commands)
+
+
+def _value(value):
+    # Numbers are stored as doubles
+    return _message(4, _key(3, 1) + struct.pack("<d", value))
+
+
+def encode_layer(ids, geometries):
+    """
+    An MVT layer of features with the given ``ids`` and geometries (in
+    integer tile coordinates), with the ``id`` of each feature as its only
+    property
+    """
+    features = []
+    values = []
+    for feature_id, geometry in zip(ids, geometries):
+        geom_type, commands = encode_geometry(geometry)
+        if geom_type is None:
+            continue
+        # The tags are the positions of the key and the value of the
+        # property in the keys and values of the layer
+        features.append(
+            _message(
+                2,
+                _key(1, 0) + _varint(int(feature_id))
+                + _message(2, _varints([0, len(values)]))
+                + _key(3, 0) + _varint(geom_type)
+                + _message(4, _varints(commands)),
+            )
+        )
+        values.append(_value(float(feature_id)))
+    if not features:
+        return b""
+    layer = _key(15, 0) + _varint(2) + _message(1, LAYER_NAME.encode())
+    layer += b"".join(features)
+    layer += _message(3, b"id")
+    layer += b"".join(values)
+    layer += _key(5, 0) + _varint(EXTENT)
+    return _message(3, layer)
+
+
+def tile_bounds(z, x, y, buffer=0):
+    """
+    The (west, south, east, north) bounds in degrees of tile ``(z, x, y)``,
+    grown by ``buffer`` tile units on each side
+    """
+    n = 2 ** z
+    margin = buffer / EXTENT
+    west, east = ((x - margin) / n) * 360 - 180, ((x + 1 + margin) / n) * 360 - 180
+    north = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y - margin) / n))))
+    south = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + 1 + margin) / n))))
+    return west, south, east, north
+
+
+class RegionVectorTiles:
+    """
+    Cut the regions of a GeoRegionData into Mapbox Vector Tiles on demand
+
+    The regions in a tile are found with the spatial index of the data,
+    taken from its `SimplificationPyramid` at the level for the zoom of the
+    tile, clipped to the tile and projected to tile coordinates, all for the
+    whole tile at once. Each feature has the position of the region in the
+    data as its ``id``, which is all the tiles carry besides the geometries,
+    so they do not change with the colours of the regions (see
+    `vector_tile_style`). Encoded tiles are kept in an `LRUCache`.
+
+    If ``rows`` is given, only the regions at these positions are included,
+    for subsets.
+    """
+
+    def __init__(self, data, rows=None, cache_bytes=TILE_CACHE_BYTES):
+        self.data = data
+        if rows is None:
+            self._selected = None
+        else:
+            self._selected = np.zeros(data.size, dtype=bool)
+            self._selected[rows] = True
+        self.cache = LRUCache(cache_bytes)
+
+    def tile_regions(self, z, x, y):
+        """
+        The positions in the data of the regions in tile ``(z, x, y)``, and
+        their geometries clipped to it in integer tile coordinates
+        """
+        bounds = tile_bounds(z, x, y, BUFFER)
+        rows = np.sort(self.data.spatial_index.query(shapely.box(*bounds)))
+        if self._selected is not None:
+            rows = rows[self._selected[rows]]
+        geometries = shapely.clip_by_rect(self.data.simplification.level(z)[rows], *bounds)
+
+        def to_tile(coords):
+            ux, uy = lonlat_to_unit(coords[:, 0], coords[:, 1])
+            return np.round(np.column_stack([(ux * 2 ** z - x), (uy * 2 ** z - y)]) * EXTENT)
+
+        geometries = shapely.transform(geometries, to_tile)
+        keep = ~shapely.is_empty(geometries)
+        return rows[keep], geometries[keep]
+
+    def __call__(self, z, x, y):
+        if not (0 <= z and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+        tile = self.cache.get((z, x, y))
+        if tile is None:
+            tile = encode_layer(*self.tile_regions(z, x, y))
+            self.cache.put((z, x, y), tile)
+        return tile or None
+
+
+def _base64(values, dtype):
+    return json.dumps(b64encode(np.asarray(values).astype(dtype).tobytes()).decode())
+
+
+def vector_tile_style(style, colors=None, selected=None):
+    """
+    The ``layer_styles`` of a VectorTileLayer of `RegionVectorTiles`
+
+    ``style`` is the Leaflet path style shared by all regions. ``colors``
+    are hex colours for every region of the data, which are looked up by
+    the ``id`` of each feature in the browser, with a JavaScript function
+    holding the distinct colours and the position of the colour of each
+    region among them. Likewise, if ``selected`` (a boolean mask of the
+    regions of the data) is given, only the selected regions are drawn, so
+    the layers of subsets share the tiles of their data. Changing the
+    colours or the selection only changes the style, not the tiles.
+    """
+    style = {"fill": True, **style}
+    if colors is None and selected is None:
+        return {LAYER_NAME: style}
+    declarations = [
+        f"var style = {json.dumps(style)};",
+        "function decode(text) { return Uint8Array.from(atob(text), function (c) { return c.charCodeAt(0); }); }",
+    ]
+    body = []
+    if selected is not None:
+        # One bit per region, the first region in the lowest bit
+        bits = np.packbits(np.asarray(selected, dtype=bool), bitorder="little")
+        declarations.append(f"var selected = decode({_base64(bits, '<u1')});")
+        body.append("if (!((selected[properties.id >> 3] >> (properties.id & 7)) & 1)) { return []; }")
+    if colors is None:
+        body.append("return style;")
+    else:
+        palette, index = np.unique(np.asarray(colors), return_inverse=True)
+        array, dtype = ("Uint8Array", "<u1") if len(palette) <= 256 else ("Uint16Array", "<u2")
+        declarations.append(f"var palette = {json.dumps(palette.tolist())};")
+        declarations.append(f"var index = new {array}(decode({_base64(index, dtype)}).buffer);")
+        body.append("var color = palette[index[properties.id]];")
+        body.append("return Object.assign({}, style, {fillColor: color, color: color});")
+    return (
+        "(function () {"
+        + "".join(declarations)
+        + f"return {{{json.dumps(LAYER_NAME)}: function (properties) {{"
+        + "".join(body)
+        + "}}; })()"
+    )
@@ -1,6 +1,6 @@
 import ipyleaflet
 import ipywidgets
-from glue.core.subset import roi_to_subset_state
+from glue.core.subset import Subset, roi_to_subset_state
 
 # from glue.logger import logger
 from glue.utils import color2hex
@@ -8,16 +8,19 @@ from glue_jupyter.link import dlink, link
 from glue_jupyter.utils import float_or_none
 from glue_jupyter.view import IPyWidgetView
 from glue_jupyter.widgets import Color, Size
-from ipywidgets import VBox
+from ipywidgets import HBox, VBox
 
 from .layer_artist import MapPointsLayerArtist, MapRegionLayerArtist, MapXarrayLayerArtist
 from .state import MapViewerState
 from .state_widgets.viewer_map import MapViewerStateWidget
 from .state_widgets.layer_map import MapLayerStateWidget
-from .utils import get_geom_type
+from .utils import Debounced, get_geom_type
 
 __all__ = ["IPyLeafletMapViewer"]
 
+# Seconds the map has to stay still before the layers are culled to its new bounds
+BOUNDS_DEBOUNCE = 0.2
+
 
 class SimpleColor(VBox):
     def __init__(self, state, **kwargs):
@@ -65,33 +68,38 @@ class PointsLayerStateWidget(VBox):
         # self.simple_color_widgets = SimpleColor(state=self.state)
         self.simple_size_widgets = SimpleSize(state=self.state)
 
+        self.widget_heatmap_weight = ipywidgets.Dropdown(
+            options=type(self.state).heatmap_weight.get_choice_labels(self.state),
+            description="weight",
+        )
+        link((self.state, "heatmap_weight"), (self.widget_heatmap_weight, "value"))
+
         self.widget_alpha = ipywidgets.FloatSlider(
             description="opacity", min=0, max=1, value=self.state.alpha
         )
         link((self.state, "alpha"), (self.widget_alpha, "value"))
 
-        # Only show full color_widget for Individual Points mode
-        dlink(
-            (self.widget_display_mode, "value"),
-            (self.color_widgets.layout, "display"),
-            lambda value: None if value == display_mode_options[1] else "none",
-        )
-        # Only show full size_widget for Individual Points mode
-        dlink(
-            (self.widget_display_mode, "value"),
-            (self.size_widgets.layout, "display"),
-            lambda value: None if value == display_mode_options[1] else "none",
-        )
+        # Only show full color_widget for Individual Points and Density Tiles
+        # modes, and full size_widget for Individual Points mode, or for the
+        # Heatmap when its weight comes from their attribute
+        self.state.add_callback("display_mode", self._update_attribute_widgets)
+        self.state.add_callback("heatmap_weight", self._update_attribute_widgets)
+        self._update_attribute_widgets()
 
         ## Only show simple color_widget for Individual Points mode
         # dlink((self.widget_display_mode, 'value'), (self.simple_color_widgets.layout, 'display'),
         #    lambda value: None if value == display_mode_options[0] else 'none')
 
-        # Only show simple size_widget for Individual Points mode
+        # Only show simple size_widget for Heatmap and Clustered modes
         dlink(
             (self.widget_display_mode, "value"),
             (self.simple_size_widgets.layout, "display"),
-            lambda value: None if value == display_mode_options[0] else "none",
+            lambda value: None if value in ("Heatmap", "Clustered") else "none",
+        )
+        dlink(
+            (self.widget_display_mode, "value"),
+            (self.widget_heatmap_weight.layout, "display"),
+            lambda value: None if value == "Heatmap" else "none",
         )
 
         super().__init__(
@@ -100,21 +108,41 @@ class PointsLayerStateWidget(VBox):
                 self.size_widgets,
                 self.color_widgets,
                 self.simple_size_widgets,
+                self.widget_heatmap_weight,
                 self.widget_alpha,
             ]
         )
 
+    def _update_attribute_widgets(self, *args):
+        mode = self.state.display_mode
+        heatmap = mode == "Heatmap"
+        show_color = mode in ("Individual Points", "Density Tiles") or (
+            heatmap and self.state.heatmap_weight == "Color attribute"
+        )
+        show_size = mode == "Individual Points" or (heatmap and self.state.heatmap_weight == "Size attribute")
+        self.color_widgets.layout.display = None if show_color else "none"
+        self.size_widgets.layout.display = None if show_size else "none"
+
 
 class RegionLayerStateWidget(VBox):
     def __init__(self, layer_state):
         self.state = layer_state
+
+        display_mode_options = type(self.state).display_mode.get_choice_labels(
+            self.state
+        )
+        self.widget_display_mode = ipywidgets.RadioButtons(
+            options=display_mode_options, description="display mode"
+        )
+        link((self.state, "display_mode"), (self.widget_display_mode, "value"))
+
         self.color_widgets = Color(state=self.state)
         self.widget_alpha = ipywidgets.FloatSlider(
             description="opacity", min=0, max=1, value=self.state.alpha
         )
         link((self.state, "alpha"), (self.widget_alpha, "value"))
 
-        super().__init__([self.color_widgets, self.widget_alpha])
+        super().__init__([self.widget_display_mode, self.color_widgets, self.widget_alpha])
 
 
 class XarrayLayerStateWidget(VBox):
@@ -126,7 +154,44 @@ class XarrayLayerStateWidget(VBox):
         )
         link((self.state, "alpha"), (self.widget_alpha, "value"))
 
-        super().__init__([self.color_widgets, self.widget_alpha])
+        self.widget_t = ipywidgets.IntSlider(
+            description="time", min=0, max=self.state.t_max, value=self.state.t
+        )
+        dlink((self.state, "t_max"), (self.widget_t, "max"))
+        link((self.state, "t"), (self.widget_t, "value"))
+
+        self.widget_playing = ipywidgets.ToggleButton(
+            description="play", icon="play", value=self.state.playing
+        )
+        link((self.state, "playing"), (self.widget_playing, "value"))
+        self.widget_fps = ipywidgets.IntSlider(
+            description="fps", min=1, max=30, value=self.state.fps
+        )
+        link((self.state, "fps"), (self.widget_fps, "value"))
+
+        quality_flag_options = type(self.state).quality_flag.get_choice_labels(
+            self.state
+        )
+        self.widget_quality_flag = ipywidgets.Dropdown(
+            options=quality_flag_options, description="quality"
+        )
+        link((self.state, "quality_flag"), (self.widget_quality_flag, "value"))
+
+        # Only show the quality level for data that carries a quality class
+        layer = self.state.layer
+        data = layer.data if isinstance(layer, Subset) else layer
+        if getattr(data, "quality", None) is None:
+            self.widget_quality_flag.layout.display = "none"
+
+        super().__init__(
+            [
+                self.color_widgets,
+                self.widget_alpha,
+                self.widget_t,
+                HBox([self.widget_playing, self.widget_fps]),
+                self.widget_quality_flag,
+            ]
+        )
 
 
 class IPyLeafletMapViewer(IPyWidgetView):
@@ -163,6 +228,10 @@ class IPyLeafletMapViewer(IPyWidgetView):
 
         link((self.state, "zoom_level"), (self.map, "zoom"), float_or_none)
         link((self.state, "center"), (self.map, "center"))
+        # Bounds are reported continuously while the map is dragged, so the
+        # layers are only told about them once the map has settled
+        self._update_bounds = Debounced(self._set_bounds, BOUNDS_DEBOUNCE)
+        self.map.observe(self._on_map_bounds_change, names="bounds")
 
         self.state.add_global_callback(self._update_map)
         self._update_map(force=True)
@@ -171,6 +240,12 @@ class IPyLeafletMapViewer(IPyWidgetView):
     def _initialize_map(self):
         self.map = ipyleaflet.Map(basemap=self.state.basemap, prefer_canvas=True)
 
+    def _on_map_bounds_change(self, change):
+        self._update_bounds(change["new"])
+
+    def _set_bounds(self, bounds):
+        self.state.bounds = tuple(tuple(corner) for corner in bounds) if bounds else None
+
     def _update_map(self, force=False, **kwargs):
         if force or "basemap" in kwargs:
             pass  # Change basemap
@@ -180,11 +255,12 @@ class IPyLeafletMapViewer(IPyWidgetView):
         return cls(self.map, self.state, layer=layer, layer_state=layer_state)
 
     def get_data_layer_artist(self, layer=None, layer_state=None):
-        if get_geom_type(layer) == "regions":
+        geom_type = get_geom_type(layer)
+        if geom_type == "regions":
             cls = MapRegionLayerArtist
-        elif get_geom_type(layer) == "points":
+        elif geom_type == "points":
             cls = MapPointsLayerArtist
-        elif get_geom_type(layer) == "xarray":
+        elif geom_type == "xarray":
             cls = MapXarrayLayerArtist
         else:
             raise ValueError(
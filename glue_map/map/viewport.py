@@ -0,0 +1,134 @@
+"""
+Culling of map layers to the part of the map that is on screen.
+
+Bounds are given the way ipyleaflet reports them, as
+``((south, west), (north, east))`` in degrees. The longitudes can run past
++/-180 when the map has been panned around the world.
+"""
+import numpy as np
+from shapely.geometry import box
+
+from .tiles import MAX_LEVEL, _interleave, lonlat_to_unit, quadtree_codes
+
+__all__ = ["expand_bounds", "bounds_contain", "points_in_bounds", "PointViewportIndex", "region_viewport_indices"]
+
+# Features are sent for the viewport grown by this fraction of its size on
+# every side, so that small pans do not need an update
+VIEWPORT_MARGIN = 0.5
+
+
+def expand_bounds(bounds, margin=VIEWPORT_MARGIN):
+    """
+    Grow ``bounds`` by ``margin`` times its height and width on every side
+    """
+    (south, west), (north, east) = bounds
+    dlat = (north - south) * margin
+    dlon = (east - west) * margin
+    return (max(south - dlat, -90.0), west - dlon), (min(north + dlat, 90.0), east + dlon)
+
+
+def bounds_contain(outer, inner):
+    """
+    Whether ``inner`` lies entirely within ``outer``
+    """
+    (s0, w0), (n0, e0) = outer
+    (s1, w1), (n1, e1) = inner
+    if e0 - w0 >= 360:
+        return s0 <= s1 and n1 <= n0
+    return s0 <= s1 and n1 <= n0 and w0 <= w1 and e1 <= e0
+
+
+def lon_ranges(west, east):
+    """
+    Split the longitudes from ``west`` to ``east`` into ranges within [-180, 180]
+    """
+    if east - west >= 360:
+        return [(-180.0, 180.0)]
+    width = east - west
+    west = (west + 180) % 360 - 180
+    east = west + width
+    if east <= 180:
+        return [(west, east)]
+    return [(west, 180.0), (-180.0, east - 360)]
+
+
+def points_in_bounds(lat, lon, bounds):
+    """
+    A mask of the points within ``bounds``, for arrays too small to need an index
+    """
+    (south, west), (north, east) = bounds
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    within_lon = np.zeros(lon.shape, dtype=bool)
+    for lon_min, lon_max in lon_ranges(west, east):
+        within_lon |= (lon >= lon_min) & (lon <= lon_max)
+    return within_lon & (lat >= south) & (lat <= north)
+
+
+class PointViewportIndex:
+    """
+    Find the points within a latitude/longitude box
+
+    The points are sorted along a quadtree curve once, when the index is
+    built, like `PointDensityTiles`. A query picks the zoom level at which
+    the box spans at most two tiles in each direction, so the candidates are
+    a few contiguous slices of the sorted points, which are then filtered
+    exactly.
+    """
+
+    def __init__(self, lat, lon):
+        lat = np.asarray(lat, dtype=float).ravel()
+        lon = np.asarray(lon, dtype=float).ravel()
+        keep = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        codes = quadtree_codes(lon[keep], lat[keep])
+        order = np.argsort(codes, kind="stable")
+        self._codes = codes[order]
+        self._index = keep[order]
+        self._lat = lat[self._index]
+        self._lon = lon[self._index]
+
+    def __len__(self):
+        return len(self._codes)
+
+    def _candidates(self, south, west, north, east):
+        x0, y1 = lonlat_to_unit(west, south)
+        x1, y0 = lonlat_to_unit(east, north)
+        extent = max(x1 - x0, y1 - y0, 2.0 ** -MAX_LEVEL)
+        z = int(np.clip(np.floor(-np.log2(extent)), 0, MAX_LEVEL))
+        n = 2 ** z
+        tx = np.arange(int(np.clip(x0 * n, 0, n - 1)), int(np.clip(x1 * n, 0, n - 1)) + 1)
+        ty = np.arange(int(np.clip(y0 * n, 0, n - 1)), int(np.clip(y1 * n, 0, n - 1)) + 1)
+        tiles = (_interleave(tx)[:, None] | (_interleave(ty)[None, :] << np.uint64(1))).ravel()
+        shift = np.uint64(2 * (MAX_LEVEL - z))
+        starts = np.searchsorted(self._codes, tiles << shift)
+        stops = np.searchsorted(self._codes, (tiles + np.uint64(1)) << shift)
+        return np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)])
+
+    def query(self, bounds):
+        """
+        The sorted indices (into the arrays the index was built from) of the
+        finite points within ``bounds``
+        """
+        (south, west), (north, east) = bounds
+        found = []
+        for lon_min, lon_max in lon_ranges(west, east):
+            candidates = self._candidates(south, lon_min, north, lon_max)
+            lat = self._lat[candidates]
+            lon = self._lon[candidates]
+            inside = (lat >= south) & (lat <= north) & (lon >= lon_min) & (lon <= lon_max)
+            found.append(self._index[candidates[inside]])
+        return np.unique(np.concatenate(found))
+
+
+def region_viewport_indices(spatial_index, bounds):
+    """
+    The sorted positions of the geometries whose bounding boxes intersect
+    ``bounds``, found with their ``spatial_index`` (a `shapely.STRtree`, or
+    the ``sindex`` of a GeoDataFrame)
+    """
+    (south, west), (north, east) = bounds
+    found = [
+        spatial_index.query(box(lon_min, south, lon_max, north))
+        for lon_min, lon_max in lon_ranges(west, east)
+    ]
+    return np.unique(np.concatenate(found))
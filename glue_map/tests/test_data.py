@@ -1,10 +1,65 @@
+import gc
+import os
+import shutil
+import tracemalloc
+
+import dask
+import dask.array as da
 import geopandas
+import h5py
 import numpy as np
 import pytest
+import shapely
+import xarray as xr
 from geopandas.testing import assert_geodataframe_equal
 from glue.core.subset import ElementSubsetState
 
-from ..data import GeoRegionData, InvalidGeoData
+from ..data import (
+    GeoPandasTranslator,
+    GeoRegionData,
+    InvalidGeoData,
+    SimplificationPyramid,
+    XarrayCoordinates,
+    XarrayData,
+    append_tempo_data,
+    load_tempo_data,
+    tempo_quality_mask,
+)
+
+
+def make_tempo_granule(path, hour, nlat=20, nlon=30):
+    """
+    Write a tiny file with the same group layout as a TEMPO NO2 L3 granule
+    """
+    rng = np.random.default_rng(hour)
+    dims = ("time", "latitude", "longitude")
+    shape = (1, nlat, nlon)
+    coords = xr.Dataset(
+        coords={
+            "time": ("time", [float(hour)]),
+            "latitude": ("latitude", np.linspace(20, 50, nlat)),
+            "longitude": ("longitude", np.linspace(-120, -70, nlon)),
+        }
+    )
+    coords.to_netcdf(path, engine="h5netcdf")
+    groups = {
+        "product": {
+            "vertical_column_troposphere": rng.random(shape) * 1e16,
+            "main_data_quality_flag": rng.integers(0, 2, shape).astype("i2"),
+        },
+        "geolocation": {"solar_zenith_angle": rng.random(shape) * 100},
+        "support_data": {"eff_cloud_fraction": rng.random(shape)},
+    }
+    for group, variables in groups.items():
+        ds = xr.Dataset({name: (dims, values) for name, values in variables.items()})
+        ds.to_netcdf(path, mode="a", group=group, engine="h5netcdf")
+
+
+@pytest.fixture
+def tempo_dir(tmp_path):
+    for hour in range(3):
+        make_tempo_granule(tmp_path / f"TEMPO_NO2_L3_V01_20230801T{hour:02d}00Z_S00{hour}.nc", hour)
+    return tmp_path
 
 
 @pytest.fixture
@@ -38,6 +93,31 @@ def test_creation(nycbb):
     assert len(nycbb.components) == 8
 
 
+@pytest.mark.parametrize("anchor", ["representative_point", "centroid", "bbox_center"])
+def test_lazy_anchors(gdf, anchor):
+    nycbb = GeoRegionData(gdf, "nyc_boroughs", anchor=anchor)
+    assert nycbb.anchors._points is None
+    lat_cid, lon_cid = nycbb._centroid_component_ids
+    assert nycbb.get_component(lat_cid).shape == (5,)
+    assert nycbb.anchors._points is None
+
+    if anchor == "representative_point":
+        expected = gdf.representative_point()
+    elif anchor == "centroid":
+        expected = gdf.centroid
+    else:
+        expected = geopandas.GeoSeries.from_xy((gdf.bounds.minx + gdf.bounds.maxx) / 2,
+                                               (gdf.bounds.miny + gdf.bounds.maxy) / 2)
+    np.testing.assert_allclose(nycbb[lon_cid], expected.x)
+    np.testing.assert_allclose(nycbb[lat_cid], expected.y)
+    assert nycbb.centroids is nycbb.anchors.points
+
+
+def test_bad_anchor(gdf):
+    with pytest.raises(ValueError):
+        GeoRegionData(gdf, "nyc_boroughs", anchor="middle")
+
+
 def test_error_on_bad_creation():
     not_geo_data = np.array(([1, 2, 3], [3, 4, 5]))
     with pytest.raises(InvalidGeoData):
@@ -64,3 +144,259 @@ def test_get_mask_element_subset_state(nycbb, gdf):
     # print(hand_subset)
     assert_geodataframe_equal(auto_subset, hand_subset)
     # assert hand_subset ==
+
+
+def test_geometry_round_trip(earthdata):
+    geometry = earthdata.get_component("geometry")
+    assert isinstance(geometry.data[0], bytes)
+    gdf = geopandas.read_file(geopandas.datasets.get_path("naturalearth_lowres"))
+    auto_gdf = earthdata.get_object(cls=geopandas.GeoDataFrame)
+    assert auto_gdf.geometry.geom_equals_exact(gdf.geometry, tolerance=0).all()
+
+
+def test_geodataframe_cache(nycbb, gdf):
+    translator = GeoPandasTranslator()
+    first = translator.to_object(nycbb)
+    assert translator._to_geodataframe(nycbb) is translator._to_geodataframe(nycbb)
+
+    # Adding columns to the returned frame does not touch the cache
+    first["extra"] = 1
+    assert "extra" not in translator.to_object(nycbb)
+
+    subset = nycbb.new_subset()
+    subset.subset_state = ElementSubsetState(indices=[0, 3])
+    assert_geodataframe_equal(translator.to_object(subset), gdf.iloc[[0, 3]].reset_index(drop=True))
+
+    nycbb.add_component(np.arange(5), label="rank")
+    assert list(translator.to_object(subset)["rank"]) == [0, 3]
+
+    nycbb.update_components({nycbb.id["rank"]: np.arange(5) * 10})
+    assert list(translator.to_object(nycbb)["rank"]) == [0, 10, 20, 30, 40]
+
+
+def test_geom_type_follows_geometry(nycbb, gdf):
+    assert nycbb.geom_type == "regions"
+    # Replacing the geometry column (here with the centroid of each borough)
+    # is picked up
+    nycbb.update_components({nycbb.id["geometry"]: gdf.geometry.centroid.to_wkb().values})
+    assert nycbb.geom_type == "points"
+
+
+def test_simplification_pyramid(nycbb, gdf):
+    pyramid = nycbb.simplification
+    assert pyramid is nycbb.simplification
+    # The boroughs share borders, and are in feet, so the tolerance is scaled
+    assert pyramid.is_coverage
+    assert pyramid.tolerance(0) > 1000 * pyramid.tolerance(5)
+
+    n_coordinates = [shapely.get_num_coordinates(pyramid.level(zoom)).sum() for zoom in (0, 4, 8, 12, 20)]
+    assert n_coordinates == sorted(n_coordinates)
+    assert n_coordinates[0] < n_coordinates[-1] / 50
+    assert n_coordinates[-1] == shapely.get_num_coordinates(gdf.geometry.values).sum()
+    assert pyramid.level(4) is pyramid.level(5)
+    assert pyramid.level(20) is pyramid.geometry
+
+    # Simplified boroughs keep their shape to within a couple of pixels
+    original = np.asarray(gdf.geometry.values)
+    for zoom in (4, 8):
+        simplified = pyramid.level(zoom)
+        tolerance = pyramid.tolerance(pyramid.band(zoom))
+        assert (shapely.hausdorff_distance(simplified, original) <= tolerance * 4).all()
+    assert shapely.is_valid(simplified).all()
+
+    nycbb.add_component(np.arange(5), label="rank")
+    assert nycbb.simplification is not pyramid
+
+
+def test_simplification_pyramid_without_coverage_simplify(nycbb, gdf, monkeypatch):
+    # Older shapely and GEOS simplify the boroughs one by one
+    monkeypatch.setattr("glue_map.data.HAS_COVERAGE_SIMPLIFY", False)
+    pyramid = SimplificationPyramid(gdf.geometry.values, gdf.crs)
+    assert not pyramid.is_coverage
+    simplified = pyramid.level(4)
+    assert shapely.get_num_coordinates(simplified).sum() < shapely.get_num_coordinates(pyramid.geometry).sum()
+    assert shapely.is_valid(simplified).all()
+
+
+def test_load_tempo_data_parallel(tempo_dir):
+    serial = load_tempo_data(tempo_dir, max_workers=1)
+    parallel = load_tempo_data(tempo_dir, max_workers=2)
+    assert parallel.shape == (3, 20, 30)
+    assert len(parallel.meta["tempo_load_times"]) == 3
+    # The granules are opened lazily, and only read when they are used
+    assert isinstance(parallel.xarr.data, da.Array)
+    assert isinstance(parallel.quality.data, da.Array)
+    np.testing.assert_allclose(parallel.xarr.values, serial.xarr.values)
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_load_tempo_data_cache_parallel(tempo_dir, tmp_path_factory, use_processes):
+    serial = load_tempo_data(tempo_dir, max_workers=1)
+    gc.collect()
+    open_files = len(h5py.h5f.get_obj_ids(types=h5py.h5f.OBJ_FILE))
+    cached = load_tempo_data(tempo_dir, max_workers=2, use_processes=use_processes,
+                             cache_dir=tmp_path_factory.mktemp("cache"))
+    np.testing.assert_allclose(cached.xarr.values, serial.xarr.values)
+    np.testing.assert_array_equal(cached.quality.values, serial.quality.values)
+    np.testing.assert_array_equal(cached.xarr.coords["time"], serial.xarr.coords["time"])
+    # The granules written to the cache were closed
+    assert len(h5py.h5f.get_obj_ids(types=h5py.h5f.OBJ_FILE)) == open_files
+
+
+def test_load_tempo_data_cache(tempo_dir, tmp_path_factory):
+    cache_dir = tmp_path_factory.mktemp("cache")
+    cold = load_tempo_data(tempo_dir, cache_dir=cache_dir)
+    warm = load_tempo_data(tempo_dir, cache_dir=cache_dir)
+    assert warm.meta["tempo_cache"] == cold.meta["tempo_cache"]
+    assert "tempo_load_times" not in warm.meta
+    assert [cid.label for cid in warm.components] == [cid.label for cid in cold.components]
+    np.testing.assert_allclose(warm.xarr.values, cold.xarr.values)
+
+    # The cache holds the unmasked product so it is shared by all quality levels,
+    # but a newly arrived granule gives a new cache entry
+    low = load_tempo_data(tempo_dir, quality_flag="low", cache_dir=cache_dir)
+    assert low.meta["tempo_cache"] == cold.meta["tempo_cache"]
+    assert low.quality_flag == "low"
+    make_tempo_granule(tempo_dir / "TEMPO_NO2_L3_V01_20230801T0300Z_S003.nc", 3)
+    updated = load_tempo_data(tempo_dir, cache_dir=cache_dir)
+    assert updated.meta["tempo_cache"] != cold.meta["tempo_cache"]
+    assert updated.shape == (4, 20, 30)
+
+
+def test_load_tempo_data_cache_race(tempo_dir, tmp_path_factory, monkeypatch):
+    # When another process writes the same cube first, its copy is kept
+    winner = load_tempo_data(tempo_dir, cache_dir=tmp_path_factory.mktemp("winner"))
+    cache_dir = tmp_path_factory.mktemp("cache")
+    replace = os.replace
+
+    def lose_race(src, dst, **kwargs):
+        if str(src).endswith(".zarr.tmp"):
+            shutil.copytree(winner.meta["tempo_cache"], dst)
+        replace(src, dst, **kwargs)
+
+    monkeypatch.setattr(os, "replace", lose_race)
+    data = load_tempo_data(tempo_dir, cache_dir=cache_dir)
+    assert os.listdir(cache_dir) == [os.path.basename(data.meta["tempo_cache"])]
+    np.testing.assert_allclose(data.xarr.values, winner.xarr.values)
+
+
+def test_load_tempo_data_cache_pruning(tempo_dir, tmp_path_factory, monkeypatch):
+    monkeypatch.setattr("glue_map.data.TEMPO_CACHE_ENTRIES", 1)
+    cache_dir = tmp_path_factory.mktemp("cache")
+    old = load_tempo_data(tempo_dir, cache_dir=cache_dir)
+    old_path = old.meta["tempo_cache"]
+    make_tempo_granule(tempo_dir / "TEMPO_NO2_L3_V01_20230801T0300Z_S003.nc", 3)
+    new = load_tempo_data(tempo_dir, cache_dir=cache_dir)
+    # The old store is still being read from
+    assert os.path.exists(old_path)
+    assert old.xarr.values.shape == (3, 20, 30)
+
+    # Once nothing reads from it, it is removed, along with stale temporary stores
+    del old
+    gc.collect()
+    stale = cache_dir / "stale.zarr.tmp"
+    stale.mkdir()
+    os.utime(stale, (0, 0))
+    fresh = cache_dir / "fresh.zarr.tmp"
+    fresh.mkdir()
+    make_tempo_granule(tempo_dir / "TEMPO_NO2_L3_V01_20230801T0400Z_S004.nc", 4)
+    newest = load_tempo_data(tempo_dir, cache_dir=cache_dir)
+    assert not os.path.exists(old_path)
+    assert sorted(os.listdir(cache_dir)) == sorted([
+        "fresh.zarr.tmp",
+        os.path.basename(new.meta["tempo_cache"]),
+        os.path.basename(newest.meta["tempo_cache"]),
+    ])
+
+
+@pytest.mark.parametrize("quality_flag,max_cloud_fraction", [("high", 0.2), ("medium", 0.4), ("low", np.inf)])
+def test_tempo_quality_mask(tempo_dir, quality_flag, max_cloud_fraction):
+    data = load_tempo_data(tempo_dir, quality_flag=quality_flag)
+    assert data.quality_flag == quality_flag
+    assert data.quality.dtype == np.uint8
+
+    files = sorted(tempo_dir.glob("*.nc"))
+    sza = np.concatenate([xr.open_dataset(f, group="geolocation")["solar_zenith_angle"].values for f in files])
+    flag = np.concatenate([xr.open_dataset(f, group="product")["main_data_quality_flag"].values for f in files])
+    cloud = np.concatenate([xr.open_dataset(f, group="support_data")["eff_cloud_fraction"].values for f in files])
+    expected = (sza < 80) & (flag == 0) & (cloud < max_cloud_fraction)
+    np.testing.assert_array_equal(tempo_quality_mask(data.quality.values, quality_flag), expected)
+    # The product itself is not masked
+    assert not np.isnan(data.xarr.values).any()
+
+
+def test_append_tempo_data(tempo_dir):
+    data = load_tempo_data(tempo_dir)
+    cids = list(data.components)
+    assert append_tempo_data(data, tempo_dir) == []
+
+    new_file = tempo_dir / "TEMPO_NO2_L3_V01_20230801T0300Z_S003.nc"
+    make_tempo_granule(new_file, 3)
+    assert append_tempo_data(data, tempo_dir) == [str(new_file)]
+    assert data.shape == (4, 20, 30)
+    assert list(data.components) == cids
+    assert data.quality.shape == (4, 20, 30)
+
+    reloaded = load_tempo_data(tempo_dir)
+    np.testing.assert_allclose(data.xarr.values, reloaded.xarr.values)
+    np.testing.assert_array_equal(data[data.main_components[0]], reloaded[reloaded.main_components[0]])
+
+
+def test_xarray_data_browse_memory_bounded():
+    # A 128 MB cube with one 8 MB chunk per time step. Browsing it slice by
+    # slice and computing full-cube statistics should only ever hold a few
+    # chunks in memory (tracemalloc sees numpy's buffers, so its peak is a
+    # proxy for the growth in RSS).
+    nt, ny, nx = 16, 1000, 1000
+    cube = da.random.RandomState(0).random_sample((nt, ny, nx), chunks=(1, ny, nx))
+    xarr = xr.DataArray(cube, name="no2", dims=("time", "latitude", "longitude"),
+                        coords={"time": np.arange(nt), "latitude": np.linspace(20, 50, ny),
+                                "longitude": np.linspace(-120, -70, nx)})
+    data = XarrayData(xarr, label="cube", coords=XarrayCoordinates(xarr, n_dim=3))
+    cid = data.id["no2"]
+    chunk_bytes = ny * nx * 8
+
+    with dask.config.set(scheduler="synchronous"):
+        tracemalloc.start()
+        try:
+            for t in range(nt):
+                assert data[cid, (t, slice(None), slice(None))].shape == (ny, nx)
+            vmin = data.compute_statistic("minimum", cid)
+            vmax = data.compute_statistic("maximum", cid)
+            means = data.compute_statistic("mean", cid, axis=(1, 2))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    assert 0 <= vmin < vmax <= 1
+    assert means.shape == (nt,)
+    assert peak < 4 * chunk_bytes
+
+
+@pytest.mark.parametrize("latitude", [np.linspace(50, 20, 31), np.geomspace(1, 60, 31)])
+def test_xarray_coordinates(latitude):
+    longitude = np.linspace(-120, -70, 51)
+    xarr = xr.DataArray(np.zeros((4, 31, 51)), name="no2", dims=("time", "latitude", "longitude"),
+                        coords={"time": np.arange(4), "latitude": latitude, "longitude": longitude})
+    coords = XarrayCoordinates(xarr, n_dim=3)
+    assert coords.world_axis_names == ["longitude", "latitude", "time"]
+    # Regular axes take the affine path
+    assert coords._affine[0] is not None
+    assert (coords._affine[1] is not None) == (latitude[1] - latitude[0] == latitude[2] - latitude[1])
+
+    x, y, t = np.meshgrid(np.arange(51.), np.arange(31.), np.arange(4.), indexing="ij")
+    lon, lat, time = coords.pixel_to_world_values(x, y, t)
+    np.testing.assert_allclose(lon, longitude[x.astype(int)])
+    np.testing.assert_allclose(lat, latitude[y.astype(int)])
+    np.testing.assert_allclose(time, t)
+
+    # Between pixel centres the transform is piecewise linear, and it inverts
+    y_frac = np.linspace(0, 30, 1001)
+    _, lat_frac, _ = coords.pixel_to_world_values(0, y_frac, 0)
+    np.testing.assert_allclose(lat_frac, np.interp(y_frac, np.arange(31), latitude))
+    _, y_back, _ = coords.world_to_pixel_values(-100, lat_frac, 0)
+    np.testing.assert_allclose(y_back, y_frac, atol=1e-9)
+
+    data = XarrayData(xarr, label="cube", coords=coords)
+    np.testing.assert_allclose(data[data.id["Latitude"]][0, :, 0], latitude)
+    np.testing.assert_allclose(data[data.id["Longitude"]][0, 0, :], longitude)